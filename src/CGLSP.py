@@ -1,18 +1,37 @@
 
-from src.bnb_tree import BnB_Tree
+from src.bnb_tree import (BnB_Tree, DEFAULT_CHECKPOINT_INTERVAL,
+                          SOLVE_STATUS_OPTIMAL, SEARCH_LIMIT_STATUSES,
+                          BRANCHING_RULE_CARPANETO_TOTH, BRANCHING_RULES,
+                          get_optimality_gap)
+from src.parallel_bnb_tree import Parallel_BnB_Tree
+from src.MAP_solver import MAP_SOLVERS
 from src.instance_parser import get_CGLSP_instance_cost_matrix
-import sys
+from src.preprocessing import Instance_Reduction
+from src.additive_bounds import (ADDITIVE_BOUND_PROCEDURES,
+                                 DEFAULT_ADDITIVE_BOUNDS)
+import argparse
 import time
 from pathlib import Path
 import numpy as np
 
-# ensure cost matrices are printed to the console nicely by increasing the line
-# width for printing numpy arrays
-np.set_printoptions(precision=2, suppress=True, linewidth=100)
+# the numpy print options of the cost matrices printed to the console (set only
+# while printing them, so concurrent solves don't share global print state)
+COST_MATRIX_PRINT_OPTIONS = {"precision": 2, "suppress": True, "linewidth": 100}
 
 
 class CGLSP:
-    def __init__(self, problem_instance, problem_type, update_frequency):
+    def __init__(self, problem_instance, problem_type, update_frequency,
+                 MAP_solver="jv", subtour_patching=True,
+                 patching_local_search=False, ACO_time_limit=0, num_workers=1,
+                 concurrent_heuristic=False, max_nodes_in_memory=None,
+                 spill_directory=None, checkpoint_path=None,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, resume=False,
+                 time_limit=None, node_limit=None, memory_limit=None, epsilon=0,
+                 progress_callback=None, trace_path=None, collect_metrics=False,
+                 instance_name=None, log_results=True, preprocessing=True,
+                 arc_elimination=True,
+                 branching_rule=BRANCHING_RULE_CARPANETO_TOTH,
+                 additive_bounds=DEFAULT_ADDITIVE_BOUNDS):
 
         if problem_type == "CGLSP":
             root_cost_matrix = get_CGLSP_instance_cost_matrix(
@@ -26,24 +45,93 @@ class CGLSP:
             self.num_coils = instance_size - 1
         else:
             self.num_coils = instance_size
-        self.bnb_tree = BnB_Tree(root_cost_matrix, instance_size, update_frequency)
+
+        # the branch and bound solves the instance reduced by the preprocessing
+        # (see preprocessing.py), whose solutions are expanded back into solutions
+        # of the instance
+        self.instance_reduction = None
+        search_cost_matrix = root_cost_matrix
+        if preprocessing:
+            self.instance_reduction = Instance_Reduction(root_cost_matrix)
+            search_cost_matrix = self.instance_reduction.cost_matrix
+        search_instance_size = search_cost_matrix.shape[0]
+
+        tree_options = {
+            "MAP_solver": MAP_solver,
+            "subtour_patching": subtour_patching,
+            "patching_local_search": patching_local_search,
+            "ACO_time_limit": ACO_time_limit,
+            "max_nodes_in_memory": max_nodes_in_memory,
+            "spill_directory": spill_directory,
+            "epsilon": epsilon,
+            "arc_elimination": arc_elimination,
+            "branching_rule": branching_rule,
+            "additive_bounds": additive_bounds,
+        }
+        # with more than one worker, the branch and bound search runs in parallel
+        # in num_workers processes
+        if num_workers > 1:
+            self.bnb_tree = Parallel_BnB_Tree(search_cost_matrix,
+                                              search_instance_size,
+                                              update_frequency, num_workers,
+                                              **tree_options)
+        # a sequential search can run an improvement heuristic in a separate
+        # process alongside it, can be checkpointed and resumed, can be
+        # stopped by time, node and memory limits, and reports its metrics
+        else:
+            self.bnb_tree = BnB_Tree(search_cost_matrix, search_instance_size,
+                                     update_frequency,
+                                     concurrent_heuristic=concurrent_heuristic,
+                                     checkpoint_path=checkpoint_path,
+                                     checkpoint_interval=checkpoint_interval,
+                                     resume=resume,
+                                     time_limit=time_limit,
+                                     node_limit=node_limit,
+                                     memory_limit=memory_limit,
+                                     progress_callback=progress_callback,
+                                     trace_path=trace_path,
+                                     collect_metrics=collect_metrics,
+                                     **tree_options)
         self.min_cost = np.inf
         self.optimal_solution = []
         self.problem_type = problem_type
 
+        # the name of the instance in the results, by default the instance solved
+        # by the command line interface for the problem type
+        if instance_name is None:
+            instance_name = "br17" if problem_type == "TSPLIB" else "cgl_17"
+        self.instance_name = instance_name
+        # whether solve writes the result to the results csv file of the problem
+        # type (batch solves collect the results themselves, see batch.py)
+        self.log_results = log_results
+
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.memory_limit = memory_limit
+        self.epsilon = epsilon
+
         if problem_type == "CGLSP":
             dashed_line = "-" * 80
             print(dashed_line)
             print(f"Solving CGLSP instance with {self.num_coils} coils \n")
             print("The cost matrix for this instance is: ")
-            print(root_cost_matrix)
+            with np.printoptions(**COST_MATRIX_PRINT_OPTIONS):
+                print(root_cost_matrix)
 
         elif problem_type == "TSPLIB":
             dashed_line = "-" * 80
             print(dashed_line)
             print(f"Solving TSPLIB ASTP instance with {self.num_coils} cities \n")
             print("The cost matrix for this instance is: \n")
-            print(root_cost_matrix)
+            with np.printoptions(**COST_MATRIX_PRINT_OPTIONS):
+                print(root_cost_matrix)
+
+        if self.instance_reduction is not None:
+            print()
+            self.instance_reduction.print_summary()
+            if self.instance_reduction.fixed_cost:
+                print("(the costs reported during the search exclude the fixed "
+                      "cost)")
 
     def solve(self):
 
@@ -52,24 +140,44 @@ class CGLSP:
         end = time.time()
         self.solve_time = end - start
 
-        self.optimal_sequence = [edge[0] for edge in self.optimal_solution]
-
-        # 0 job is dummy node in graph, remove it in final solution to
-        # obtain actual sequence of coils
-        if self.problem_type == "CGLSP":
-            self.optimal_sequence.remove(0)
-
-        # min cost of -1 is returned when there are no feasible solutions to CGLSP
+        # an infinite min cost is returned when there are no feasible solutions to
+        # CGLSP
         # (Although for the Spansh CGLSP problem instances
         # the authors gaurantee that all instances have a solution)
 
         # In general though, a CGLSP instance may not have feasible solutions
-        if self.min_cost == -1:
+        # (if the search was stopped by a limit, a solution may just not have been
+        # found yet)
+        self.solve_status = self.bnb_tree.solve_status
+        self.lower_bound = self.bnb_tree.lower_bound
+        self.optimality_gap = self.bnb_tree.optimality_gap
+
+        # the costs and the solution of the reduced instance, as costs and a
+        # solution of the instance
+        if self.instance_reduction is not None:
+            self.min_cost = self.instance_reduction.expand_cost(self.min_cost)
+            self.lower_bound = self.instance_reduction.expand_cost(
+                self.lower_bound)
+            self.optimality_gap = get_optimality_gap(self.min_cost,
+                                                     self.lower_bound)
+            self.optimal_solution = self.instance_reduction.expand_solution(
+                self.optimal_solution)
+
+        if (self.min_cost == np.inf
+                and self.solve_status not in SEARCH_LIMIT_STATUSES):
             raise InfeasibleCGLSPInstanceException(
                 " There are no feasible solutions for this CGLSP instance"
             )
 
-        self.log_result()
+        self.optimal_sequence = [edge[0] for edge in self.optimal_solution]
+
+        # 0 job is dummy node in graph, remove it in final solution to
+        # obtain actual sequence of coils
+        if self.problem_type == "CGLSP" and self.optimal_sequence:
+            self.optimal_sequence.remove(0)
+
+        if self.log_results:
+            self.log_result()
 
         return self.min_cost, self.optimal_sequence, self.solve_time
 
@@ -80,23 +188,18 @@ class CGLSP:
         subdirectory = "results"
         Path(subdirectory).mkdir(parents=True, exist_ok=True)
 
+        # one results file per instance, e.g. CGLSP_17.csv for cgl_17 and
+        # TSPLIB_ATSP_br17.csv for br17
         if self.problem_type == "TSPLIB":
-            file_name = "TSPLIB_ATSP_br17.csv"
-            problem_instance = "br17"
+            file_name = f"TSPLIB_ATSP_{self.instance_name}.csv"
 
         elif self.problem_type == "CGLSP":
-            file_name = "CGLSP_17.csv"
-            problem_instance = "cgl_17"
+            file_name = f"CGLSP_{self.instance_name.removeprefix('cgl_')}.csv"
 
         # Path to the CSV file
         csv_file_path = Path(subdirectory) / file_name
 
-        result = {"Problem Instance": problem_instance,
-                  "# Coils to sequence": self.num_coils,
-                  "Min Cost": self.min_cost,
-                  "Optimal Sequence": self.optimal_sequence,
-                  "Solve Time (s)": round(self.solve_time, 4),
-                  "# Explored Subproblems": self.bnb_tree.explored_subproblems}
+        result = self.get_result()
 
         # Write the result to the CSV file
         with csv_file_path.open(mode="w", newline="") as csv_file:
@@ -106,17 +209,111 @@ class CGLSP:
             writer.writeheader()  # Write header row
             writer.writerow(result)
 
+    def get_result(self):
+        # the result of the solve, as a row of the results csv files
+        return {"Problem Instance": self.instance_name,
+                "# Coils to sequence": self.num_coils,
+                "Min Cost": self.min_cost,
+                "Optimal Sequence": self.optimal_sequence,
+                "Solve Time (s)": round(self.solve_time, 4),
+                "# Explored Subproblems": self.bnb_tree.explored_subproblems,
+                "Status": self.solve_status,
+                "Lower Bound": self.lower_bound,
+                "Optimality Gap": self.optimality_gap,
+                "Time Limit (s)": self.time_limit,
+                "Node Limit": self.node_limit,
+                "Memory Limit (MB)": self.memory_limit,
+                "Epsilon": self.epsilon}
+
 
 # custom expection class in case CGLSP instance is actually not solveable
 class InfeasibleCGLSPInstanceException(Exception):
     pass
 
 
+def add_solver_arguments(parser):
+    # adds the options of the solver settings shared by the command line
+    # interfaces (CGLSP.py, batch.py and benchmark.py) to an argparse parser, see
+    # solver_options_from_args
+    parser.add_argument(
+        "--MAP-solver", choices=list(MAP_SOLVERS), default="jv",
+        help="The assignment problem solver used to solve the MAP relaxations of "
+             "the subproblems (default: jv).")
+    parser.add_argument(
+        "--no-subtour-patching", dest="subtour_patching", action="store_false",
+        help="Don't patch the subtours of the MAP solutions of the branched "
+             "subproblems into tours to find better solutions.")
+    parser.add_argument(
+        "--patching-local-search", action="store_true",
+        help="Improve the tours found by subtour patching with Or-opt local "
+             "search.")
+    parser.add_argument(
+        "--max-nodes-in-memory", type=positive_int, default=None,
+        help="Maximum number of unpruned subproblems kept in memory, the others are "
+             "spilled to disk and read back when needed (default: no maximum).")
+    parser.add_argument(
+        "--epsilon", type=float, default=0,
+        help="Relative optimality tolerance: subproblems whose lower bound is at "
+             "least the best cost / (1 + epsilon) are pruned, so the solution found "
+             "is certified to be within a factor 1 + epsilon of the optimal cost, "
+             "e.g. 0.005 for 0.5%% (default: 0, i.e. an optimal solution).")
+    parser.add_argument(
+        "--no-preprocessing", dest="preprocessing", action="store_false",
+        help="Don't reduce the instance before the branch and bound search by "
+             "contracting forced arcs and breaking the symmetries of identical "
+             "coils.")
+    parser.add_argument(
+        "--no-arc-elimination", dest="arc_elimination", action="store_false",
+        help="Don't eliminate the arcs whose reduced cost in the root MAP shows "
+             "they can't be in a better solution than the best solution found.")
+    parser.add_argument(
+        "--branching-rule", choices=list(BRANCHING_RULES),
+        default=BRANCHING_RULE_CARPANETO_TOTH,
+        help="The rule choosing the subtour of a subproblem's MAP solution to "
+             "branch on and the order in which its edges are fixed in the "
+             "children (default: carpaneto_toth).")
+    parser.add_argument(
+        "--additive-bounds", nargs="*", choices=list(ADDITIVE_BOUND_PROCEDURES),
+        default=list(DEFAULT_ADDITIVE_BOUNDS),
+        help="The bounding procedures chained on the reduced costs of the MAP "
+             "relaxations to strengthen their lower bounds (default: "
+             "r_arborescence r_anti_arborescence), no additive bounding if the "
+             "option is given without procedures.")
+
+
+def solver_options_from_args(args):
+    # the CGLSP keyword arguments of the solver settings parsed from the options
+    # added by add_solver_arguments
+    return {
+        "MAP_solver": args.MAP_solver,
+        "subtour_patching": args.subtour_patching,
+        "patching_local_search": args.patching_local_search,
+        "max_nodes_in_memory": args.max_nodes_in_memory,
+        "epsilon": args.epsilon,
+        "preprocessing": args.preprocessing,
+        "arc_elimination": args.arc_elimination,
+        "branching_rule": args.branching_rule,
+        "additive_bounds": args.additive_bounds,
+    }
+
+
+def positive_int(value):
+    # utility function
+    # argparse type of the options which must be at least 1
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+
+    return number
+
+
 if __name__ == "__main__":
 
-    def solve_instance(problem_instance, problem_type, update_frequency):
+    def solve_instance(problem_instance, problem_type, update_frequency,
+                       solver_options):
 
-        CGLSP_instance = CGLSP(problem_instance, problem_type, update_frequency)
+        CGLSP_instance = CGLSP(problem_instance, problem_type, update_frequency,
+                               **solver_options)
         min_cost, solution, solve_time = CGLSP_instance.solve()
 
         dashed_line = "-" * 80
@@ -124,56 +321,115 @@ if __name__ == "__main__":
         print("Solution: \n")
         print("Min cost: ", min_cost)
         print("Optimal coil sequence: ", solution)
+        if CGLSP_instance.solve_status != SOLVE_STATUS_OPTIMAL:
+            print("Solve status: ", CGLSP_instance.solve_status)
+            print("Lower bound: ", CGLSP_instance.lower_bound)
+            print("Optimality gap: ",
+                  format(CGLSP_instance.optimality_gap, '.4%'))
         print("\nSolve Time = ",  format(solve_time, '.6f'), "seconds\n")
 
-    class InvalidArgumentsError(Exception):
-        pass
-
-    if len(sys.argv) < 2:
-        raise InvalidArgumentsError("You need to pass the type of problem instance you'd"
-                                    " like to solve. Pass either 'TSPLIB' or 'CGLSP' ")
-
-    elif len(sys.argv) > 3:
-        message = ("Script takes at most 2 arguments. For the first argument, you "
-                   "need to pass the type of problem instance you'd like to solve. "
-                   "Pass either 'TSPLIB' or 'CGLSP'.\n"
-                   "Optionally you can also control how often the progress "
-                   "of the optimization process is reported by specifiying "
-                   "an integer. A good default value is 500.")
-        raise InvalidArgumentsError(message)
-
-    else:
-        problem_type = sys.argv[1]
-
-        if len(sys.argv) == 2:
-            update_frequency = 500
-
-        elif len(sys.argv) == 3:
-            try:
-                int(sys.argv[2])
-            except:
-                raise InvalidArgumentsError("Update frequency argument must be an int.")
-            update_frequency = int(sys.argv[2])
-
-        if problem_type == "CGLSP":
-
-            problem_instance_relative_path = \
-                "problem_instances/CGLSP_instances/data/cgl_17.txt"
-            problem_instance_absolute_path = \
-                Path(problem_instance_relative_path).resolve()
-
-            problem_instance = problem_instance_absolute_path
-
-            solve_instance(problem_instance, problem_type, update_frequency)
-
-        elif problem_type == "TSPLIB":
-
-            from src.algorithm_verification.br17 import get_cost_matrix_br17_atsp
-            cost_matrix = get_cost_matrix_br17_atsp()
-            problem_instance = cost_matrix
-
-            solve_instance(problem_instance, problem_type, update_frequency)
-
-        else:
-            raise InvalidArgumentsError("Pass only the type of problem instance you'd "
-                                        "like to solve. Choose either 'TSPLIB' or 'CGLSP'")
+    parser = argparse.ArgumentParser(
+        prog="python -m src.CGLSP",
+        description="Solve the cgl_17 CGLSP instance or the TSPLIB ATSP br17 "
+                    "instance to optimality.")
+    parser.add_argument(
+        "problem_type", choices=["CGLSP", "TSPLIB"],
+        help="The type of problem instance you'd like to solve. 'CGLSP' solves the "
+             "cgl_17 instance and 'TSPLIB' solves the TSPLIB ATSP br17 instance.")
+    parser.add_argument(
+        "update_frequency", nargs="?", type=int, default=500,
+        help="How often the progress of the optimization process is reported, as "
+             "the number of branchings between progress updates. A good default "
+             "value is 500.")
+    add_solver_arguments(parser)
+    parser.add_argument(
+        "--ACO-time-limit", type=float, default=0,
+        help="Time limit in seconds of an ant colony optimization run improving the "
+             "initial solution of the branch and bound (default: 0, no ant colony "
+             "optimization).")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Number of worker processes running the branch and bound search in "
+             "parallel (default: 1, i.e. a sequential search).")
+    parser.add_argument(
+        "--concurrent-heuristic", action="store_true",
+        help="Run an iterated local search heuristic in a separate process "
+             "alongside a sequential branch and bound search, exchanging better "
+             "solutions with it.")
+    parser.add_argument(
+        "--spill-directory", type=Path, default=None,
+        help="Directory in which the unpruned subproblems are spilled to disk "
+             "(default: the temporary directory).")
+    parser.add_argument(
+        "--checkpoint", dest="checkpoint_path", type=Path, default=None,
+        help="File to which the state of a sequential search is saved periodically, "
+             "to be able to resume it if it's interrupted (default: no "
+             "checkpoints).")
+    parser.add_argument(
+        "--checkpoint-interval", type=float, default=DEFAULT_CHECKPOINT_INTERVAL,
+        help="Time in seconds between two checkpoints of the search (default: "
+             f"{DEFAULT_CHECKPOINT_INTERVAL}).")
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Resume the search from the checkpoint file given with --checkpoint.")
+    parser.add_argument(
+        "--time-limit", type=float, default=None,
+        help="Time limit of a sequential search in seconds, after which the best "
+             "solution found is returned along with its optimality gap (default: no "
+             "limit).")
+    parser.add_argument(
+        "--node-limit", type=int, default=None,
+        help="Maximum number of subproblems explored by a sequential search "
+             "(default: no limit).")
+    parser.add_argument(
+        "--memory-limit", type=float, default=None,
+        help="Maximum peak memory usage of a sequential search in MB (default: no "
+             "limit).")
+    parser.add_argument(
+        "--trace", dest="trace_path", type=Path, default=None,
+        help="JSON lines file to which the metrics of a sequential search (time "
+             "spent per phase, counters and bounds) are written at every progress "
+             "update and new best solution (default: no trace).")
+    args = parser.parse_args()
+
+    if args.resume and args.checkpoint_path is None:
+        parser.error("--resume requires the checkpoint file given with --checkpoint")
+    if args.checkpoint_path is not None and args.workers > 1:
+        parser.error("checkpoints are only supported by the sequential search")
+    if args.workers > 1 and (args.time_limit is not None
+                             or args.node_limit is not None
+                             or args.memory_limit is not None):
+        parser.error("search limits are only supported by the sequential search")
+    if args.trace_path is not None and args.workers > 1:
+        parser.error("traces are only supported by the sequential search")
+
+    if args.problem_type == "CGLSP":
+
+        problem_instance_relative_path = \
+            "problem_instances/CGLSP_instances/data/cgl_17.txt"
+        problem_instance_absolute_path = \
+            Path(problem_instance_relative_path).resolve()
+
+        problem_instance = problem_instance_absolute_path
+
+    elif args.problem_type == "TSPLIB":
+
+        from src.algorithm_verification.br17 import get_cost_matrix_br17_atsp
+        cost_matrix = get_cost_matrix_br17_atsp()
+        problem_instance = cost_matrix
+
+    solver_options = dict(solver_options_from_args(args),
+                          ACO_time_limit=args.ACO_time_limit,
+                          num_workers=args.workers,
+                          concurrent_heuristic=args.concurrent_heuristic,
+                          spill_directory=args.spill_directory,
+                          checkpoint_path=args.checkpoint_path,
+                          checkpoint_interval=args.checkpoint_interval,
+                          resume=args.resume,
+                          time_limit=args.time_limit,
+                          node_limit=args.node_limit,
+                          memory_limit=args.memory_limit,
+                          trace_path=args.trace_path)
+
+    solve_instance(problem_instance, args.problem_type, args.update_frequency,
+                   solver_options)
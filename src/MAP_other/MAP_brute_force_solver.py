@@ -1,4 +1,4 @@
-from src.instance_parser import get_CGLSP_instance_cost_matrix
+from src.instance_parser import get_CGLSP_instance_cost_matrix, NA
 import numpy as np
 import time
 
@@ -74,7 +74,7 @@ def generate_feasible_solutions(cost_matrix):
 
         used_cols = curr_path_object["used_cols"]
         next_row_feasible_cols = {index for index, cost in enumerate(
-            cost_matrix[next_row]) if cost != "NA" and index != next_row} - used_cols
+            cost_matrix[next_row]) if cost != NA and index != next_row} - used_cols
         for col in next_row_feasible_cols:
             updated_path = curr_path.copy()
             updated_path.append((next_row, col))
@@ -1,7 +1,9 @@
 # from instance_parser import instance_to_cost_matrix
 from src.instance_generation.random_CGLSP_instance_generator import get_random_CGLSP_instances
 from src.MAP_other.MAP_brute_force_solver import *
-from src.MAP_solver import google_or_AP_solver
+from src.MAP_solver import MAP_SOLVERS, SPARSE_MAP_SOLVERS
+from src.instance_parser import get_feasible_edges_CSR
+import timeit
 
 
 # pass a list of ints, test_instances to get_random_CGLSP_instances to generate random problem instances
@@ -16,7 +18,7 @@ if num_test_instances == 1:
 
 print("\n--------------------------------------------START OF ALGORITHM COMPARISION---------------------------------------------------------------")
 
-print(f"Comparing solutions from Google OR Solver and Brute Force solver for {num_test_instances} test instances \n")
+print(f"Comparing solutions from the MAP solvers ({', '.join(MAP_SOLVERS)}) and Brute Force solver for {num_test_instances} test instances \n")
 
 
 failed_solves = 0
@@ -24,59 +26,89 @@ for i, cost_matrix in enumerate(cost_matrices):
     print("----------------------------------------------------------------------------------------------------------------------------------")
 
     print(
-        f"Comparing solutions from Google OR Solver and Brute Force solver for test instance {i+1} / {num_test_instances} \n")
-
-    best_sol_google, best_assignment_costs_google, min_cost_google = google_or_AP_solver(cost_matrix)
-
-    print("----------------------------------------------------------------------------------------------------------------------------------")
+        f"Comparing solutions from the MAP solvers and Brute Force solver for test instance {i+1} / {num_test_instances} \n")
 
     best_sol_bf, best_assignment_costs_bf, min_cost_bf = brute_force_AP_solver(cost_matrix)
 
     print("----------------------------------------------------------------------------------------------------------------------------------")
 
     print(
-        f"Checking if Google OR solution and Brute Force solution are the same for test instance {i+1} / {num_test_instances} : \n")
-
-    best_solution_assertion = {"condition": best_sol_google == best_sol_bf, "message": f"Google OR best solution {best_sol_google} is \
-                                                not the same as Brute Force best solution {best_sol_bf}"}
+        f"Checking if the MAP solvers' solutions and Brute Force solution have the same cost for test instance {i+1} / {num_test_instances} : \n")
 
-    best_assignment_costs_assertion = {"condition": best_assignment_costs_google == best_assignment_costs_bf, "message":
-                                       f"Google OR best solution assignment costs {best_assignment_costs_google}  is \
-                                          not the same as Brute Force best solution assignment costs {best_assignment_costs_bf}"}
-
-    min_cost_assertion = {"condition": min_cost_google == min_cost_bf, "message":
-                          f"Google OR best solution min cost {min_cost_google}  is \
+    # different solvers may find different optimal solutions when there are ties,
+    # so only the min costs of the solutions are compared
+    failed_assertions = 0
+    for MAP_solver_name, MAP_solver in MAP_SOLVERS.items():
+        if MAP_solver_name in SPARSE_MAP_SOLVERS:
+            best_sol, min_cost, best_assignment_costs, status, _ = MAP_solver(
+                get_feasible_edges_CSR(cost_matrix))
+        else:
+            best_sol, min_cost, best_assignment_costs, status, _ = MAP_solver(cost_matrix)
+
+        min_cost_assertion = {"condition": min_cost == min_cost_bf, "message":
+                              f"{MAP_solver_name} best solution min cost {min_cost}  is \
                                           not the same as Brute Force best solution min cost {min_cost_bf}"}
 
-    assertions = [best_solution_assertion, best_assignment_costs_assertion, min_cost_assertion]
+        assignment_costs_assertion = {"condition": sum(best_assignment_costs) == min_cost, "message":
+                                      f"{MAP_solver_name} best solution assignment costs {best_assignment_costs}  \
+                                          don't add up to its min cost {min_cost}"}
 
-    failed_assertions = 0
-    for assertion in assertions:
-        condition = assertion["condition"]
-        message = assertion["message"]
-        try:
-            assert condition, message
-        except AssertionError as e:
-            failed_assertions += 1
-            print(f"Assertion Failed for test instance {i} : ",  e)
+        for assertion in [min_cost_assertion, assignment_costs_assertion]:
+            condition = assertion["condition"]
+            message = assertion["message"]
+            try:
+                assert condition, message
+            except AssertionError as e:
+                failed_assertions += 1
+                print(f"Assertion Failed for test instance {i} : ",  e)
 
     if failed_assertions > 0:
         failed_solves += 1
 
     else:
         print(
-            f"Google OR solution and Brute Force solution ARE THE SAMME for test instance {i+1} / {num_test_instances} \n")
+            f"The MAP solvers' solutions and Brute Force solution HAVE THE SAME COST for test instance {i+1} / {num_test_instances} \n")
 
 
 if failed_solves == 0:
 
     print("----------------------------------------------------------------------------------------------------------------------------------")
 
-    print("Congratulations, all test instances had the same solution for the Google OR solver and the Brute Force solver\n")
+    print("Congratulations, all test instances had the same solution cost for the MAP solvers and the Brute Force solver\n")
 
 else:
     print(
-        f"Unfortunately the brute force solver is giving the incorrect answer on {failed_solves} / {num_test_instances} instances\n")
+        f"Unfortunately the MAP solvers and the brute force solver disagree on {failed_solves} / {num_test_instances} instances\n")
 
 
 print("--------------------------------------------END OF ALGORITHM COMPARISION---------------------------------------------------------------")
+
+
+# Timing comparison of the MAP solvers across matrix sizes
+# The sizes cover the range of the CGLSP instances (17 - 114 coils)
+timing_instance_sizes = [10, 17, 26, 50, 81, 114]
+timing_repeats = 20
+
+print("\n--------------------------------------------START OF TIMING COMPARISION------------------------------------------------------------------")
+
+print(f"Mean solve time (ms) over {timing_repeats} solves of a random instance of each size \n")
+
+header = f"{'# Jobs':>8}" + "".join(f"{MAP_solver_name:>12}" for MAP_solver_name in MAP_SOLVERS)
+print(header)
+
+for instance_size in timing_instance_sizes:
+    cost_matrix = get_random_CGLSP_instances(num_jobs=instance_size)
+
+    sparse_cost_matrix = get_feasible_edges_CSR(cost_matrix)
+
+    row = f"{instance_size:>8}"
+    for MAP_solver_name, MAP_solver in MAP_SOLVERS.items():
+        if MAP_solver_name in SPARSE_MAP_SOLVERS:
+            solver_input = sparse_cost_matrix
+        else:
+            solver_input = cost_matrix
+        solve_time = timeit.timeit(lambda: MAP_solver(solver_input), number=timing_repeats)
+        row += f"{1000 * solve_time / timing_repeats:>12.3f}"
+    print(row)
+
+print("\n--------------------------------------------END OF TIMING COMPARISION--------------------------------------------------------------------")
@@ -2,28 +2,24 @@
 import numpy as np
 import time
 from ortools.graph.python import linear_sum_assignment
+from scipy import optimize, sparse
+from scipy.sparse import csgraph
+from src.instance_parser import NA
 
 
-def google_or_AP_solver(cost_matrix):
-    """Linear Sum Assignment example."""
+def google_or_AP_solver(cost_matrix, warm_start=None):
+    """Linear Sum Assignment example.
 
-    start_time = time.time()
-    assignment = linear_sum_assignment.SimpleLinearSumAssignment()
+    The Google OR-Tools solver can't be warm started, so warm_start is ignored and
+    no solver state is returned.
+    """
 
-    rows = cols = cost_matrix.shape[0]
-
-    cost = cost_matrix.tolist()
+    assignment = linear_sum_assignment.SimpleLinearSumAssignment()
 
-    for worker in range(0, rows):
-        for task in range(0, cols):
-            if cost[worker][task] != 'NA':
-                assignment.add_arc_with_cost(worker, task, cost[worker][task])
+    add_feasible_edges(assignment, cost_matrix)
 
     status = assignment.solve()
 
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-
     best_sol = []
     best_assignment_costs = []
 
@@ -38,13 +34,13 @@ def google_or_AP_solver(cost_matrix):
             assignment_cost = assignment.assignment_cost(i)
             best_assignment_costs.append(assignment_cost)
 
-        return best_sol, min_cost, best_assignment_costs, "FOUND_OPTIMAL"
+        return best_sol, min_cost, best_assignment_costs, "FOUND_OPTIMAL", None
     elif status == assignment.INFEASIBLE:
         min_cost = -1
-        return best_sol, min_cost, best_assignment_costs, "INFEASIBLE"
+        return best_sol, min_cost, best_assignment_costs, "INFEASIBLE", None
     elif status == assignment.POSSIBLE_OVERFLOW:
         min_cost = -1
-        return best_sol, min_cost, best_assignment_costs, "POSSIBLE_OVERFLOW"
+        return best_sol, min_cost, best_assignment_costs, "POSSIBLE_OVERFLOW", None
 
 
 def google_or_AP_solver_verbose(cost_matrix):
@@ -57,14 +53,7 @@ def google_or_AP_solver_verbose(cost_matrix):
     print("Cost Matrix: \n", cost_matrix, "\n")
     assignment = linear_sum_assignment.SimpleLinearSumAssignment()
 
-    rows = cols = cost_matrix.shape[0]
-
-    cost = cost_matrix.tolist()
-
-    for worker in range(0, rows):
-        for task in range(0, cols):
-            if cost[worker][task] != 'NA':
-                assignment.add_arc_with_cost(worker, task, cost[worker][task])
+    add_feasible_edges(assignment, cost_matrix)
 
     status = assignment.solve()
 
@@ -93,20 +82,442 @@ def google_or_AP_solver_verbose(cost_matrix):
             )
         print("\nSolve Time = ",  format(elapsed_time, '.6f'), "seconds\n")
 
-        return best_sol, min_cost, best_assignment_costs, "FOUND_OPTIMAL"
+        return best_sol, min_cost, best_assignment_costs, "FOUND_OPTIMAL", None
     elif status == assignment.INFEASIBLE:
         print("No assignment is possible.")
         min_cost = -1
-        return best_sol, min_cost, best_assignment_costs, "INFEASIBLE"
+        return best_sol, min_cost, best_assignment_costs, "INFEASIBLE", None
     elif status == assignment.POSSIBLE_OVERFLOW:
         print("Some input costs are too large and may cause an integer overflow.")
         min_cost = -1
-        return best_sol, min_cost, best_assignment_costs, "POSSIBLE_OVERFLOW"
+        return best_sol, min_cost, best_assignment_costs, "POSSIBLE_OVERFLOW", None
+
+
+def add_feasible_edges(assignment, cost_matrix):
+    # add all the feasible (non NA) edges of the cost matrix to the Google OR-Tools
+    # solver in one bulk call, using arrays of the edges' tails, heads and costs
+    tails, heads = np.nonzero(cost_matrix != NA)
+    assignment.add_arcs_with_cost(
+        tails.astype(np.int32),
+        heads.astype(np.int32),
+        cost_matrix[tails, heads].astype(np.int64),
+    )
+
+
+def scipy_AP_solver(cost_matrix, warm_start=None):
+    """
+    Solve the assignment problem using SciPy's linear_sum_assignment solver.
+
+    SciPy's solver has no notion of forbidden edges, so they are given a big-M cost
+    that is larger than the cost of any assignment using only feasible edges. If the
+    optimal assignment still uses a big-M edge then there is no feasible assignment.
+
+    The SciPy solver can't be warm started, so warm_start is ignored and no solver
+    state is returned.
+    """
+
+    rows = cost_matrix.shape[0]
+
+    feasible_edges = cost_matrix != NA
+    big_M = (np.abs(cost_matrix).max() + 1) * rows
+    costs = np.where(feasible_edges, cost_matrix, big_M)
+
+    row_indices, col_indices = optimize.linear_sum_assignment(costs)
+
+    best_sol = []
+    best_assignment_costs = []
+
+    if not feasible_edges[row_indices, col_indices].all():
+        return best_sol, -1, best_assignment_costs, "INFEASIBLE", None
+
+    assignment_costs = cost_matrix[row_indices, col_indices]
+    min_cost = int(assignment_costs.sum())
+
+    best_sol = list(zip(row_indices.tolist(), col_indices.tolist()))
+    best_assignment_costs = assignment_costs.tolist()
+
+    return best_sol, min_cost, best_assignment_costs, "FOUND_OPTIMAL", None
+
+
+def sparse_AP_solver(cost_matrix, warm_start=None):
+    """
+    Solve the assignment problem using SciPy's sparse LAPJVsp solver
+    (min_weight_full_bipartite_matching), on a cost matrix in CSR form containing
+    only the feasible edges (see get_feasible_edges_CSR).
+
+    The solve time scales with the number of feasible edges instead of n^2, which
+    matters for the large and mostly forbidden CGLSP instances.
+
+    The sparse solver drops edges with a cost of 0, so every edge's cost is
+    shifted up by 1 for the solve. Every perfect assignment has exactly n edges, so
+    the shift doesn't change the optimal assignment.
+
+    The sparse solver can't be warm started, so warm_start is ignored and no solver
+    state is returned.
+    """
+
+    best_sol = []
+    best_assignment_costs = []
+
+    shifted_cost_matrix = sparse.csr_matrix(
+        (cost_matrix.data + 1, cost_matrix.indices, cost_matrix.indptr),
+        shape=cost_matrix.shape)
+
+    try:
+        row_indices, col_indices = csgraph.min_weight_full_bipartite_matching(
+            shifted_cost_matrix)
+    except ValueError:
+        # raised when there is no perfect assignment
+        return best_sol, -1, best_assignment_costs, "INFEASIBLE", None
+
+    assignment_costs = np.asarray(
+        cost_matrix[row_indices, col_indices]).ravel().astype(np.int64)
+    min_cost = int(assignment_costs.sum())
+
+    best_sol = list(zip(row_indices.tolist(), col_indices.tolist()))
+    best_assignment_costs = assignment_costs.tolist()
+
+    return best_sol, min_cost, best_assignment_costs, "FOUND_OPTIMAL", None
+
+
+def jv_AP_solver(cost_matrix, warm_start=None):
+    """
+    Solve the assignment problem using a pure NumPy Jonker-Volgenant solver, i.e.
+    a shortest augmenting path (Hungarian) solver in the style of Carpaneto and
+    Toth, initialised by Jonker-Volgenant column reduction.
+
+    The solver keeps dual potentials u (rows) and v (columns) such that the
+    reduced cost c[i, j] - u[i] - v[j] is non-negative for every feasible edge and
+    zero for every edge in the current (partial) assignment. Each unassigned row is
+    then assigned by finding a shortest augmenting path (Dijkstra) on the reduced
+    costs, so a solve from scratch costs O(n^3).
+
+    A child subproblem in the branch and bound tree only forbids edges relative to
+    its parent (its included and excluded edges are a superset of its parent's), so
+    the parent's dual potentials remain feasible for the child. Passing the parent's
+    solver state as warm_start means only the rows whose assigned edge is no longer
+    feasible (usually just the row of the newly excluded edge) need to be repaired,
+    which costs O(n^2) per repaired row.
+
+    warm_start is the solver state (u, v, col4row) returned by a previous solve of
+    a less constrained subproblem. The solver state of this solve is returned as the
+    last element of the returned tuple so it can be used to warm start children.
+    """
+
+    rows = cols = cost_matrix.shape[0]
+
+    # forbidden (NA) edges get an infinite cost so they are never selected
+    feasible_edges = cost_matrix != NA
+    costs = np.where(feasible_edges, cost_matrix, np.inf)
+
+    best_sol = []
+    best_assignment_costs = []
+
+    if warm_start is None:
+        # a row or column without any feasible edges can't be assigned
+        if (~feasible_edges.any(axis=0)).any() or (~feasible_edges.any(axis=1)).any():
+            return best_sol, -1, best_assignment_costs, "INFEASIBLE", None
+
+        # cold start (column reduction): reduce each column by its min cost, which
+        # is a feasible dual solution, and assign each column to the row of its min
+        # cost, as long as no other column has already been assigned to that row
+        u = np.zeros(rows)
+        v = costs.min(axis=0)
+        col4row = np.full(rows, -1)
+        min_cost_rows, first_cols = np.unique(
+            costs.argmin(axis=0), return_index=True)
+        col4row[min_cost_rows] = first_cols
+
+    else:
+        # (the solver state may be stored compactly, e.g. as small integer arrays)
+        u, v = (potentials.astype(float) for potentials in warm_start[:2])
+        col4row = warm_start[2].astype(np.int64)
+
+        # unassign the rows whose assigned edge has been forbidden in this
+        # subproblem, all other assigned edges still have zero reduced cost
+        assigned_rows = np.flatnonzero(col4row >= 0)
+        broken_rows = assigned_rows[
+            ~feasible_edges[assigned_rows, col4row[assigned_rows]]]
+        col4row[broken_rows] = -1
+
+    row4col = np.full(cols, -1)
+    assigned_rows = np.flatnonzero(col4row >= 0)
+    row4col[col4row[assigned_rows]] = assigned_rows
+
+    for cur_row in np.flatnonzero(col4row < 0):
+        if not _augment(costs, u, v, col4row, row4col, cur_row):
+            return best_sol, -1, best_assignment_costs, "INFEASIBLE", None
+
+    assignment_costs = cost_matrix[np.arange(rows), col4row]
+    min_cost = int(assignment_costs.sum())
+
+    best_sol = list(zip(range(rows), col4row.tolist()))
+    best_assignment_costs = assignment_costs.tolist()
+
+    return best_sol, min_cost, best_assignment_costs, "FOUND_OPTIMAL", (u, v, col4row)
+
+
+def get_dual_potentials(cost_matrix, solver_state=None):
+    """
+    The optimal dual potentials (u, v) of the assignment problem of a dense cost
+    matrix, as float arrays: the reduced cost c[i, j] - u[i] - v[j] of every
+    feasible edge is non-negative, and the sum of the potentials is the min cost of
+    the assignment problem. So every assignment (and every tour) using the edge
+    (i, j) costs at least sum(u) + sum(v) + c[i, j] - u[i] - v[j].
+
+    The potentials are those of solver_state, the solver state returned by a
+    jv_AP_solver solve of the assignment problem, if it's given. The other solvers
+    don't return their dual solution, so otherwise the assignment problem is solved
+    again with the jv_AP_solver. Returns None if the assignment problem is
+    infeasible.
+    """
+
+    if solver_state is None:
+        *_, solver_state = jv_AP_solver(cost_matrix)
+        if solver_state is None:
+            return None
+
+    u, v = solver_state[:2]
+    return u.astype(float), v.astype(float)
+
+
+def jv_AP_batch_solver(cost_matrices, warm_start):
+    """
+    Solve a batch of k assignment problems, stacked in a (k, n, n) cost tensor,
+    that are all warm started from the same solver state, e.g. the MAP relaxations
+    of the k children of a subproblem in the branch and bound tree.
+
+    Like the jv_AP_solver, each problem only has to repair the rows of the shared
+    assignment that are no longer feasible in that problem. The shortest augmenting
+    paths of all the problems are found together in lockstep by a vectorized kernel,
+    so the Python overhead of a solve is paid once per batch instead of once per
+    problem.
+
+    Returns a list with the result of each problem, in the same format as the
+    results of the jv_AP_solver.
+    """
+
+    k, rows, cols = cost_matrices.shape
+
+    feasible_edges = cost_matrices != NA
+    costs = np.where(feasible_edges, cost_matrices, np.inf)
+
+    # every problem starts from its own copy of the shared solver state
+    u, v = (np.broadcast_to(potentials, (k, rows)).astype(float)
+            for potentials in warm_start[:2])
+    col4row = np.broadcast_to(warm_start[2], (k, rows)).astype(np.int64)
+
+    # unassign the rows whose assigned edge has been forbidden in each problem
+    batch_indices, row_indices = np.nonzero(col4row >= 0)
+    broken = ~feasible_edges[batch_indices, row_indices,
+                             col4row[batch_indices, row_indices]]
+    col4row[batch_indices[broken], row_indices[broken]] = -1
+
+    row4col = np.full((k, cols), -1)
+    batch_indices, row_indices = np.nonzero(col4row >= 0)
+    row4col[batch_indices, col4row[batch_indices, row_indices]] = row_indices
+
+    feasible = np.ones(k, dtype=bool)
+    while True:
+        # augment the first unassigned row of every problem that still has one
+        unassigned_rows = (col4row < 0) & feasible[:, None]
+        active = unassigned_rows.any(axis=1)
+        if not active.any():
+            break
+        cur_rows = unassigned_rows.argmax(axis=1)
+
+        augmented = _augment_batch(costs, u, v, col4row, row4col, cur_rows, active)
+        feasible &= augmented | ~active
+
+    results = []
+    for b in range(k):
+        if not feasible[b]:
+            results.append(([], -1, [], "INFEASIBLE", None))
+            continue
+
+        assignment_costs = cost_matrices[b, np.arange(rows), col4row[b]]
+        min_cost = int(assignment_costs.sum())
+        best_sol = list(zip(range(rows), col4row[b].tolist()))
+
+        results.append((best_sol, min_cost, assignment_costs.tolist(),
+                        "FOUND_OPTIMAL", (u[b], v[b], col4row[b])))
+
+    return results
+
+
+def _augment_batch(costs, u, v, col4row, row4col, cur_rows, active):
+    # batched version of _augment, which finds a shortest augmenting path from the
+    # unassigned row cur_rows[b] of each active problem b in the batch
+    # (all arrays have the batch as their first axis, and u, v, col4row and
+    # row4col are updated in place)
+    # returns whether an augmenting path was found for each active problem
+
+    # Instead of scanning one column at a time (Dijkstra), the shortest path
+    # distances from cur_rows to all the columns are found with a Bellman-Ford
+    # search, where every step relaxes all the edges of all the problems at once in
+    # a single vectorized operation on the (k, n, n) reduced cost tensor. The
+    # reduced costs are non-negative, so the search converges in at most n steps,
+    # and in practice in as many steps as the augmenting paths have edges.
+
+    k, n = u.shape
+    batch = np.arange(k)
+
+    reduced_costs = costs - u[:, :, None] - v[:, None, :]
+
+    # the distance to a row is the distance to the column it's assigned to, as
+    # paths alternate between unassigned and assigned edges
+    col_dists = np.full((k, n), np.inf)
+    path = np.full((k, n), -1)
+    unassigned_rows = col4row < 0
+    assigned_cols = batch[:, None] * n + np.maximum(col4row, 0)
+    while True:
+        row_dists = col_dists.ravel()[assigned_cols]
+        row_dists[unassigned_rows] = np.inf
+        row_dists[batch[active], cur_rows[active]] = 0
+
+        path_costs = row_dists[:, :, None] + reduced_costs
+        closest_rows = path_costs.argmin(axis=1)
+        closest_dists = path_costs.min(axis=1)
+
+        improved = closest_dists < col_dists
+        if not improved.any():
+            break
+        np.copyto(col_dists, closest_dists, where=improved)
+        np.copyto(path, closest_rows, where=improved)
+
+    # the augmenting path ends at the closest unassigned column
+    free_col_dists = np.where(row4col == -1, col_dists, np.inf)
+    sinks = free_col_dists.argmin(axis=1)
+    min_vals = free_col_dists[batch, sinks]
+
+    # problems without an augmenting path have no perfect assignment
+    augmented = active & (min_vals < np.inf)
+
+    # update the dual potentials so the reduced costs stay non-negative and the
+    # edges on the augmenting paths have zero reduced cost
+    b = np.flatnonzero(augmented)
+    min_vals = np.where(augmented, min_vals, 0)
+    col_reductions = np.maximum(min_vals[:, None] - col_dists, 0)
+    v -= col_reductions
+    row_reductions = col_reductions.ravel()[assigned_cols]
+    row_reductions[unassigned_rows] = 0
+    u += row_reductions
+    u[b, cur_rows[b]] += min_vals[b]
+
+    # augment the assignments along the paths back from the sinks to cur_rows
+    for problem in b:
+        j = sinks[problem]
+        while True:
+            row = path[problem, j]
+            row4col[problem, j] = row
+            col4row[problem, row], j = j, col4row[problem, row]
+            if row == cur_rows[problem]:
+                break
+
+    return augmented
+
+
+def _augment(costs, u, v, col4row, row4col, cur_row):
+    # find a shortest augmenting path from the unassigned row cur_row to an
+    # unassigned column using the reduced costs, then update the dual potentials
+    # and flip the assignment along the path
+    # (u, v, col4row and row4col are updated in place)
+
+    n = costs.shape[0]
+    shortest_path_costs = np.full(n, np.inf)
+    path = np.full(n, -1)
+    scanned_rows = np.zeros(n, dtype=bool)
+    scanned_cols = np.zeros(n, dtype=bool)
+
+    min_val = 0.0
+    i = cur_row
+    sink = -1
+    while sink == -1:
+        scanned_rows[i] = True
+
+        # relax the edges out of row i to all the columns not yet scanned
+        reduced_costs = min_val + costs[i] - u[i] - v
+        improved = (reduced_costs < shortest_path_costs) & ~scanned_cols
+        path[improved] = i
+        shortest_path_costs[improved] = reduced_costs[improved]
+
+        # scan the closest column, preferring an unassigned column on ties
+        remaining_costs = np.where(scanned_cols, np.inf, shortest_path_costs)
+        j = remaining_costs.argmin()
+        min_val = remaining_costs[j]
+        if min_val == np.inf:
+            # no augmenting path exists, so there is no perfect assignment
+            return False
+        if row4col[j] != -1:
+            free_ties = np.flatnonzero(
+                (remaining_costs == min_val) & (row4col == -1))
+            if free_ties.size:
+                j = free_ties[0]
+
+        scanned_cols[j] = True
+        if row4col[j] == -1:
+            sink = j
+        else:
+            i = row4col[j]
+
+    # update the dual potentials so the reduced costs stay non-negative and the
+    # edges on the augmenting path have zero reduced cost
+    u[cur_row] += min_val
+    other_scanned_rows = scanned_rows.copy()
+    other_scanned_rows[cur_row] = False
+    u[other_scanned_rows] += min_val - \
+        shortest_path_costs[col4row[other_scanned_rows]]
+    v[scanned_cols] -= min_val - shortest_path_costs[scanned_cols]
+
+    # augment the assignment along the path back from the sink to cur_row
+    j = sink
+    while True:
+        i = path[j]
+        row4col[j] = i
+        col4row[i], j = j, col4row[i]
+        if i == cur_row:
+            break
+
+    return True
+
+
+# assignment problem solvers that can be selected to solve the MAP relaxations
+# of the subproblems. All solvers take a cost matrix (and optionally the solver
+# state of a parent subproblem's solve to warm start from), and return the
+# solution, min cost, assignment costs, solve status and solver state. Only solvers
+# that return a solver state can warm start the MAP solves of child subproblems.
+MAP_SOLVERS = {
+    "jv": jv_AP_solver,
+    "ortools": google_or_AP_solver,
+    "scipy": scipy_AP_solver,
+    "sparse": sparse_AP_solver,
+}
+
+# solvers that take the cost matrix in sparse CSR form (see get_feasible_edges_CSR)
+# instead of as a dense matrix
+SPARSE_MAP_SOLVERS = {"sparse"}
+
+
+def get_MAP_solver(MAP_solver_name):
+    # utility function
+    # returns the assignment problem solver registered under MAP_solver_name
+
+    if MAP_solver_name not in MAP_SOLVERS:
+        raise UnknownMAPSolverException(
+            f"Unknown MAP solver '{MAP_solver_name}'. "
+            f"Choose one of {', '.join(MAP_SOLVERS)}"
+        )
+
+    return MAP_SOLVERS[MAP_solver_name]
 
 
 class PossibleOverflowException(Exception):
     pass
 
 
+class UnknownMAPSolverException(Exception):
+    pass
+
+
 if __name__ == "__main__":
     pass
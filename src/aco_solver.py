@@ -0,0 +1,227 @@
+"""
+Ant colony optimization (MAX-MIN Ant System) heuristic solver for CGLSP instances
+
+An anytime alternative to the exact branch and bound for the large instances: it
+returns the best tour found within a wall clock time limit. It can be used on its
+own (see the command line interface at the bottom of this script) or to provide
+the branch and bound with an initial incumbent (see BnB_Tree).
+"""
+from src.heuristics import (get_heuristic_costs, get_candidate_lists,
+                            initial_tour_heuristic, local_search, tour_cost,
+                            tour_to_solution)
+import numpy as np
+import time
+
+
+class ACO_Solver:
+    def __init__(self, root_cost_matrix, time_limit=10, num_ants=64, alpha=1,
+                 beta=2, evaporation_rate=0.1, max_iterations=None,
+                 local_search=True, seed=None):
+        self.root_cost_matrix = root_cost_matrix
+        self.instance_size = root_cost_matrix.shape[0]
+        self.time_limit = time_limit
+        self.max_iterations = max_iterations
+        self.num_ants = num_ants
+        self.alpha = alpha
+        self.evaporation_rate = evaporation_rate
+        # whether the best tour of each iteration is improved by local search
+        self.local_search = local_search
+        self.rng = np.random.default_rng(seed)
+
+        self.costs = get_heuristic_costs(root_cost_matrix)
+        self.candidates = get_candidate_lists(self.costs)
+
+        # the ants can only use the feasible edges (and no self loops)
+        self.feasible_edges = np.isfinite(self.costs)
+        np.fill_diagonal(self.feasible_edges, False)
+
+        # heuristic information of the edges, the cheaper the edge the more
+        # attractive it is, 0 for the edges that can't be used
+        self.heuristic_information = np.where(
+            self.feasible_edges, 1 / (self.costs + 1), 0) ** beta
+
+        self.pheromones = np.ones_like(self.costs)
+
+        self.best_cost = np.inf
+        self.best_tour = None
+        self.iterations = 0
+        self.constructed_tours = 0
+
+    def solve(self, initial_solution=None):
+        """
+        Runs the ant colony until the time limit (or the maximum number of
+        iterations) is reached, and returns the cost of the best tour found and the
+        tour as a list of (job, next job) edges, or (np.inf, []) if no tour was found
+
+        The colony is seeded with initial_solution if it's given, otherwise with the
+        tour of the initial tour heuristic (see heuristics.initial_tour_heuristic)
+        """
+        start = time.time()
+
+        if not initial_solution:
+            _, initial_solution = initial_tour_heuristic(self.costs, self.candidates)
+
+        if initial_solution:
+            initial_tour = np.array([edge[0] for edge in initial_solution])
+            self.update_best_tour(initial_tour, tour_cost(self.costs, initial_tour))
+            # MAX-MIN Ant System initializes the pheromones to their maximum
+            self.pheromones[:] = self.max_pheromone
+
+        while time.time() - start < self.time_limit:
+            if (self.max_iterations is not None
+                    and self.iterations >= self.max_iterations):
+                break
+
+            self.iterations += 1
+
+            tours, complete_tours = self.construct_tours()
+            self.constructed_tours += complete_tours.sum()
+
+            iteration_best_tour = None
+            if complete_tours.any():
+                tours = tours[complete_tours]
+                tour_costs = self.costs[tours, np.roll(tours, -1, axis=1)].sum(axis=1)
+                iteration_best_tour = tours[tour_costs.argmin()]
+
+                if self.local_search:
+                    iteration_best_tour = local_search(
+                        self.costs, iteration_best_tour, self.candidates)
+
+                self.update_best_tour(iteration_best_tour,
+                                      tour_cost(self.costs, iteration_best_tour))
+
+            self.update_pheromones(iteration_best_tour)
+
+        if self.best_tour is None:
+            return np.inf, []
+
+        return int(self.best_cost), tour_to_solution(self.best_tour)
+
+    def construct_tours(self):
+        """
+        Constructs the tours of all the ants at once, as a (num_ants, n) array of
+        tours starting at vertex 0, along with a boolean mask of the ants which
+        completed a tour using only feasible edges
+
+        At each step every ant moves from its current vertex to an unvisited vertex
+        v with probability proportional to pheromone^alpha * heuristic information.
+        If the current vertex is the last remaining feasible predecessor of some
+        unvisited vertices, the ant moves to one of them instead, as otherwise it
+        could never visit them. Ants with no feasible move left are stuck, and
+        don't complete a tour.
+        """
+        n = self.instance_size
+        ants = np.arange(self.num_ants)
+
+        tours = np.zeros((self.num_ants, n), dtype=np.int64)
+        unvisited = np.ones((self.num_ants, n), dtype=bool)
+        unvisited[:, 0] = False
+        complete_tours = np.ones(self.num_ants, dtype=bool)
+        cur_vertices = np.zeros(self.num_ants, dtype=np.int64)
+
+        # the number of feasible predecessors of each vertex the ants can still
+        # leave from, i.e. their unvisited vertices and their current vertex
+        remaining_predecessors = np.tile(self.feasible_edges.sum(axis=0),
+                                         (self.num_ants, 1))
+
+        edge_weights = self.pheromones ** self.alpha * self.heuristic_information
+
+        for position in range(1, n):
+            move_weights = edge_weights[cur_vertices] * unvisited
+
+            last_chance_vertices = (unvisited
+                                    & self.feasible_edges[cur_vertices]
+                                    & (remaining_predecessors == 1))
+            move_weights = np.where(last_chance_vertices.any(axis=1)[:, None],
+                                    move_weights * last_chance_vertices,
+                                    move_weights)
+
+            # sample the next vertex of each ant by inverse transform sampling
+            cumulative_weights = np.cumsum(move_weights, axis=1)
+            total_weights = cumulative_weights[:, -1]
+            complete_tours &= total_weights > 0
+
+            samples = self.rng.random(self.num_ants) * total_weights
+            next_vertices = np.minimum(
+                (cumulative_weights <= samples[:, None]).sum(axis=1), n - 1)
+
+            remaining_predecessors -= self.feasible_edges[cur_vertices]
+            tours[:, position] = next_vertices
+            unvisited[ants, next_vertices] = False
+            cur_vertices = next_vertices
+
+        # the ants have to be able to return to vertex 0
+        complete_tours &= self.feasible_edges[cur_vertices, 0]
+
+        return tours, complete_tours
+
+    def update_best_tour(self, tour, cost):
+        if cost < self.best_cost:
+            self.best_cost = cost
+            self.best_tour = tour
+
+            # MAX-MIN Ant System pheromone bounds
+            self.max_pheromone = 1 / (self.evaporation_rate * self.best_cost)
+            self.min_pheromone = self.max_pheromone / (2 * self.instance_size)
+
+    def update_pheromones(self, iteration_best_tour):
+        # evaporate the pheromones, and deposit pheromones on the edges of the
+        # iteration best tour, or every 5 iterations (or if no ant completed a tour)
+        # on the edges of the best tour found so far
+        self.pheromones *= 1 - self.evaporation_rate
+
+        if self.best_tour is None:
+            return
+
+        if iteration_best_tour is None or self.iterations % 5 == 0:
+            iteration_best_tour = self.best_tour
+
+        self.pheromones[iteration_best_tour, np.roll(iteration_best_tour, -1)] += (
+            1 / tour_cost(self.costs, iteration_best_tour))
+
+        np.clip(self.pheromones, self.min_pheromone, self.max_pheromone,
+                out=self.pheromones)
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+    from src.instance_parser import get_CGLSP_instance_cost_matrix
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.aco_solver",
+        description="Find a good coil sequence for a CGLSP instance with ant colony "
+                    "optimization, within a time limit.")
+    parser.add_argument(
+        "problem_instance", type=Path,
+        help="Path to a CGLSP instance file, e.g. "
+             "problem_instances/CGLSP_instances/data/cgl_114.txt")
+    parser.add_argument(
+        "--time-limit", type=float, default=10,
+        help="Wall clock time limit of the ant colony in seconds (default: 10).")
+    parser.add_argument(
+        "--num-ants", type=int, default=64,
+        help="Number of ants constructing tours in each iteration (default: 64).")
+    parser.add_argument(
+        "--seed", type=int, default=None,
+        help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    root_cost_matrix = get_CGLSP_instance_cost_matrix(args.problem_instance.resolve())
+
+    ACO_solver = ACO_Solver(root_cost_matrix, time_limit=args.time_limit,
+                            num_ants=args.num_ants, seed=args.seed)
+    start = time.time()
+    min_cost, solution = ACO_solver.solve()
+    solve_time = time.time() - start
+
+    # 0 job is dummy node in graph, remove it to obtain the sequence of coils
+    coil_sequence = [edge[0] for edge in solution if edge[0] != 0]
+
+    dashed_line = "-" * 80
+    print(dashed_line)
+    print(f"Solution found by ant colony optimization for {args.problem_instance.name}: \n")
+    print("Min cost: ", min_cost)
+    print("Coil sequence: ", coil_sequence)
+    print("Iterations: ", ACO_solver.iterations)
+    print("\nSolve Time = ", format(solve_time, '.6f'), "seconds\n")
@@ -0,0 +1,186 @@
+"""
+Additive bounding of the subproblems, in the style of Fischetti and Toth
+
+The MAP lower bound of a subproblem ignores the subtours of its solution, so it is
+weak for instances whose MAP solutions have many subtours. The additive bounding
+procedure strengthens it with bounds which forbid subtours, computed on the reduced
+costs of the MAP instead of on the costs, so that the bounds add up:
+
+Every tour is an assignment, so with the optimal MAP dual potentials (u, v) the
+cost of a tour is sum(u) + sum(v) plus the sum of the reduced costs
+c[i, j] - u[i] - v[j] >= 0 of its edges. A bounding procedure applied to the
+reduced costs returns a lower bound L on the reduced cost of any tour, and the
+residual reduced costs (still non negative) of the edges, such that the reduced
+cost of every tour is at least L plus its residual reduced cost. The bound of a
+subproblem is then sum(u) + sum(v) + L, and further procedures can be chained on the
+residual reduced costs, each adding its own bound.
+
+The procedures (ADDITIVE_BOUND_PROCEDURES) are the shortest spanning
+r-arborescence bound (every job of a tour other than the root job r is entered by a
+path from r, so a tour contains a spanning arborescence rooted at r), and the
+shortest spanning r-anti-arborescence bound (the same on the reversed graph, every
+job has a path to r). Both are computed by the dual ascent of the Chu-Liu/Edmonds
+algorithm: the minimum reduced cost of the edges entering each job is subtracted
+from them, and each cycle of zero reduced cost edges is contracted into a
+component, whose entering edges' minimum reduced cost is then subtracted, until the
+zero reduced cost edges contain a spanning arborescence. Each subtracted minimum is
+a dual variable of a set of jobs (not containing r) that every tour enters at least
+once, so their sum is a lower bound, and is the cost of the shortest arborescence.
+"""
+from src.instance_parser import NA
+import numpy as np
+
+
+# the job at the root of the arborescences, the dummy job 0
+ARBORESCENCE_ROOT = 0
+
+# the bounding procedures chained by default
+DEFAULT_ADDITIVE_BOUNDS = ("r_arborescence", "r_anti_arborescence")
+
+
+def get_additive_lower_bound(cost_matrix, u, v, procedures):
+    # the lower bound of a subproblem, given its (dense) cost matrix and the
+    # optimal dual potentials (u, v) of its MAP, obtained by chaining the bounding
+    # procedures (names of ADDITIVE_BOUND_PROCEDURES) on the reduced costs of the
+    # MAP, and the residual reduced costs of the edges (inf for the infeasible
+    # edges). The bound is infinite if a procedure shows the subproblem has no
+    # tour. Returns None if the potentials aren't dual feasible
+    reduced_costs = np.where(cost_matrix != NA,
+                             cost_matrix - u[:, np.newaxis] - v[np.newaxis, :],
+                             np.inf)
+    if (reduced_costs < 0).any():
+        return None
+
+    lower_bound = u.sum() + v.sum()
+    for procedure in procedures:
+        procedure_lower_bound, reduced_costs = \
+            ADDITIVE_BOUND_PROCEDURES[procedure](reduced_costs)
+        lower_bound += procedure_lower_bound
+
+        if lower_bound == np.inf:
+            break
+
+    return lower_bound, reduced_costs
+
+
+def r_arborescence_bound(reduced_costs, root=ARBORESCENCE_ROOT):
+    # the cost of the shortest spanning arborescence rooted at root of the reduced
+    # costs, and the residual reduced costs of the dual ascent (see the module
+    # docstring). The bound is infinite, and the residual reduced costs None, if a
+    # job can't be reached from the root
+    n = reduced_costs.shape[0]
+
+    # the dual ascent runs on the contracted graph of the components (the
+    # contracted cycles), whose matrix holds the minimum residual reduced cost of
+    # the edges from each component to each other component
+    component_costs = reduced_costs.copy()
+    np.fill_diagonal(component_costs, np.inf)
+    job_components = np.arange(n)
+
+    # the reduced cost subtracted so far from the edges entering each job from
+    # outside its component, and for the edges inside the components, the reduced
+    # cost subtracted from them before their tail and head were contracted
+    # together, from which the residual reduced costs are recovered at the end
+    job_reductions = np.zeros(n)
+    contracted = np.eye(n, dtype=bool)
+    contracted_reductions = np.zeros((n, n))
+    lower_bound = 0
+
+    while True:
+        root_component = job_components[root]
+
+        # dual ascent: the minimum reduced cost of the edges entering each
+        # component is subtracted from them
+        min_costs = component_costs.min(axis=0)
+        min_costs[root_component] = 0
+        if np.isinf(min_costs).any():
+            return np.inf, None
+
+        component_costs -= min_costs[np.newaxis, :]
+        lower_bound += min_costs.sum()
+        job_reductions += min_costs[job_components]
+
+        # a zero reduced cost edge entering each component other than the root's,
+        # as the component of its tail, and the cycles of these edges
+        predecessors = component_costs.argmin(axis=0)
+        predecessors[root_component] = root_component
+        cycle_labels = find_cycle_labels(predecessors)
+        cycle_labels[root_component] = -1
+        if (cycle_labels < 0).all():
+            break
+
+        # the cycles are contracted into components
+        cycle_jobs = np.flatnonzero(cycle_labels[job_components] >= 0)
+        cycle_edges = (cycle_jobs[:, np.newaxis], cycle_jobs[np.newaxis, :])
+        cycle_job_labels = cycle_labels[job_components[cycle_jobs]]
+        newly_contracted = ((cycle_job_labels[:, np.newaxis]
+                             == cycle_job_labels[np.newaxis, :])
+                            & ~contracted[cycle_edges])
+        contracted_reductions[cycle_edges] = np.where(
+            newly_contracted, job_reductions[np.newaxis, cycle_jobs],
+            contracted_reductions[cycle_edges])
+        contracted[cycle_edges] |= newly_contracted
+
+        # (the components of a cycle are merged into its smallest component, the
+        # components are renumbered in order, and the costs of the edges of the
+        # contracted components are their minimums)
+        merged_components = np.where(cycle_labels >= 0, cycle_labels,
+                                     np.arange(cycle_labels.size))
+        new_components = (np.cumsum(merged_components == np.arange(
+            merged_components.size)) - 1)[merged_components]
+        order = np.argsort(new_components, kind="stable")
+        starts = np.concatenate(
+            ([0], np.cumsum(np.bincount(new_components))[:-1]))
+        component_costs = np.minimum.reduceat(
+            np.minimum.reduceat(component_costs[order][:, order], starts,
+                                axis=0),
+            starts, axis=1)
+        np.fill_diagonal(component_costs, np.inf)
+        job_components = new_components[job_components]
+
+    residual_reduced_costs = reduced_costs - np.where(
+        contracted, contracted_reductions, job_reductions[np.newaxis, :])
+
+    return lower_bound, residual_reduced_costs
+
+
+def r_anti_arborescence_bound(reduced_costs, root=ARBORESCENCE_ROOT):
+    # the cost of the shortest spanning anti-arborescence rooted at root (every job
+    # has a path to the root) of the reduced costs, i.e. the shortest arborescence
+    # of the reversed graph, and the residual reduced costs of the dual ascent
+    lower_bound, residual_reduced_costs = r_arborescence_bound(reduced_costs.T,
+                                                               root)
+    if residual_reduced_costs is None:
+        return lower_bound, None
+
+    return lower_bound, residual_reduced_costs.T
+
+
+def find_cycle_labels(successors):
+    # utility function
+    # for the graph in which each vertex has a single edge to its successor, the
+    # label of each vertex on a cycle (the smallest vertex of its cycle), -1 for
+    # the vertices not on a cycle
+    # every vertex reaches a cycle in less than n steps, so the vertices on cycles
+    # are the ones reached after n steps, and the smallest vertex of each cycle is
+    # found by following the edges 2^k steps at a time (pointer doubling)
+    n = successors.size
+    jumps = successors.copy()
+    labels = np.minimum(np.arange(n), successors)
+    steps = 1
+    while steps < n:
+        labels = np.minimum(labels, labels[jumps])
+        jumps = jumps[jumps]
+        steps *= 2
+
+    on_cycle = np.zeros(n, dtype=bool)
+    on_cycle[jumps] = True
+
+    return np.where(on_cycle, labels, -1)
+
+
+# the bounding procedures which can be chained by the additive bounding, by name
+ADDITIVE_BOUND_PROCEDURES = {
+    "r_arborescence": r_arborescence_bound,
+    "r_anti_arborescence": r_anti_arborescence_bound,
+}
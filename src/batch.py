@@ -0,0 +1,214 @@
+"""
+Batch solves of many problem instances in parallel
+
+The instances are solved by a pool of worker processes, one sequential branch and
+bound solve (see CGLSP.py) per process, each under the same per instance budget
+(time, node and memory limits). By default there are as many worker processes as
+CPUs available to the batch.
+
+- the instances are scheduled largest first, so the longest solves don't start last
+  and the batch finishes as early as possible
+- each solve runs in a fresh worker process, so its peak memory usage (and memory
+  limit) is its own, and its console output goes to its own log file
+- the result of each solve is appended to the results csv file as soon as it is
+  completed, by the main process only, so the results of the finished solves are
+  kept if the batch is interrupted, and previous results are never overwritten
+
+Usage: python -m src.batch <instance paths or globs> [--time-limit S]
+       [--node-limit N] [--memory-limit MB] [--processes P] [--results <file>]
+"""
+from src.CGLSP import (CGLSP, InfeasibleCGLSPInstanceException,
+                       add_solver_arguments, solver_options_from_args)
+from src.instance_parser import get_instance_cost_matrix
+from pathlib import Path
+import contextlib
+import csv
+import glob
+import multiprocessing
+import os
+import time
+
+
+DEFAULT_RESULTS_PATH = "results/batch_results.csv"
+
+# the columns of the results csv file, those of CGLSP.get_result
+RESULT_FIELDS = ["Problem Instance", "# Coils to sequence", "Min Cost",
+                 "Optimal Sequence", "Solve Time (s)", "# Explored Subproblems",
+                 "Status", "Lower Bound", "Optimality Gap", "Time Limit (s)",
+                 "Node Limit", "Memory Limit (MB)", "Epsilon"]
+
+# status of the solves of the instances without feasible solutions
+SOLVE_STATUS_INFEASIBLE = "INFEASIBLE"
+
+
+def solve_batch_instance(instance_path, solver_options, update_frequency,
+                         log_directory):
+    # solves an instance in a worker process, with its console output written to
+    # its own log file (or discarded if there is no log directory), and returns
+    # the result of the solve as a row of the results csv file
+    instance_name = Path(instance_path).stem
+    cost_matrix, problem_type = get_instance_cost_matrix(instance_path)
+
+    # CGLSP instances are passed as file paths, other instances as cost matrices
+    problem_instance = instance_path if problem_type == "CGLSP" else cost_matrix
+
+    if log_directory is None:
+        log_path = os.devnull
+    else:
+        log_path = Path(log_directory) / f"{instance_name}.log"
+
+    with open(log_path, "w") as log_file, contextlib.redirect_stdout(log_file):
+        CGLSP_instance = CGLSP(problem_instance, problem_type, update_frequency,
+                               instance_name=instance_name, log_results=False,
+                               **solver_options)
+
+        start = time.time()
+        try:
+            CGLSP_instance.solve()
+        except InfeasibleCGLSPInstanceException:
+            # the other instances of the batch are still solved
+            return {"Problem Instance": instance_name,
+                    "# Coils to sequence": CGLSP_instance.num_coils,
+                    "Solve Time (s)": round(time.time() - start, 4),
+                    "Status": SOLVE_STATUS_INFEASIBLE}
+
+    return CGLSP_instance.get_result()
+
+
+def solve_batch(instance_paths, solver_options, results_path,
+                num_processes=None, update_frequency=500, log_directory=None):
+    # solves the instances in parallel, largest first, appending the result of each
+    # solve to the results csv file as it is completed, and returns the results in
+    # the order they were completed
+    if num_processes is None:
+        num_processes = get_num_available_cpus()
+
+    instance_paths = sort_largest_first(instance_paths)
+
+    Path(results_path).parent.mkdir(parents=True, exist_ok=True)
+    if log_directory is not None:
+        Path(log_directory).mkdir(parents=True, exist_ok=True)
+
+    results = []
+    # a new worker process for every instance (maxtasksperchild=1), and the
+    # instances handed out one at a time (chunksize=1) in the order of the list
+    with multiprocessing.Pool(processes=num_processes, maxtasksperchild=1) as pool:
+        solves = pool.imap_unordered(
+            solve_batch_instance_star,
+            [(instance_path, solver_options, update_frequency, log_directory)
+             for instance_path in instance_paths],
+            chunksize=1)
+
+        for result in solves:
+            append_result(results_path, result)
+            results.append(result)
+
+            print(f"{result['Problem Instance']:>10}: {result['Status']:<16} "
+                  f"min cost {result.get('Min Cost')}, "
+                  f"{result['Solve Time (s)']} s "
+                  f"({len(results)}/{len(instance_paths)} instances)")
+
+    return results
+
+
+def solve_batch_instance_star(arguments):
+    # unpacks the arguments of solve_batch_instance for Pool.imap_unordered
+    return solve_batch_instance(*arguments)
+
+
+def append_result(results_path, result):
+    # appends a result to the results csv file, with a header row if the file is
+    # new
+    with open(results_path, "a", newline="") as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=RESULT_FIELDS,
+                                extrasaction="ignore")
+        if results_file.tell() == 0:
+            writer.writeheader()
+        writer.writerow(result)
+        results_file.flush()
+
+
+def sort_largest_first(instance_paths):
+    # the instances in non increasing order of their size (number of nodes)
+    instance_sizes = {instance_path: get_instance_cost_matrix(instance_path)[0]
+                      .shape[0] for instance_path in instance_paths}
+
+    return sorted(instance_paths, key=instance_sizes.get, reverse=True)
+
+
+def get_instance_paths(patterns):
+    # the instance files matching the paths or glob patterns
+    return sorted({path for pattern in patterns for path in glob.glob(pattern)})
+
+
+def get_num_available_cpus():
+    # the number of CPUs the process may run on (which may be less than the number
+    # of CPUs of the machine, e.g. in a container)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.batch",
+        description="Solve many CGLSP (or TSPLIB ATSP) instances in parallel, "
+                    "appending the result of each solve to a results csv file.")
+    parser.add_argument(
+        "instances", nargs="+",
+        help="Paths or glob patterns of the instances to solve, e.g. "
+             "'problem_instances/CGLSP_instances/data/*.txt'.")
+    parser.add_argument(
+        "--time-limit", type=float, default=None,
+        help="Time limit of each solve in seconds (default: no limit).")
+    parser.add_argument(
+        "--node-limit", type=int, default=None,
+        help="Maximum number of subproblems explored by each solve (default: no "
+             "limit).")
+    parser.add_argument(
+        "--memory-limit", type=float, default=None,
+        help="Maximum peak memory usage of each solve in MB (default: no limit).")
+    add_solver_arguments(parser)
+    parser.add_argument(
+        "--processes", type=int, default=None,
+        help="Number of instances solved in parallel (default: the number of "
+             "available CPUs).")
+    parser.add_argument(
+        "--results", default=DEFAULT_RESULTS_PATH,
+        help=f"Csv file the results are appended to (default: "
+             f"{DEFAULT_RESULTS_PATH}).")
+    parser.add_argument(
+        "--log-directory", type=Path, default=None,
+        help="Directory in which the console output of each solve is written to a "
+             "<instance>.log file (default: the output is discarded).")
+    parser.add_argument(
+        "--update-frequency", type=int, default=500,
+        help="Number of branchings between the progress updates in the logs "
+             "(default: 500).")
+    args = parser.parse_args()
+
+    instance_paths = get_instance_paths(args.instances)
+    if not instance_paths:
+        parser.error("no instances match the given paths or patterns")
+    if args.processes is not None and args.processes < 1:
+        parser.error("--processes must be at least 1")
+
+    solver_options = dict(solver_options_from_args(args),
+                          time_limit=args.time_limit,
+                          node_limit=args.node_limit,
+                          memory_limit=args.memory_limit)
+
+    num_processes = args.processes or get_num_available_cpus()
+    print(f"Solving {len(instance_paths)} instances in {num_processes} processes, "
+          f"appending the results to {args.results}\n")
+
+    start = time.time()
+    solve_batch(instance_paths, solver_options, args.results,
+                num_processes=num_processes,
+                update_frequency=args.update_frequency,
+                log_directory=args.log_directory)
+
+    print("\nBatch solve time = ", format(time.time() - start, '.2f'), "seconds")
@@ -0,0 +1,315 @@
+"""
+Benchmark of the branch and bound solver over all the problem instances, with
+regression tracking
+
+Every instance is solved in a fresh process, under a time and a node budget, so its
+peak memory usage is measured on its own. The results of a benchmark run are
+appended to a JSON lines results file, one record per instance, keyed by the git
+commit of the code and the solver configuration. The results can be compared to a
+stored baseline (a previous run with the same configuration) to flag regressions:
+
+- a worse best cost, or an optimality gap more than GAP_TOLERANCE larger
+- an instance that was solved to optimality within the budget no longer is
+- a solve time or a number of explored subproblems more than a tolerance above the
+  baseline (solve times below MIN_COMPARED_SOLVE_TIME are too noisy to compare)
+
+Usage: python -m src.benchmark [--instances <paths or globs>] [--time-limit S]
+       [--node-limit N] [--baseline <file>] [--update-baseline]
+"""
+from src.CGLSP import (CGLSP, InfeasibleCGLSPInstanceException,
+                       add_solver_arguments, solver_options_from_args)
+from src.bnb_tree import get_peak_memory_usage
+from src.instance_parser import get_instance_cost_matrix
+from src.metrics import to_json_number
+from pathlib import Path
+import contextlib
+import datetime
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import subprocess
+
+
+# the instances benchmarked by default
+DEFAULT_INSTANCE_PATTERNS = (
+    "problem_instances/CGLSP_instances/data/*.txt",
+    "problem_instances/TSPLIB_instances/*.atsp",
+)
+
+DEFAULT_RESULTS_PATH = "results/benchmark_results.jsonl"
+DEFAULT_BASELINE_PATH = "results/benchmark_baseline.json"
+
+# relative increase of the solve time or the number of explored subproblems over
+# the baseline which is flagged as a regression
+DEFAULT_TOLERANCE = 0.2
+
+# increase of the optimality gap over the baseline which is flagged as a
+# regression, in percentage points (the gap reached within a time limit is noisy)
+GAP_TOLERANCE = 0.01
+
+# solve times (in seconds) below which the solve time isn't compared to the baseline
+MIN_COMPARED_SOLVE_TIME = 1.0
+
+
+def benchmark_instance(instance_path, configuration):
+    # solves an instance with the solver configuration, and returns the result
+    # record of the solve (run in a separate process for each instance)
+    instance_name = Path(instance_path).stem
+    cost_matrix, problem_type = get_instance_cost_matrix(instance_path)
+
+    # CGLSP instances are passed as file paths, other instances as cost matrices
+    problem_instance = instance_path if problem_type == "CGLSP" else cost_matrix
+
+    # the solve statistics are collected by the benchmark, the console output of
+    # the solver isn't needed
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        CGLSP_instance = CGLSP(problem_instance, problem_type, 10 ** 9,
+                               collect_metrics=True, instance_name=instance_name,
+                               log_results=False, **configuration)
+
+        try:
+            CGLSP_instance.solve()
+        except InfeasibleCGLSPInstanceException:
+            # the record of an instance without feasible solutions has an
+            # infinite best cost
+            pass
+
+    bnb_tree = CGLSP_instance.bnb_tree
+
+    return {
+        "instance": instance_name,
+        "problem_type": problem_type,
+        "instance_size": cost_matrix.shape[0],
+        "status": CGLSP_instance.solve_status,
+        "best_cost": to_json_number(CGLSP_instance.min_cost),
+        "lower_bound": to_json_number(CGLSP_instance.lower_bound),
+        "optimality_gap": to_json_number(CGLSP_instance.optimality_gap),
+        "solve_time": CGLSP_instance.solve_time,
+        "explored_subproblems": bnb_tree.explored_subproblems,
+        "pruned_subproblems": bnb_tree.pruned_subproblems,
+        "branched_subproblems": bnb_tree.branched_subproblems,
+        "MAP_solve_calls": bnb_tree.MAP_solves,
+        "MAP_solve_time": bnb_tree.metrics.phase_times["MAP_solve"],
+        "peak_memory_usage_MB": get_peak_memory_usage(),
+    }
+
+
+def run_benchmark(instance_paths, configuration, results_path):
+    # benchmarks every instance, appending the result records to the results file,
+    # and returns the result records
+    commit = get_git_commit()
+    configuration_key = get_configuration_key(configuration)
+    timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+
+    results = []
+    Path(results_path).parent.mkdir(parents=True, exist_ok=True)
+    for instance_path in instance_paths:
+
+        # a new process for every instance, so the peak memory usage is the
+        # instance's own
+        with multiprocessing.Pool(processes=1, maxtasksperchild=1) as pool:
+            result = pool.apply(benchmark_instance, (instance_path, configuration))
+
+        result = dict(result, commit=commit, configuration=configuration,
+                      configuration_key=configuration_key, timestamp=timestamp)
+        results.append(result)
+
+        with open(results_path, "a") as results_file:
+            results_file.write(json.dumps(result) + "\n")
+
+        print(f"{result['instance']:>10}: {result['status']:<14} "
+              f"best cost {result['best_cost']}, gap "
+              f"{format_gap(result['optimality_gap'])}, "
+              f"{result['explored_subproblems']} explored subproblems, "
+              f"{result['solve_time']:.2f} s, "
+              f"{result['peak_memory_usage_MB']:.0f} MB")
+
+    return results
+
+
+def find_regressions(results, baseline_results, tolerance=DEFAULT_TOLERANCE):
+    # compares the result records to the baseline's result records of the same
+    # instances, and returns a description of every regression
+    regressions = []
+
+    for result in results:
+        baseline = baseline_results.get(result["instance"])
+        if baseline is None:
+            continue
+
+        instance = result["instance"]
+
+        if worse(result["best_cost"], baseline["best_cost"]):
+            regressions.append(f"{instance}: best cost {result['best_cost']} is "
+                               f"worse than the baseline's {baseline['best_cost']}")
+
+        if worse(result["optimality_gap"], baseline["optimality_gap"],
+                 GAP_TOLERANCE):
+            regressions.append(
+                f"{instance}: optimality gap {format_gap(result['optimality_gap'])} "
+                f"is larger than the baseline's "
+                f"{format_gap(baseline['optimality_gap'])}")
+
+        if baseline["status"] == "OPTIMAL" and result["status"] != "OPTIMAL":
+            regressions.append(f"{instance}: no longer solved to optimality within "
+                               f"the budget ({result['status']})")
+
+        # the solve time and the number of explored subproblems are only
+        # comparable if both solves were completed
+        if result["status"] != baseline["status"]:
+            continue
+
+        if (result["solve_time"] >= MIN_COMPARED_SOLVE_TIME
+                and result["solve_time"] > (1 + tolerance) * baseline["solve_time"]):
+            regressions.append(
+                f"{instance}: solve time {result['solve_time']:.2f} s is more than "
+                f"{tolerance:.0%} above the baseline's "
+                f"{baseline['solve_time']:.2f} s")
+
+        if (result["status"] == "OPTIMAL" and result["explored_subproblems"]
+                > (1 + tolerance) * baseline["explored_subproblems"]):
+            regressions.append(
+                f"{instance}: {result['explored_subproblems']} explored "
+                f"subproblems is more than {tolerance:.0%} above the baseline's "
+                f"{baseline['explored_subproblems']}")
+
+    return regressions
+
+
+def load_baseline(baseline_path, configuration_key):
+    # the baseline result records of the configuration, by instance
+    if not Path(baseline_path).exists():
+        return None
+
+    with open(baseline_path) as baseline_file:
+        baselines = json.load(baseline_file)
+
+    return baselines.get(configuration_key)
+
+
+def save_baseline(baseline_path, configuration_key, results):
+    # makes the result records the baseline of their configuration
+    baselines = {}
+    if Path(baseline_path).exists():
+        with open(baseline_path) as baseline_file:
+            baselines = json.load(baseline_file)
+
+    baselines[configuration_key] = {result["instance"]: result for result in results}
+
+    Path(baseline_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(baseline_path, "w") as baseline_file:
+        json.dump(baselines, baseline_file, indent=2)
+
+
+def get_instance_paths(patterns):
+    # the instance files matching the paths or glob patterns, smallest first
+    instance_paths = sorted({path for pattern in patterns
+                             for path in glob.glob(pattern)})
+
+    return sorted(instance_paths, key=os.path.getsize)
+
+
+def get_configuration_key(configuration):
+    # short hash identifying a solver configuration
+    return hashlib.sha256(
+        json.dumps(configuration, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def get_git_commit():
+    # the commit of the benchmarked code, marked as dirty if it has uncommitted
+    # changes (None outside of a git repository)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--", "src"],
+                                 capture_output=True, text=True,
+                                 check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return f"{commit}-dirty" if changes else commit
+
+
+def worse(value, baseline_value, tolerance=0):
+    # utility function
+    # whether a cost or gap is worse than the baseline's by more than tolerance
+    # (None stands for inf)
+    if value is None:
+        return baseline_value is not None
+
+    return baseline_value is not None and value > baseline_value + tolerance
+
+
+def format_gap(gap):
+    return "inf" if gap is None else format(gap, '.2%')
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.benchmark",
+        description="Benchmark the branch and bound solver over the problem "
+                    "instances, and compare the results to a baseline.")
+    parser.add_argument(
+        "--instances", nargs="+", default=list(DEFAULT_INSTANCE_PATTERNS),
+        help="Paths or glob patterns of the instances to benchmark (default: all "
+             "the CGLSP and TSPLIB instances).")
+    parser.add_argument(
+        "--time-limit", type=float, default=60,
+        help="Time limit of each solve in seconds (default: 60).")
+    parser.add_argument(
+        "--node-limit", type=int, default=None,
+        help="Maximum number of subproblems explored by each solve (default: no "
+             "limit).")
+    add_solver_arguments(parser)
+    parser.add_argument(
+        "--results", default=DEFAULT_RESULTS_PATH,
+        help=f"JSON lines file the results are appended to (default: "
+             f"{DEFAULT_RESULTS_PATH}).")
+    parser.add_argument(
+        "--baseline", default=DEFAULT_BASELINE_PATH,
+        help=f"JSON file of the baseline results, by configuration (default: "
+             f"{DEFAULT_BASELINE_PATH}).")
+    parser.add_argument(
+        "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+        help="Relative increase of the solve time or of the number of explored "
+             f"subproblems flagged as a regression (default: {DEFAULT_TOLERANCE}).")
+    parser.add_argument(
+        "--update-baseline", action="store_true",
+        help="Make the results of this run the baseline of its configuration.")
+    args = parser.parse_args()
+
+    configuration = dict(solver_options_from_args(args),
+                         time_limit=args.time_limit,
+                         node_limit=args.node_limit)
+    configuration_key = get_configuration_key(configuration)
+
+    instance_paths = get_instance_paths(args.instances)
+    if not instance_paths:
+        parser.error("no instances match the given paths or patterns")
+
+    print(f"Benchmarking {len(instance_paths)} instances with configuration "
+          f"{configuration_key}: {configuration}\n")
+    results = run_benchmark(instance_paths, configuration, args.results)
+
+    baseline_results = load_baseline(args.baseline, configuration_key)
+    regressions = []
+    if baseline_results is None:
+        print("\nNo baseline for this configuration")
+    else:
+        regressions = find_regressions(results, baseline_results, args.tolerance)
+        print(f"\nRegressions compared to the baseline: {len(regressions)}")
+        for regression in regressions:
+            print("  " + regression)
+
+    if args.update_baseline:
+        save_baseline(args.baseline, configuration_key, results)
+        print(f"\nSaved the results as the baseline of configuration "
+              f"{configuration_key}")
+
+    # a failing exit status if there are regressions, e.g. to fail a CI job
+    sys.exit(1 if regressions else 0)
@@ -1,56 +1,409 @@
 import numpy as np
-import queue
-from src.node import Node
-from src.MAP_solver import PossibleOverflowException
+import os
+import resource
+import sys
+import time
+from src.node import (Node, solve_MAP_batch, create_sibling_cost_matrices,
+                      get_cost_reduction_lower_bound_batch,
+                      create_node_from_compact_subproblem)
+from src.MAP_solver import (PossibleOverflowException, get_MAP_solver,
+                            get_dual_potentials, SPARSE_MAP_SOLVERS)
+from src.instance_parser import get_feasible_edges_CSR, NA
+from src.additive_bounds import (ADDITIVE_BOUND_PROCEDURES,
+                                 DEFAULT_ADDITIVE_BOUNDS, get_additive_lower_bound)
+from src.aco_solver import ACO_Solver
+from src.concurrent_heuristic import Concurrent_Heuristic
+from src.open_list import Open_List
+from src.metrics import Solver_Metrics
+from src.checkpoint import (get_instance_fingerprint, read_checkpoint,
+                            write_checkpoint)
+from src.heuristics import (get_heuristic_costs, get_candidate_lists,
+                            subtour_patching_heuristic)
+
+
+# how often (in number of branchings) the included edges of the subproblem being
+# branched are sent to the concurrent heuristic as a seed
+HEURISTIC_SEED_FREQUENCY = 100
+
+# the default time (in seconds) between two checkpoints of the search
+DEFAULT_CHECKPOINT_INTERVAL = 600
+
+# the statuses of a solve: the search was completed, so the best solution found
+# is optimal, or the search was stopped by one of its limits
+SOLVE_STATUS_OPTIMAL = "OPTIMAL"
+SOLVE_STATUS_EPSILON_OPTIMAL = "EPSILON_OPTIMAL"
+SOLVE_STATUS_TIME_LIMIT = "TIME_LIMIT"
+SOLVE_STATUS_NODE_LIMIT = "NODE_LIMIT"
+SOLVE_STATUS_MEMORY_LIMIT = "MEMORY_LIMIT"
+SEARCH_LIMIT_STATUSES = (SOLVE_STATUS_TIME_LIMIT, SOLVE_STATUS_NODE_LIMIT,
+                         SOLVE_STATUS_MEMORY_LIMIT)
+
+# the branching rules, which choose the subtour of a subproblem's MAP solution its
+# children are created from, and the order in which its edges are fixed:
+# - carpaneto_toth: the subtour with the fewest edges not yet included, ties
+#   broken by the largest total exclusion penalty, with its edges in decreasing
+#   order of their exclusion penalties (see Node.get_exclusion_penalties)
+# - tour_order: the first subtour with the fewest edges not yet included, with its
+#   edges in the order of the subtour
+BRANCHING_RULE_CARPANETO_TOTH = "carpaneto_toth"
+BRANCHING_RULE_TOUR_ORDER = "tour_order"
+BRANCHING_RULES = (BRANCHING_RULE_CARPANETO_TOTH, BRANCHING_RULE_TOUR_ORDER)
+
+# the solve statistics saved in the checkpoints of the search
+CHECKPOINT_STATISTICS = (
+    "explored_subproblems",
+    "optimal_subproblem_solutions_found",
+    "pruned_subproblems",
+    "branched_subproblems",
+    "heuristic_upper_bound_updates",
+    "concurrent_heuristic_upper_bound_updates",
+    "MAP_solves",
+)
 
 
 class BnB_Tree:
-    def __init__(self, root_cost_matrix, instance_size, update_frequency):
-        self.root_cost_matrix = root_cost_matrix
+    def __init__(self, root_cost_matrix, instance_size, update_frequency,
+                 MAP_solver="jv", subtour_patching=True,
+                 patching_local_search=False, ACO_time_limit=0,
+                 concurrent_heuristic=False, max_nodes_in_memory=None,
+                 spill_directory=None, checkpoint_path=None,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, resume=False,
+                 time_limit=None, node_limit=None, memory_limit=None, epsilon=0,
+                 progress_callback=None, trace_path=None, collect_metrics=False,
+                 arc_elimination=True, root_dual_potentials=None,
+                 branching_rule=BRANCHING_RULE_CARPANETO_TOTH,
+                 additive_bounds=DEFAULT_ADDITIVE_BOUNDS):
+        # the arcs eliminated from the search are removed from the root cost
+        # matrix in place (see eliminate_arcs), so the tree works on its own copy
+        self.root_cost_matrix = self.get_search_cost_matrix(root_cost_matrix)
         self.instance_size = instance_size
+        self.MAP_solver = get_MAP_solver(MAP_solver)
+
+        # the root cost matrix in the form taken by the MAP solver, i.e. for sparse
+        # MAP solvers a CSR matrix of the feasible edges, built once for the solve
+        if MAP_solver in SPARSE_MAP_SOLVERS:
+            self.MAP_cost_matrix = get_feasible_edges_CSR(self.root_cost_matrix)
+        else:
+            self.MAP_cost_matrix = self.root_cost_matrix
+
         self.root_node = Node(
-            root_cost_matrix,
+            self.MAP_cost_matrix,
             instance_size=instance_size,
             included_edges=[],
             excluded_edges=[],
             lower_bound=0,
+            MAP_solver=self.MAP_solver,
         )
-        self.unpruned_nodes = queue.PriorityQueue()
+        # the unpruned subproblems, of which at most max_nodes_in_memory are kept in
+        # memory, the others are spilled to disk (see open_list.py)
+        self.unpruned_nodes = Open_List(self.restore_node,
+                                        max_nodes_in_memory=max_nodes_in_memory,
+                                        spill_directory=spill_directory)
         self.best_cost = np.inf
         self.best_solution = []
         self.explored_subproblems = 0
         self.optimal_subproblem_solutions_found = 0
         self.pruned_subproblems = 0
         self.branched_subproblems = 0
+        # the number of MAP relaxations solved (the subproblems of a branching are
+        # solved in one batched call)
+        self.MAP_solves = 0
 
         self.update_frequency = update_frequency
 
+        # whether the subtours of the MAP solution of each branched subproblem are
+        # patched into a tour to find better solutions (upper bounds), and whether
+        # the patched tours are improved by local search
+        self.subtour_patching = subtour_patching
+        self.patching_local_search = patching_local_search
+        self.heuristic_costs = get_heuristic_costs(self.root_cost_matrix)
+        self.heuristic_candidates = None
+        if patching_local_search:
+            self.heuristic_candidates = get_candidate_lists(self.heuristic_costs)
+        self.heuristic_upper_bound_updates = 0
+
+        # time limit (in seconds) of the ant colony optimization run improving the
+        # initial solution, no ant colony optimization is run if it is 0
+        self.ACO_time_limit = ACO_time_limit
+
+        # whether an improvement heuristic runs in a separate process during the
+        # search, exchanging best solutions and seeds with the tree (see
+        # concurrent_heuristic.py). The heuristic works on the costs of all the arcs,
+        # as the arc elimination of the root node eliminates those of the initial
+        # solution it starts from
+        self.concurrent_heuristic = concurrent_heuristic
+        self.heuristic_cost_matrix = None
+        if concurrent_heuristic:
+            self.heuristic_cost_matrix = self.root_cost_matrix.copy()
+        self.heuristic_process = None
+        self.concurrent_heuristic_upper_bound_updates = 0
+
+        # the search state is saved to the checkpoint file every checkpoint_interval
+        # seconds, and if resume is True the search continues from the checkpoint
+        # file instead of starting from the root node (see checkpoint.py)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.resume = resume
+        self.last_checkpoint_time = time.time()
+        self.instance_fingerprint = None
+        if checkpoint_path is not None:
+            self.instance_fingerprint = get_instance_fingerprint(
+                self.root_cost_matrix)
+
+        # limits of the search (None for no limit): the solve time in seconds, the
+        # number of explored subproblems, and the peak memory usage of the process
+        # in MB. The search stops when one of them is reached, and the best solution
+        # found is returned along with the global lower bound on the optimal cost
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.memory_limit = memory_limit
+        self.start_time = None
+
+        # relative optimality tolerance: subproblems are pruned if their lower
+        # bound is at least best cost / (1 + epsilon), so the best solution found
+        # is within a factor 1 + epsilon of the optimal cost
+        self.epsilon = epsilon
+
+        # the status of the solve (one of the SOLVE_STATUS constants), and the
+        # global lower bound on the optimal cost and the optimality gap of the best
+        # solution when the solve ended
+        self.solve_status = None
+        self.lower_bound = 0
+        self.optimality_gap = np.inf
+
+        # the lower bound of the subproblem being branched, which isn't in the
+        # unpruned nodes queue (inf if no subproblem is being branched)
+        self.branched_node_lower_bound = np.inf
+
+        # the bounding procedures (names of ADDITIVE_BOUND_PROCEDURES) chained on
+        # the reduced costs of the MAP of each subproblem that can't be pruned by
+        # its MAP lower bound, to strengthen it (see additive_bounds.py), no
+        # additive bounding if it's empty
+        for procedure in additive_bounds:
+            if procedure not in ADDITIVE_BOUND_PROCEDURES:
+                raise ValueError(f"Unknown additive bound procedure: {procedure}")
+        self.additive_bounds = tuple(additive_bounds)
+
+        # reduced cost arc elimination: the root MAP's dual potentials give a lower
+        # bound on the cost of any tour using each arc, and the arcs whose bound
+        # reaches the pruning bound are removed from the root cost matrix, so they
+        # are no longer offered to any subproblem. The dual potentials are those of
+        # the root node (or given, e.g. for the workers of a parallel search)
+        self.arc_elimination = arc_elimination
+        self.root_dual_potentials = None
+        self.arc_lower_bounds = None
+        self.eliminated_arcs = 0
+        if arc_elimination and root_dual_potentials is not None:
+            self.set_arc_lower_bounds(root_dual_potentials)
+
+        # the rule choosing the edges fixed in the children of a branched
+        # subproblem (one of BRANCHING_RULES)
+        if branching_rule not in BRANCHING_RULES:
+            raise ValueError(f"Unknown branching rule: {branching_rule}")
+        self.branching_rule = branching_rule
+
+        # per phase timers and the bound trajectory of the search, reported to
+        # progress_callback and/or the JSON lines trace file (see metrics.py), or
+        # only collected if collect_metrics is True
+        self.metrics = Solver_Metrics(callback=progress_callback,
+                                      trace_path=trace_path,
+                                      enabled=collect_metrics or None)
+
+    def get_search_cost_matrix(self, root_cost_matrix):
+        # the root cost matrix of the search, a private int64 copy of the given
+        # cost matrix, which is never modified
+        return np.array(root_cost_matrix, dtype=np.int64)
+
     def solve(self):
+        self.start_time = time.time()
+
+        # Continue the search from the checkpoint, or process the root node, which
+        # may already solve the CGLSP
+        if self.resume:
+            self.resume_from_checkpoint()
+
+        else:
+            with self.metrics.timer("root_node"):
+                root_solved = self.process_root_node()
+
+            if root_solved:
+                self.set_final_bounds()
+                self.metrics.record_event("end", self)
+                self.metrics.close()
+                return self.get_final_solution()
+
+        self.metrics.record_event("root", self)
+
+        if self.concurrent_heuristic:
+            self.heuristic_process = Concurrent_Heuristic(
+                self.heuristic_cost_matrix, self.best_solution)
+
+        try:
+            self.search()
+
+            # the checkpoint of a completed search is no longer needed, whereas a
+            # search stopped by a limit can be resumed from its last state
+            if self.checkpoint_path is not None:
+                if self.solve_status in SEARCH_LIMIT_STATUSES:
+                    self.save_checkpoint()
+                elif os.path.exists(self.checkpoint_path):
+                    os.remove(self.checkpoint_path)
+
+            self.metrics.record_event("end", self)
+
+        finally:
+            if self.heuristic_process is not None:
+                self.heuristic_process.stop()
+            self.unpruned_nodes.close()
+            self.metrics.close()
+
+        # Output fianl solution statistics once the optimal solution has been found
+        self.print_statistics()
+
+        return self.get_final_solution()
+
+    def search(self):
+        # best first search of the unpruned subproblems
+
+        # while there are still subproblems with potentially better solutions
+        # than the best solution obtained so far, explore those unpruned subproblems
+        while not self.unpruned_nodes.empty():
+
+            # prune against the better solutions found by the concurrent heuristic
+            if self.heuristic_process is not None:
+                self.receive_heuristic_solutions()
+                if self.unpruned_nodes.empty():
+                    break
+
+            # stop the search if one of its limits is reached
+            self.solve_status = self.check_limits()
+            if self.solve_status is not None:
+                break
+
+            # if a subproblem is in the queue that's because it needs to be explored
+            # Its lower bound is lower than the currently best known solution
+            # and its MAP solution (relaxation) is not feasible for CGLSP because it
+            # consists of subtours
+            # We need to branch the current subproblem
+            # - i.e. create children subproblems and then iterate over the children
+            # subproblems
+
+            # obtain the current unpruned subproblem with the lowest lower bound
+            # by popping the min item from the unpruned nodes priority queue
+            with self.metrics.timer("queue_operations"):
+                cur_node = self.unpruned_nodes.get()[1]
+            self.branched_node_lower_bound = cur_node.lower_bound
+
+            self.branched_subproblems += 1
+
+            # if we have branched a multiple of update_frequency times
+            # output solver progress updates to the console
+            if self.branched_subproblems % self.update_frequency == 0:
+                self.print_progress()
+                self.metrics.record_event("progress", self)
+
+            # send the included edges of the subproblems branched every
+            # HEURISTIC_SEED_FREQUENCY branchings (the most promising unpruned
+            # subproblems) to the concurrent heuristic, to construct new tours from
+            if (self.heuristic_process is not None
+                    and self.branched_subproblems % HEURISTIC_SEED_FREQUENCY == 0):
+                self.heuristic_process.send_seed(cur_node.included_edges)
+
+            self.explore_node(cur_node)
+            self.branched_node_lower_bound = np.inf
+
+            if (self.checkpoint_path is not None and time.time()
+                    - self.last_checkpoint_time >= self.checkpoint_interval):
+                self.save_checkpoint()
+
+        self.set_final_bounds()
+
+        return
+
+    def set_final_bounds(self):
+        # the search was completed, unless it was stopped by a limit
+        if self.solve_status is None:
+            if self.epsilon == 0:
+                self.solve_status = SOLVE_STATUS_OPTIMAL
+            else:
+                self.solve_status = SOLVE_STATUS_EPSILON_OPTIMAL
+
+        self.lower_bound = self.get_lower_bound()
+        self.optimality_gap = get_optimality_gap(self.best_cost, self.lower_bound)
+
+    def check_limits(self):
+        # the status of the solve if one of the limits of the search is reached,
+        # None otherwise
+        if (self.time_limit is not None
+                and time.time() - self.start_time >= self.time_limit):
+            return SOLVE_STATUS_TIME_LIMIT
+
+        if (self.node_limit is not None
+                and self.explored_subproblems >= self.node_limit):
+            return SOLVE_STATUS_NODE_LIMIT
+
+        if (self.memory_limit is not None
+                and get_peak_memory_usage() >= self.memory_limit):
+            return SOLVE_STATUS_MEMORY_LIMIT
+
+        return None
+
+    def get_lower_bound(self):
+        # the global lower bound on the optimal cost: the best lower bound of the
+        # unpruned subproblems, or the lowest lower bound the pruned subproblems
+        # may have had (the best cost if epsilon is 0)
+        return min(self.best_cost, self.unpruned_nodes.min_priority(),
+                   self.branched_node_lower_bound,
+                   get_epsilon_lower_bound(self.best_cost, self.epsilon))
+
+    def get_pruning_bound(self):
+        # subproblems whose lower bound is at least the pruning bound can't contain
+        # a solution better than the best solution by more than a factor 1 + epsilon
+        return self.best_cost / (1 + self.epsilon)
+
+    def process_root_node(self):
+        # explores the root node, i.e. finds an initial solution and lower bounds
+        # the full problem, and adds the root node to the unpruned nodes queue if it
+        # has to be branched
+        # returns True if the CGLSP has been solved (or shown to have no feasible
+        # solutions) without branching
 
-        # Process the root node
         self.explored_subproblems += 1
 
         # Find initial feasible solution (using a heuristic solve)
-        # UNCOMMENT when you have implemented the heuristic solver
-        # self.best_cost, self.best_solution = self.root_node.get_feasible_sol()
+        # if the heuristic doesn't find a feasible solution, the best cost remains
+        # infinite and the branch and bound determines whether there is one
+        self.best_cost, self.best_solution = self.root_node.get_feasible_sol()
 
-        # best cost of -1 is returned when there are no feasible solutions to CGLSP
-        if self.best_cost == -1:
-            return self.best_cost, self.best_solution
+        # try to improve the initial solution with ant colony optimization, seeded
+        # with the initial solution
+        if self.ACO_time_limit > 0:
+            ACO_cost, ACO_solution = ACO_Solver(
+                self.root_cost_matrix, time_limit=self.ACO_time_limit
+            ).solve(initial_solution=self.best_solution)
+
+            if ACO_cost < self.best_cost:
+                self.best_cost, self.best_solution = ACO_cost, ACO_solution
 
         # Find an initial lower bound on CGLSP using a cost reduction method
         self.root_node.get_cost_reduction_lower_bound()
 
+        # an infinite lower bound means some job has no feasible successor or
+        # predecessor, so the CGLSP has no feasible solutions
+        if self.root_node.lower_bound == np.inf:
+            return True
+
         # if the determined lower bound by cost reduction is the
         # the same as the best cost found so far
         # then our initial feasible solution is optimal
-        if self.root_node.lower_bound == self.best_cost:
+        if self.root_node.lower_bound >= self.get_pruning_bound():
             self.optimal_subproblem_solutions_found += 1
-            return self.best_cost, self.best_solution
+            return True
 
         # otherwise, we attempt to tighten the lower bound by solving
         # the MAP relaxation of the CGLSP:
         self.root_node.solve_MAP()
+        self.MAP_solves += 1
 
         # check if MAP relaxation was solved without any possible integer
         # overflow issues
@@ -60,12 +413,17 @@ class BnB_Tree:
                  Failed with a possible integer overflow"
             )
 
+        # if the MAP relaxation has no feasible solution, then neither does the
+        # CGLSP
+        if self.root_node.MAP_solve_status == "INFEASIBLE":
+            return True
+
         # if the MAP optimal solution established a tighter lower bound that
         # is the same as the best found cost so far then we've already found the
         # optimal solution
-        if self.root_node.lower_bound == self.best_cost:
+        if self.root_node.lower_bound >= self.get_pruning_bound():
             self.optimal_subproblem_solutions_found += 1
-            return self.best_cost, self.best_solution
+            return True
 
         # Otherwise, if the MAP lower bound is lower than the current best cost
         # (as was the cost reduction lower bound), then either
@@ -76,148 +434,212 @@ class BnB_Tree:
         #   is an optimal solution for the CGLSP
         elif self.root_node.MAP_sol_CGLSP_feasible():
             self.optimal_subproblem_solutions_found += 1
-            self.best_cost = self.root_node.MAP_best_cost
-            self.best_solution = self.root_node.MAP_solution
+            self.update_best_solution(
+                self.root_node.MAP_min_cost, self.root_node.MAP_solution)
 
-            return self.best_cost, self.best_solution
+            return True
 
         # 2. otherwise if the MAP optimal solution is not CGLSP feasible,
         #    then the best solution may yet not have been found, so we need
         #    to explore subproblems by branching (uing the MAP solution to
         #    branch)
         else:
+            # the MAP lower bound is strengthened by additive bounding, which may
+            # show that the best solution found is optimal
+            if self.additive_bounds:
+                self.root_node.get_additive_lower_bound(self.additive_bounds,
+                                                        self.root_cost_matrix)
+
+                if self.root_node.lower_bound >= self.get_pruning_bound():
+                    self.optimal_subproblem_solutions_found += 1
+                    return True
+
+            # the arcs which can't be in a better solution than the best solution
+            # found are eliminated before any subproblem is created
+            if self.arc_elimination:
+                self.set_arc_lower_bounds(get_dual_potentials(
+                    self.root_cost_matrix, self.root_node.MAP_solver_state))
+                self.eliminate_arcs()
+
             node_priority = self.root_node.lower_bound
             self.unpruned_nodes.put((node_priority, self.root_node))
 
-        # while there are still subproblems with potentially better solutions
-        # than the best solution obtained so far, explore those unpruned subproblems
-        while not self.unpruned_nodes.empty():
+        return False
 
-            # if a subproblem is in the queue that's because it needs to be explored
-            # Its lower bound is lower than the currently best known solution
-            # and its MAP solution (relaxation) is not feasible for CGLSP because it
-            # consists of subtours
-            # We need to branch the current subproblem
-            # - i.e. create children subproblems and then iterate over the children
-            # subproblems
+    def explore_node(self, cur_node):
+        # explores a subproblem popped off the unpruned nodes queue: it is branched,
+        # and its children subproblems are either pruned, provide a new best
+        # solution or are added to the unpruned nodes queue to be branched later
 
-            # obtain the current unpruned subproblem with the lowest lower bound
-            # by popping the min item from the unpruned nodes priority queue
-            cur_node = self.unpruned_nodes.get()[1]
+        # the subtours of the current subproblem's MAP solution, used both to
+        # branch the subproblem and to find a tour by patching them together
+        with self.metrics.timer("subtour_extraction"):
+            subtours = self.find_subtours(cur_node.MAP_solution)
 
-            self.branched_subproblems += 1
+        # if patching the subtours finds a better solution than the best known
+        # solution, the current subproblem may no longer need to be branched
+        if self.subtour_patching:
+            with self.metrics.timer("subtour_patching"):
+                self.update_upper_bound_by_patching(subtours)
 
-            # if we have branched a multiple of update_frequency times
-            # output solver progress updates to the console
+            if cur_node.lower_bound >= self.get_pruning_bound():
+                self.pruned_subproblems += 1
+                cur_node.discard_MAP_solution()
+                return
 
-            if self.branched_subproblems % self.update_frequency == 0:
-                dashed_line = "-" * 80
-                print(dashed_line)
-                print(f"Solution progress after branching {self.branched_subproblems} times: \n")
-                print("Min cost found so far: ", self.best_cost)
-                print("Explored subproblems: ",
-                      self.explored_subproblems)
-                print("Upper bound updates: ",
-                      self.optimal_subproblem_solutions_found)
-                print("Pruned subproblems: ",
-                      self.pruned_subproblems)
-                print("Branched supbroblems: ",
-                      self.branched_subproblems)
-                print("Current subproblems still required to process: ",
-                      self.unpruned_nodes.qsize())
-
-            # branch the current subproblem just popped of the queue
-            children_nodes = self.branch(cur_node)
-
-            # for each of the branched subproblems, process them
-            for node in children_nodes:
-
-                self.explored_subproblems += 1
-
-                # First we attempt to prune the node from branch and bound tree by
-                # calculating a tighter lower bound than the lower bound
-                # inherited from its parent, using cost reduction
-                # We will update the known lower bound for this subproblem if the cost
-                # reduction lower bound is higher than the current lower bound
-                node.get_cost_reduction_lower_bound()
-
-                # if the lower bound determined by cost reduction is at least as
-                # high as the cost of the best known solution, then there is not a more
-                # optimal solution in this subtree, in which case we can prune it
-                if node.lower_bound >= self.best_cost:
-                    self.pruned_subproblems += 1
-                    continue
-
-                # otherwise, if the initial lower bound found using cost reduction
-                # is lower than our known best cost, then solve the Modified Assignment
-                # problem for this subproblem.
-                # The obtained optimal MAP solution for this subproblem could result in:
-                #   1. Pruning the subproblem, if the MAP optimal cost which is a lower
-                #      bound on the subproblem, is at least as high as the best cost
-                #      known so far, as then this subtree can't contain the optimal
-                #      solution, or
-                #   2. Finding a new best solution if the MAP optimal solution is CGLSP
-                #      feasible and has lower cost then our current best cost,
-                #      as well as pruning the subproblem, because then the MAP optimal
-                #      solution is the optimal solution for this subproblem and so we
-                #      don't need to explore the subproblem further, or
-                #   3. The need to branch this subproblem further if we can't
-                #      establish a higher lower bound on the subproblem than
-                #      our current best solution
-
-                node.solve_MAP()
-
-                # Check if there is no feasible solution for the MAP relaxation of the
-                # subproblem. If this is the case then there is no feasible solutions
-                #  for the subproblem at all and therefore the subproblem can be pruned
-                if node.MAP_solve_status == "INFEASIBLE":
-                    self.pruned_subproblems += 1
-                    continue
-
-                # check if MAP relaxation was solved without an integer overflow issue
-                if node.MAP_solve_status == "POSSIBLE_OVERFLOW":
-                    raise PossibleOverflowException(
-                        "MAP Solver couldn't solve MAP relaxation for this subproblem. \
-                                              Failed with a possible integer overflow"
-                    )
-
-                # otherwise, if a feasible solution for the MAP relaxation of the
-                # subproblem was found
-                # and if the (new) lower bound found for this subproblem is at least as
-                # high as the cost of the best known solution, then there is not a more
-                # optimal solution in this subtree
-                if node.lower_bound >= self.best_cost:
-                    self.pruned_subproblems += 1
-                    continue
-
-                # otherwise, if the MAP lower bound is lower than the current best
-                # cost (and so is the cost reduction lower bound)
-                # then if:
-                #        1. the MAP found a feasible solution to the CGLSP, then this
-                #           solution is the best known solution so far
-                #           and this solution is the best for this subproblem,
-                #           so we don't need to explore it further
-                #        2. otherwise, the best solution may be in this subset of the
-                #           solution space, in which case we need to use the MAP
-                #           solution to branch this subproblem
-                else:
-                    if node.MAP_sol_CGLSP_feasible():
-                        self.optimal_subproblem_solutions_found += 1
+        # branch the current subproblem just popped of the queue
+        # (the Carpaneto-Toth rule uses its reduced costs, so its subproblem cost
+        # matrix is materialized for the branching, and reused as the parent cost
+        # matrix of its children's cost matrices)
+        with self.metrics.timer("branching"):
+            cur_node_cost_matrix = None
+            if self.branching_rule == BRANCHING_RULE_CARPANETO_TOTH:
+                cur_node_cost_matrix = cur_node.subproblem_cost_matrix
+            children_nodes = self.branch(cur_node, subtours, cur_node_cost_matrix)
+
+        # materialize the children's subproblem cost matrices together, they are
+        # used both for their cost reduction lower bounds and their MAPs
+        with self.metrics.timer("subproblem_matrix_construction"):
+            children_cost_matrices = create_sibling_cost_matrices(
+                children_nodes, cur_node_cost_matrix)
+
+        # First we attempt to prune the children from branch and bound tree by
+        # calculating a tighter lower bound than the lower bound
+        # inherited from their parent, using cost reduction
+        # We will update the known lower bound for each subproblem if the cost
+        # reduction lower bound is higher than the current lower bound
+        with self.metrics.timer("cost_reduction_bound"):
+            get_cost_reduction_lower_bound_batch(
+                children_nodes, children_cost_matrices)
+
+        # for each of the branched subproblems, first attempt to prune them
+        unpruned_children_nodes = []
+        unpruned_children_indices = []
+        for b, node in enumerate(children_nodes):
+
+            self.explored_subproblems += 1
+
+            # if the lower bound determined by cost reduction is at least as
+            # high as the cost of the best known solution, then there is not a more
+            # optimal solution in this subtree, in which case we can prune it
+            if node.lower_bound >= self.get_pruning_bound():
+                self.pruned_subproblems += 1
+                continue
+
+            unpruned_children_nodes.append(node)
+            unpruned_children_indices.append(b)
+
+        if children_cost_matrices is not None:
+            children_cost_matrices = children_cost_matrices[
+                unpruned_children_indices]
+
+        # otherwise, if the initial lower bound found using cost reduction
+        # is lower than our known best cost, then solve the Modified Assignment
+        # problem for this subproblem.
+        # The MAPs of all the children that weren't pruned are solved together
+        # in a single batched call, as the siblings only differ from their parent
+        # in a few fixed edges
+        # The obtained optimal MAP solution for a subproblem could result in:
+        #   1. Pruning the subproblem, if the MAP optimal cost which is a lower
+        #      bound on the subproblem, is at least as high as the best cost
+        #      known so far, as then this subtree can't contain the optimal
+        #      solution, or
+        #   2. Finding a new best solution if the MAP optimal solution is CGLSP
+        #      feasible and has lower cost then our current best cost,
+        #      as well as pruning the subproblem, because then the MAP optimal
+        #      solution is the optimal solution for this subproblem and so we
+        #      don't need to explore the subproblem further, or
+        #   3. The need to branch this subproblem further if we can't
+        #      establish a higher lower bound on the subproblem than
+        #      our current best solution
+        with self.metrics.timer("MAP_solve"):
+            solve_MAP_batch(unpruned_children_nodes, children_cost_matrices)
+        self.MAP_solves += len(unpruned_children_nodes)
+
+        # the current subproblem's MAP solution is no longer needed now that its
+        # children have been created and solved
+        cur_node.discard_MAP_solution()
+
+        # process the solved children subproblems
+        for b, node in enumerate(unpruned_children_nodes):
+
+            # Check if there is no feasible solution for the MAP relaxation of the
+            # subproblem. If this is the case then there is no feasible solutions
+            #  for the subproblem at all and therefore the subproblem can be pruned
+            if node.MAP_solve_status == "INFEASIBLE":
+                self.pruned_subproblems += 1
+                continue
+
+            # check if MAP relaxation was solved without an integer overflow issue
+            if node.MAP_solve_status == "POSSIBLE_OVERFLOW":
+                raise PossibleOverflowException(
+                    "MAP Solver couldn't solve MAP relaxation for this subproblem. \
+                                          Failed with a possible integer overflow"
+                )
+
+            # otherwise, if a feasible solution for the MAP relaxation of the
+            # subproblem was found
+            # and if the (new) lower bound found for this subproblem is at least as
+            # high as the cost of the best known solution, then there is not a more
+            # optimal solution in this subtree
+            if node.lower_bound >= self.get_pruning_bound():
+                self.pruned_subproblems += 1
+                continue
 
-                        self.best_cost = node.MAP_min_cost
-                        self.best_solution = node.MAP_solution
+            # otherwise, if the MAP lower bound is lower than the current best
+            # cost (and so is the cost reduction lower bound)
+            # then if:
+            #        1. the MAP found a feasible solution to the CGLSP, then this
+            #           solution is the best known solution so far
+            #           and this solution is the best for this subproblem,
+            #           so we don't need to explore it further
+            #        2. otherwise, the best solution may be in this subset of the
+            #           solution space, in which case we need to use the MAP
+            #           solution to branch this subproblem
+            else:
+                if node.MAP_sol_CGLSP_feasible():
+                    self.optimal_subproblem_solutions_found += 1
+
+                    self.update_best_solution(node.MAP_min_cost, node.MAP_solution)
+
+                else:
+                    # if the MAP solution wasn't feasible then we may need to
+                    # branch this subproblem, unless its lower bound strengthened
+                    # by additive bounding shows it can be pruned
+                    if self.additive_bounds:
+                        with self.metrics.timer("additive_bounding"):
+                            node.get_additive_lower_bound(
+                                self.additive_bounds,
+                                None if children_cost_matrices is None
+                                else children_cost_matrices[b])
 
-                        # remove all subproblems from queue with lower bound above
-                        # the new best cost
-                        self.prune_queue()
+                        if node.lower_bound >= self.get_pruning_bound():
+                            self.pruned_subproblems += 1
+                            continue
 
-                    else:
-                        # if the MAP solution wasn't feasible then we need to
-                        # branch this subproblem
-                        node_priority = node.lower_bound
+                    node_priority = node.lower_bound
+                    with self.metrics.timer("queue_operations"):
                         self.unpruned_nodes.put((node_priority, node))
 
-        # Output fianl solution statistics once the optimal solution has been found
+        return
+
+    def print_progress(self):
+        dashed_line = "-" * 80
+        print(dashed_line)
+        print(f"Solution progress after branching {self.branched_subproblems} times: \n")
+        print("Min cost found so far: ", self.best_cost)
+        print("Explored subproblems: ",
+              self.explored_subproblems)
+        print("Upper bound updates: ",
+              self.optimal_subproblem_solutions_found)
+        print("Pruned subproblems: ",
+              self.pruned_subproblems)
+        print("Branched supbroblems: ",
+              self.branched_subproblems)
+        print("Current subproblems still required to process: ",
+              self.unpruned_nodes.qsize())
+
+    def print_statistics(self):
         dashed_line = "-" * 80
         print(dashed_line)
         print(f"Solution statistics at end of solve: \n")
@@ -225,24 +647,95 @@ class BnB_Tree:
               self.explored_subproblems)
         print("Upper bound updates: ",
               self.optimal_subproblem_solutions_found)
+        print("Upper bound updates by subtour patching: ",
+              self.heuristic_upper_bound_updates)
+        if self.concurrent_heuristic:
+            print("Upper bound updates by the concurrent heuristic: ",
+                  self.concurrent_heuristic_upper_bound_updates)
         print("Pruned subproblems: ",
               self.pruned_subproblems)
         print("Branched supbroblems: ",
               self.branched_subproblems)
         print("Current subproblems still required to process: ",
               self.unpruned_nodes.qsize())
+        if self.arc_elimination:
+            print("Arcs eliminated by their reduced costs: ", self.eliminated_arcs)
+        if self.solve_status != SOLVE_STATUS_OPTIMAL:
+            print("Solve status: ", self.solve_status)
+            print("Lower bound: ", self.lower_bound)
+            print("Optimality gap: ", format(self.optimality_gap, '.4%'))
+        self.metrics.print_phase_times()
+
+    def get_final_solution(self):
+        # the best cost and solution found, with the solution as a tour starting at
+        # the dummy job 0
+
+        # no feasible solution was found, i.e. the CGLSP instance has no feasible
+        # solutions
+        if not self.best_solution:
+            return self.best_cost, self.best_solution
 
         return self.best_cost, self.find_subtours(self.best_solution)[0]
 
-    def branch(self, node):
+    def receive_heuristic_solutions(self):
+        # makes the best of the solutions found by the concurrent heuristic the best
+        # known solution, if it is better than the best known solution
+        for cost, solution in self.heuristic_process.receive_solutions():
+            if cost < self.best_cost:
+                self.concurrent_heuristic_upper_bound_updates += 1
+
+                self.best_cost = cost
+                self.best_solution = solution
+                self.prune_queue()
+                self.metrics.record_event("incumbent", self)
+
+    def update_best_solution(self, cost, solution):
+        # makes a solution that is better than the best known solution the new best
+        # known solution
+        self.best_cost = cost
+        self.best_solution = solution
+
+        # the concurrent heuristic continues to improve the new best solution
+        if self.heuristic_process is not None:
+            self.heuristic_process.send_best_solution(cost, solution)
+
+        # remove all subproblems from queue with lower bound above
+        # the new best cost
+        self.prune_queue()
+
+        self.metrics.record_event("incumbent", self)
+
+    def update_upper_bound_by_patching(self, subtours):
+        # patch the subtours of a subproblem's MAP solution into a tour, and if the
+        # tour is better than the best known solution, make it the best known
+        # solution
+        cost, solution = subtour_patching_heuristic(
+            self.heuristic_costs, subtours, candidates=self.heuristic_candidates)
+
+        if cost < self.best_cost:
+            self.heuristic_upper_bound_updates += 1
+
+            self.update_best_solution(cost, solution)
+
+        return
+
+    def branch(self, node, subtours, subproblem_cost_matrix=None):
         # takes a subproblem that may contain the optimal solution to CGLSP
         # and branches the subproblem based on the subtour of its MAP optimal solution
         # with the least edges in common with the included edges of the subproblem
+        # subtours are the subtours of the subproblem's MAP solution
+        # subproblem_cost_matrix can be passed if it has already been materialized
 
-        # get the list of non included edges of minimal subtour
-        minimal_subtour_non_included_edges = self.minimal_subtour_edges(
-            node.included_edges, node.MAP_solution
-        )
+        # get the list of non included edges of minimal subtour, ordered by the
+        # branching rule
+        if self.branching_rule == BRANCHING_RULE_CARPANETO_TOTH:
+            minimal_subtour_non_included_edges = \
+                self.carpaneto_toth_subtour_edges(node, subtours,
+                                                  subproblem_cost_matrix)
+        else:
+            minimal_subtour_non_included_edges = self.minimal_subtour_edges(
+                node.included_edges, subtours
+            )
 
         # using this minimal subtour branch the subproblem
         num_children_nodes = len(minimal_subtour_non_included_edges)
@@ -259,16 +752,18 @@ class BnB_Tree:
 
             new_included_edges = minimal_subtour_non_included_edges[0:i]
             new_excluded_edge = minimal_subtour_non_included_edges[i: i + 1]
-            child_included_edges = new_included_edges + node.included_edges
-            child_excluded_edges = new_excluded_edge + node.excluded_edges
 
             # create the new child subproblem
+            # the child only stores the edges it fixes in addition to the current
+            # subproblem's fixed edges, which it accesses through its parent
             child_node = Node(
-                cost_matrix=self.root_cost_matrix,
+                cost_matrix=self.MAP_cost_matrix,
                 instance_size=self.instance_size,
-                included_edges=child_included_edges,
-                excluded_edges=child_excluded_edges,
+                included_edges=new_included_edges,
+                excluded_edges=new_excluded_edge,
                 lower_bound=node.lower_bound,
+                parent=node,
+                MAP_solver=self.MAP_solver,
             )
             # append it to the list of child subproblems to be process by the branch
             # and bound algorithm next
@@ -284,15 +779,12 @@ class BnB_Tree:
 
         return children_nodes[::-1]
 
-    def minimal_subtour_edges(self, node_included_edges, node_MAP_sol):
+    def minimal_subtour_edges(self, node_included_edges, subtours):
         # for each subtour in MAP solution, find how many non included edges it has
         # return edges of subtour with minimum number of edges not in the nodes included
         # edges
-        # ideally order the edges according to Carpaneto criteria, but for now we will
-        # just return them in order of the tour as per simplified Laporte version
-
-        # obtain all subtours of the MAP solution
-        subtours = self.find_subtours(node_MAP_sol)
+        # the edges are returned in order of the tour as per simplified Laporte
+        # version (see carpaneto_toth_subtour_edges for the Carpaneto criteria)
 
         # the subtour with the minimum number of non included edges must have less than
         # a full tour of non included edges
@@ -302,20 +794,62 @@ class BnB_Tree:
 
         # iterated through all the subtours and find the subtour with the minimum number
         # of edges not already included in the current subproblem
+        node_included_edges = set(node_included_edges)
         for subtour in subtours:
-            subtour_non_included_edges = set(
-                subtour) - set(node_included_edges)
+            subtour_non_included_edges = [
+                edge for edge in subtour if edge not in node_included_edges]
             num_non_included_edges = len(subtour_non_included_edges)
             # if the current subtour has the least number of non included edges so far
             if num_non_included_edges < min_non_included_edges:
                 # updated the least number of non included edges in a subtour
                 min_non_included_edges = num_non_included_edges
                 # get a list of these non included edges in the minimal subtour
-                minimal_subtour_non_included_edges = list(
-                    subtour_non_included_edges)
+                minimal_subtour_non_included_edges = subtour_non_included_edges
 
         return minimal_subtour_non_included_edges
 
+    def carpaneto_toth_subtour_edges(self, node, subtours,
+                                     subproblem_cost_matrix=None):
+        # the non included edges of the subtour to branch on, chosen and ordered by
+        # the Carpaneto-Toth criteria using the subproblem's reduced costs: of the
+        # subtours with the fewest non included edges (the fewest children), the one
+        # whose edges have the largest total exclusion penalty, i.e. expected
+        # increase of the lower bound when they are excluded, with its edges in
+        # decreasing order of their exclusion penalties
+        # The first children then exclude the edges that are the most expensive to
+        # do without, so they are the most likely to be pruned, and the later
+        # children include these edges, so they are the most likely to contain good
+        # solutions
+        node_included_edges = set(node.included_edges)
+        subtours_non_included_edges = [
+            [edge for edge in subtour if edge not in node_included_edges]
+            for subtour in subtours]
+
+        min_non_included_edges = min(map(len, subtours_non_included_edges))
+        candidate_subtours_edges = [
+            edges for edges in subtours_non_included_edges
+            if len(edges) == min_non_included_edges]
+
+        # the exclusion penalties of the edges of all the candidate subtours,
+        # computed at once
+        penalties = node.get_exclusion_penalties(
+            [edge for edges in candidate_subtours_edges for edge in edges],
+            subproblem_cost_matrix).tolist()
+        subtours_penalties = [
+            penalties[i * min_non_included_edges:(i + 1) * min_non_included_edges]
+            for i in range(len(candidate_subtours_edges))]
+
+        # (the first of the subtours with the largest total penalty)
+        best_subtour = max(range(len(candidate_subtours_edges)),
+                           key=lambda i: sum(subtours_penalties[i]))
+        edges = candidate_subtours_edges[best_subtour]
+        edges_penalties = subtours_penalties[best_subtour]
+
+        # (sorted stably, so edges with equal penalties stay in order of the tour)
+        edge_order = sorted(range(len(edges)), key=lambda i: -edges_penalties[i])
+
+        return [edges[i] for i in edge_order]
+
     def find_subtours(self, node_MAP_sol):
         # find all subtours of the MAP optimal solution
 
@@ -363,26 +897,144 @@ class BnB_Tree:
     def prune_queue(self):
         # remove all subproblems from the unpruned subproblems queue
         # whose lower bound is no better than the best cost found so far
+        with self.metrics.timer("queue_operations"):
+            self.pruned_subproblems += self.unpruned_nodes.prune(
+                self.get_pruning_bound())
 
-        # create a new queue to which we will add all subproblems that can't yet
-        # be pruned
-        new_queue = queue.PriorityQueue()
-
-        # iterate through the queueand insert all subproblems that can't yet be
-        # pruned in the new subproblems queue new_queue. Since the queue is in non
-        # decreasing order of lower bounds, there first x subproblems in the queue
-        # won't yet be pruneable.
-        #  Once you reach the point in the queue where all remaining subproblems have
-        # lower bound higher higher than the best determined cost so far, we can
-        # just delete the original queue
-        while not self.unpruned_nodes.empty():
-            lower_bound, node = self.unpruned_nodes.get()
+        # and the arcs which can no longer be in a better solution
+        self.eliminate_arcs()
 
-            if lower_bound < self.best_cost:
-                new_queue.put((lower_bound, node))
+    def set_arc_lower_bounds(self, root_dual_potentials):
+        # the lower bound on the cost of any tour using each arc, given by the
+        # optimal dual potentials (u, v) of the root MAP: the root MAP lower bound
+        # plus the reduced cost of the arc (inf for the infeasible arcs)
+        # With additive bounding, the root's additive lower bound plus the residual
+        # reduced cost of the arc, which is at least as high
+        if root_dual_potentials is None:
+            return
 
-            else:
-                self.pruned_subproblems += (self.unpruned_nodes.qsize() + 1)
-                break
+        self.root_dual_potentials = root_dual_potentials
+        u, v = root_dual_potentials
+
+        if self.additive_bounds:
+            additive_bound = get_additive_lower_bound(
+                self.root_cost_matrix, u, v, self.additive_bounds)
+            if additive_bound is not None and additive_bound[1] is not None:
+                additive_LB, residual_reduced_costs = additive_bound
+                self.arc_lower_bounds = additive_LB + residual_reduced_costs
+                return
+
+        reduced_costs = self.root_cost_matrix - u[:, np.newaxis] - v[np.newaxis, :]
+        self.arc_lower_bounds = np.where(self.root_cost_matrix != NA,
+                                         u.sum() + v.sum() + reduced_costs, np.inf)
+
+    def eliminate_arcs(self):
+        # removes the arcs whose lower bound is no better than the pruning bound
+        # from the root cost matrix, so that no subproblem's MAP or branching
+        # considers them. The subproblems already created keep valid lower bounds,
+        # their MAPs only get more constrained
+        if self.arc_lower_bounds is None:
+            return
+
+        with self.metrics.timer("arc_elimination"):
+            # (the costs are integers, so the bounds are rounded up, with a
+            # tolerance for the floating point potentials)
+            eliminated = ((np.ceil(self.arc_lower_bounds - 1e-6)
+                           >= self.get_pruning_bound())
+                          & (self.root_cost_matrix != NA))
+            num_eliminated = int(np.count_nonzero(eliminated))
+            if num_eliminated == 0:
+                return
+
+            self.root_cost_matrix[eliminated] = NA
+            self.eliminated_arcs += num_eliminated
+
+            # the nodes share the CSR matrix of a sparse MAP solver, so it's updated
+            # in place
+            if self.MAP_cost_matrix is not self.root_cost_matrix:
+                feasible_edges_CSR = get_feasible_edges_CSR(self.root_cost_matrix)
+                self.MAP_cost_matrix.data = feasible_edges_CSR.data
+                self.MAP_cost_matrix.indices = feasible_edges_CSR.indices
+                self.MAP_cost_matrix.indptr = feasible_edges_CSR.indptr
+
+    def save_checkpoint(self):
+        # writes the state of the search (the unpruned subproblems, the best
+        # solution and the solve statistics) to the checkpoint file
+        write_checkpoint(self.checkpoint_path, self.get_checkpoint_state(),
+                         self.unpruned_nodes.qsize(),
+                         self.unpruned_nodes.compact_subproblems())
+        self.last_checkpoint_time = time.time()
+
+    def get_checkpoint_state(self):
+        state = {
+            "instance_fingerprint": self.instance_fingerprint,
+            "best_cost": self.best_cost,
+            "best_solution": self.best_solution,
+            "root_dual_potentials": self.root_dual_potentials,
+        }
+        for statistic in CHECKPOINT_STATISTICS:
+            state[statistic] = getattr(self, statistic)
+
+        return state
+
+    def resume_from_checkpoint(self):
+        # restores the state of the search saved in the checkpoint file
+        state, compact_subproblems = read_checkpoint(self.checkpoint_path,
+                                                     self.instance_fingerprint)
+
+        self.best_cost = state["best_cost"]
+        self.best_solution = state["best_solution"]
+        for statistic in CHECKPOINT_STATISTICS:
+            setattr(self, statistic, state[statistic])
+
+        # the arcs eliminated before the checkpoint are eliminated again
+        if self.arc_elimination:
+            self.set_arc_lower_bounds(state.get("root_dual_potentials"))
+            self.eliminate_arcs()
+
+        for priority, compact_subproblem in compact_subproblems:
+            self.unpruned_nodes.put((priority, self.restore_node(compact_subproblem)))
+
+        print("Resumed the search from the checkpoint: ", self.checkpoint_path)
+        print("Unpruned subproblems: ", self.unpruned_nodes.qsize())
+
+    def restore_node(self, compact_subproblem):
+        # recreates a Node from a subproblem in compact form, e.g. a subproblem
+        # spilled to disk by the open list
+        return create_node_from_compact_subproblem(
+            compact_subproblem, self.MAP_cost_matrix, self.instance_size,
+            MAP_solver=self.MAP_solver)
+
+
+def get_peak_memory_usage():
+    # utility function
+    # the peak memory usage (resident set size) of the process in MB, ru_maxrss is
+    # in kilobytes on Linux and in bytes on macOS
+    peak_memory_usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_memory_usage /= 1024
+
+    return peak_memory_usage / 1024
+
+
+def get_epsilon_lower_bound(best_cost, epsilon):
+    # utility function
+    # the lowest lower bound a subproblem pruned against best_cost with the
+    # relative optimality tolerance epsilon may have (the costs are integers)
+    if best_cost == np.inf:
+        return np.inf
+
+    return min(best_cost, int(np.ceil(best_cost / (1 + epsilon))))
+
+
+def get_optimality_gap(best_cost, lower_bound):
+    # utility function
+    # the relative gap between the best cost found and the global lower bound,
+    # inf if no solution was found and 0 if the best solution is proven optimal
+    if best_cost == np.inf:
+        return np.inf
+
+    if best_cost == lower_bound:
+        return 0.0
 
-        self.unpruned_nodes = new_queue
+    return (best_cost - lower_bound) / best_cost
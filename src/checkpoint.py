@@ -0,0 +1,86 @@
+"""
+Checkpoints of the branch and bound search, to resume long solves that were
+interrupted
+
+A checkpoint file holds the state of the search needed to continue it without
+redoing the explored subproblems:
+
+- a header with the instance's fingerprint, the best solution found so far and
+  the solve statistics (see BnB_Tree.get_checkpoint_state)
+- the unpruned subproblems, one record per subproblem, each in compact form (its
+  fixed edges, lower bound and MAP solution, see Node.get_compact_subproblem)
+
+The subproblems are streamed to the file one at a time, so no copy of the whole
+search state is built in memory, and the file is written atomically: it is written
+to a temporary file which then replaces the previous checkpoint, so an interrupted
+write never leaves a corrupted checkpoint behind.
+"""
+import hashlib
+import os
+import pickle
+
+
+# version of the checkpoint file format
+CHECKPOINT_VERSION = 2
+
+
+def get_instance_fingerprint(cost_matrix):
+    # hash of the cost matrix of an instance, to check that a checkpoint belongs to
+    # the instance being solved
+    return hashlib.sha256(cost_matrix.tobytes()).hexdigest()
+
+
+def write_checkpoint(path, state, num_subproblems, compact_subproblems):
+    # writes a checkpoint with the header state, and the num_subproblems
+    # (priority, compact subproblem) tuples of the compact_subproblems iterable
+    temporary_path = f"{path}.tmp"
+
+    header = dict(state, version=CHECKPOINT_VERSION,
+                  num_subproblems=num_subproblems)
+
+    with open(temporary_path, "wb") as checkpoint_file:
+        pickle.dump(header, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+        for item in compact_subproblems:
+            pickle.dump(item, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+    os.replace(temporary_path, path)
+
+
+def read_checkpoint(path, instance_fingerprint):
+    # reads the header state of a checkpoint, and returns it along with a generator
+    # of the (priority, compact subproblem) tuples of its unpruned subproblems
+    if not os.path.exists(path):
+        raise CheckpointException(f"There is no checkpoint {path} to resume from")
+
+    checkpoint_file = open(path, "rb")
+
+    try:
+        header = pickle.load(checkpoint_file)
+    except (pickle.UnpicklingError, EOFError) as error:
+        checkpoint_file.close()
+        raise CheckpointException(f"{path} is not a valid checkpoint") from error
+
+    if header.get("version") != CHECKPOINT_VERSION:
+        checkpoint_file.close()
+        raise CheckpointException(
+            f"{path} was written with an unsupported checkpoint format")
+
+    if header["instance_fingerprint"] != instance_fingerprint:
+        checkpoint_file.close()
+        raise CheckpointException(
+            f"{path} is a checkpoint of a different problem instance")
+
+    def read_compact_subproblems():
+        with checkpoint_file:
+            for _ in range(header["num_subproblems"]):
+                yield pickle.load(checkpoint_file)
+
+    return header, read_compact_subproblems()
+
+
+# custom exception class in case a checkpoint can't be used to resume a solve
+class CheckpointException(Exception):
+    pass
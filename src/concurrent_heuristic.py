@@ -0,0 +1,118 @@
+"""
+Improvement heuristic running in a separate process alongside the branch and bound
+
+The heuristic process runs an iterated local search: the best known tour is
+repeatedly perturbed (see heuristics.double_bridge) and improved by local search
+(see heuristics.local_search). The heuristic and the branch and bound exchange
+messages through queues:
+
+- better tours found by the heuristic are sent to the branch and bound, which makes
+  them its best solution and prunes its unpruned subproblems against them
+- the branch and bound sends the heuristic its own new best solutions, which the
+  heuristic continues to improve, and seeds: the included edges of the promising
+  subproblems it branches, from which the heuristic constructs new tours (see
+  heuristics.construct_tour_with_fixed_edges)
+"""
+from src.heuristics import (get_heuristic_costs, get_candidate_lists,
+                            construct_tour, construct_tour_with_fixed_edges,
+                            double_bridge, local_search, solution_to_tour,
+                            tour_cost, tour_to_solution)
+import multiprocessing
+import numpy as np
+import queue
+
+
+class Concurrent_Heuristic:
+    # the branch and bound's side of the concurrent heuristic: starts the heuristic
+    # process and exchanges messages with it
+
+    def __init__(self, root_cost_matrix, initial_solution, seed=None):
+        self.messages_to_heuristic = multiprocessing.Queue()
+        self.solutions_from_heuristic = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+
+        self.process = multiprocessing.Process(
+            target=concurrent_heuristic_worker,
+            args=(root_cost_matrix, initial_solution, self.messages_to_heuristic,
+                  self.solutions_from_heuristic, self.stop_event, seed),
+            daemon=True,
+        )
+        self.process.start()
+
+    def send_best_solution(self, cost, solution):
+        self.messages_to_heuristic.put(("best_solution", cost, solution))
+
+    def send_seed(self, included_edges):
+        self.messages_to_heuristic.put(("seed", included_edges))
+
+    def receive_solutions(self):
+        # the solutions found by the heuristic since the last call, as a list of
+        # (cost, solution) tuples, without waiting for new solutions
+        solutions = []
+        while True:
+            try:
+                solutions.append(self.solutions_from_heuristic.get_nowait())
+            except queue.Empty:
+                return solutions
+
+    def stop(self):
+        self.stop_event.set()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+def concurrent_heuristic_worker(root_cost_matrix, initial_solution,
+                                messages_to_heuristic, solutions_from_heuristic,
+                                stop_event, seed):
+    # the main function of the heuristic process: iterated local search from the
+    # best known tour, until the branch and bound stops it
+    costs = get_heuristic_costs(root_cost_matrix)
+    candidates = get_candidate_lists(costs)
+    rng = np.random.default_rng(seed)
+
+    if initial_solution:
+        best_tour = solution_to_tour(initial_solution)
+    else:
+        best_tour = construct_tour(costs)
+    best_cost = np.inf if best_tour is None else tour_cost(costs, best_tour)
+
+    while not stop_event.is_set():
+
+        # the tours to improve in this iteration: the tours constructed from the
+        # seeds received from the branch and bound, and a perturbation of the best
+        # known tour
+        tours = []
+        while True:
+            try:
+                message = messages_to_heuristic.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "best_solution":
+                _, cost, solution = message
+                if cost < best_cost:
+                    best_cost = cost
+                    best_tour = solution_to_tour(solution)
+
+            elif message[0] == "seed":
+                seed_tour = construct_tour_with_fixed_edges(costs, message[1])
+                if seed_tour is not None:
+                    tours.append(seed_tour)
+
+        if best_tour is not None:
+            tours.append(double_bridge(costs, best_tour, rng))
+
+        if not tours:
+            stop_event.wait(0.01)
+            continue
+
+        for tour in tours:
+            tour = local_search(costs, tour, candidates)
+            cost = tour_cost(costs, tour)
+
+            if cost < best_cost:
+                best_cost = cost
+                best_tour = tour
+                solutions_from_heuristic.put((int(cost), tour_to_solution(tour)))
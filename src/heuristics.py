@@ -0,0 +1,445 @@
+"""
+Heuristics finding feasible solutions (tours) of CGLSP instances, used by the
+branch and bound algorithm to obtain upper bounds on the optimal cost
+
+The heuristics work with tours given as arrays of the vertices (jobs) in the order
+they are visited, and with a float version of the cost matrix in which the
+forbidden edges (NA) have an infinite cost, see get_heuristic_costs, so that a
+move using a forbidden edge can never be an improvement
+"""
+from src.instance_parser import NA
+from scipy import sparse
+import numpy as np
+
+
+def get_heuristic_costs(cost_matrix):
+    # float cost matrix used by the heuristics, with infinite cost for the NA edges
+    # (or the edges missing from a sparse (CSR) cost matrix of the feasible edges)
+    if sparse.issparse(cost_matrix):
+        n = cost_matrix.shape[0]
+        costs = np.full((n, n), np.inf)
+        tails = np.repeat(np.arange(n), np.diff(cost_matrix.indptr))
+        costs[tails, cost_matrix.indices] = cost_matrix.data
+        return costs
+
+    return np.where(cost_matrix == NA, np.inf, cost_matrix).astype(float)
+
+
+def get_candidate_lists(costs, num_candidates=8):
+    """
+    Candidate lists for the local search neighbourhoods: the num_candidates
+    cheapest feasible successors of each vertex, as an (n, num_candidates) array
+
+    The local search only evaluates moves creating an edge from a vertex to one of
+    its candidate successors, which keeps the work per move close to linear in n.
+    Vertices with fewer feasible successors have their candidate list padded with
+    -1.
+    """
+    n = costs.shape[0]
+    num_candidates = min(num_candidates, n - 1)
+
+    successor_costs = costs.copy()
+    np.fill_diagonal(successor_costs, np.inf)
+
+    candidates = np.argsort(successor_costs, axis=1, kind="stable")[:, :num_candidates]
+    candidate_costs = np.take_along_axis(successor_costs, candidates, axis=1)
+
+    return np.where(np.isfinite(candidate_costs), candidates, -1)
+
+
+def rotate(tour, start):
+    # rotates a tour (or any array) so that it starts at position start
+    # (cheaper than np.roll for the small arrays used by the heuristics)
+    return np.concatenate((tour[start:], tour[:start]))
+
+
+def tour_cost(costs, tour):
+    # cost of a tour, given as an array of vertices in the order they are visited
+    return costs[tour, rotate(tour, 1)].sum()
+
+
+def tour_to_solution(tour):
+    # converts a tour into a solution as a list of (job, next job) edges, starting
+    # from the dummy job 0, in the same form as the MAP solutions
+    tour = rotate(tour, int(np.flatnonzero(tour == 0)[0])).tolist()
+    return list(zip(tour, tour[1:] + tour[:1]))
+
+
+def solution_to_tour(solution):
+    # converts a solution, as a list of (job, next job) edges in any order, into the
+    # sequence of jobs visited by the tour, starting from job 0
+    successors = dict(solution)
+    tour = [0]
+    while len(tour) < len(solution):
+        tour.append(successors[tour[-1]])
+    return np.array(tour)
+
+
+def patch_subtours(costs, subtours):
+    """
+    Karp's patching heuristic: merges the subtours of an assignment (MAP solution)
+    into a single tour
+
+    Starting from the largest subtour, the tour is repeatedly patched with the
+    subtour it can be merged with at the lowest cost. Merging subtour B into the
+    tour removes an edge (a, a') of the tour and an edge (b, b') of B, and adds the
+    edges (a, b') and (b, a'). The costs of all the possible patches with a subtour
+    are evaluated at once as a matrix, and only patches using feasible edges are
+    considered.
+
+    subtours is a list of subtours, each a list of (job, next job) edges as
+    returned by BnB_Tree.find_subtours
+    Returns the patched tour, or None if some subtour can't be patched into the
+    tour using feasible edges
+    """
+    # each subtour as an array of its edges, in the order of the subtour
+    cycles = [np.array(subtour) for subtour in subtours]
+    cycles.sort(key=len, reverse=True)
+
+    tour = cycles.pop(0)[:, 0]
+    while cycles:
+        tour_heads = rotate(tour, 1)
+        tour_edge_costs = costs[tour, tour_heads]
+
+        best_patch_cost = np.inf
+        best_patch = None
+        for k, cycle_edges in enumerate(cycles):
+            cycle, cycle_heads = cycle_edges[:, 0], cycle_edges[:, 1]
+
+            # patch_costs[i, j] is the cost of removing the edges
+            # (tour[i], tour[i+1]) and (cycle[j], cycle[j+1]) and adding the edges
+            # (tour[i], cycle[j+1]) and (cycle[j], tour[i+1])
+            patch_costs = (costs[tour[:, None], cycle_heads[None, :]]
+                           + costs[cycle[None, :], tour_heads[:, None]]
+                           - tour_edge_costs[:, None]
+                           - costs[cycle, cycle_heads][None, :])
+
+            i, j = np.unravel_index(patch_costs.argmin(), patch_costs.shape)
+            if patch_costs[i, j] < best_patch_cost:
+                best_patch_cost = patch_costs[i, j]
+                best_patch = (k, i, j)
+
+        if best_patch is None:
+            return None
+
+        k, i, j = best_patch
+        cycle = cycles.pop(k)[:, 0]
+        # the cycle is entered at cycle[j+1] and left from cycle[j]
+        tour = np.concatenate(
+            (tour[:i + 1], rotate(cycle, j + 1), tour[i + 1:]))
+
+    return tour
+
+
+def insertion_tour(costs, start_vertices):
+    """
+    Constructs a tour by insertion, starting from the cycle through start_vertices
+    (two vertices), returns None if the construction gets stuck
+
+    At each step the unvisited vertex with the fewest feasible insertion positions
+    in the tour is inserted, at its cheapest position (ties are broken by the
+    cheapest insertion). Inserting the most constrained vertices first, while the
+    tour is short and has many feasible positions left for the other vertices, is
+    what makes insertion succeed on the CGLSP instances, where most transitions
+    between coils are forbidden and nearest neighbour constructions get stuck.
+    """
+    n = costs.shape[0]
+    tour = np.array(start_vertices)
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[tour] = False
+
+    while unvisited.any():
+        unvisited_vertices = np.flatnonzero(unvisited)
+        tour_heads = rotate(tour, 1)
+
+        # insertion_costs[r, k] is the cost of inserting unvisited vertex r between
+        # tour[k] and tour[k+1]
+        insertion_costs = (costs[tour[None, :], unvisited_vertices[:, None]]
+                           + costs[unvisited_vertices[:, None], tour_heads[None, :]]
+                           - costs[tour, tour_heads][None, :])
+
+        feasible_positions = np.isfinite(insertion_costs).sum(axis=1)
+        if not feasible_positions.any():
+            return None
+
+        # vertices without feasible positions may still be inserted later
+        feasible_positions[feasible_positions == 0] = n * n
+        r = np.lexsort((insertion_costs.min(axis=1), feasible_positions))[0]
+        k = insertion_costs[r].argmin()
+
+        tour = np.concatenate((tour[:k + 1], unvisited_vertices[r:r + 1],
+                               tour[k + 1:]))
+        unvisited[unvisited_vertices[r]] = False
+
+    return tour
+
+
+def construct_tour(costs):
+    # the cheapest insertion tour (see insertion_tour) over all the feasible start
+    # cycles through vertex 0, or None if the insertion gets stuck from all of them
+    best_tour = None
+    best_cost = np.inf
+    for vertex in range(1, costs.shape[0]):
+        if np.isinf(costs[0, vertex] + costs[vertex, 0]):
+            continue
+
+        tour = insertion_tour(costs, [0, vertex])
+        if tour is not None and tour_cost(costs, tour) < best_cost:
+            best_tour = tour
+            best_cost = tour_cost(costs, tour)
+
+    return best_tour
+
+
+def construct_tour_with_fixed_edges(costs, included_edges):
+    # constructs a tour (see construct_tour) which uses the given included edges,
+    # by making all the other edges leaving the tails or entering the heads of the
+    # included edges infeasible
+    fixed_costs = costs.copy()
+    for tail, head in included_edges:
+        head_cost = costs[tail, head]
+        fixed_costs[tail, :] = np.inf
+        fixed_costs[:, head] = np.inf
+        fixed_costs[tail, head] = head_cost
+
+    return construct_tour(fixed_costs)
+
+
+def or_opt(costs, tour, candidates, max_segment_length=3):
+    """
+    Or-opt local search: moves segments of up to max_segment_length consecutive
+    vertices of the tour to a better position in the tour, without reversing them
+    (the costs are asymmetric), until no improving move exists
+
+    A segment is only inserted after one of the candidate predecessors of its first
+    vertex, or before one of the candidate successors of its last vertex (see
+    get_candidate_lists)
+    """
+    n = len(tour)
+    improved = True
+    while improved:
+        improved = False
+        for segment_length in range(1, min(max_segment_length, n - 2) + 1):
+            for i in range(n):
+                # rotate the tour so the segment starts at position 0
+                rotated_tour = rotate(tour, i)
+                segment = rotated_tour[:segment_length]
+                # the rest of the tour, from the segment's successor to its
+                # predecessor
+                rest = rotated_tour[segment_length:]
+                rest_positions = np.full(n, -1)
+                rest_positions[rest] = np.arange(n - segment_length)
+
+                # the insertion positions k, i.e. between rest[k] and rest[k+1],
+                # creating an edge from a candidate predecessor of the segment or to
+                # a candidate successor of the segment
+                candidate_predecessors = np.flatnonzero(
+                    (candidates == segment[0]).any(axis=1))
+                candidate_successors = candidates[segment[-1]]
+                candidate_successors = candidate_successors[candidate_successors >= 0]
+                k = np.concatenate((rest_positions[candidate_predecessors],
+                                    rest_positions[candidate_successors] - 1))
+                k = k[(k >= 0) & (k < n - segment_length - 1)]
+                if k.size == 0:
+                    continue
+
+                removal_gain = (costs[rest[-1], segment[0]]
+                                + costs[segment[-1], rest[0]]
+                                - costs[rest[-1], rest[0]])
+
+                insertion_costs = (costs[rest[k], segment[0]]
+                                   + costs[segment[-1], rest[k + 1]]
+                                   - costs[rest[k], rest[k + 1]])
+
+                best = insertion_costs.argmin()
+                if insertion_costs[best] < removal_gain:
+                    k = k[best]
+                    tour = np.concatenate((rest[:k + 1], segment, rest[k + 1:]))
+                    improved = True
+
+    return tour
+
+
+def segment_insertion(costs, tour, candidates):
+    """
+    3-opt segment insertion local search: exchanges two consecutive segments of the
+    tour, i.e. moves a segment of any length to another position in the tour
+    without reversing it, until no improving move exists
+
+    Rotating the tour to start after vertex x, the tour is x, A, B, C and becomes
+    x, B, A, C, replacing the edges (x, A), (A, B) and (B, C) by the edges
+    (x, B), (B, A) and (A, C). Only the moves in which the first vertex of B is a
+    candidate successor of x are evaluated (see get_candidate_lists), for all the
+    possible lengths of B at once
+    """
+    n = len(tour)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n):
+            # rotate the tour so x is its last vertex
+            rotated_tour = rotate(tour, (i + 1) % n)
+            x = rotated_tour[-1]
+            positions = np.empty(n, dtype=np.int64)
+            positions[rotated_tour] = np.arange(n)
+
+            # B starts at position j, at a candidate successor of x, so that A is
+            # not empty
+            j_candidates = positions[candidates[x][candidates[x] >= 0]]
+            j_candidates = j_candidates[(j_candidates >= 1) & (j_candidates <= n - 2)]
+
+            best_delta = 0
+            best_move = None
+            for j in j_candidates.tolist():
+                # B ends at position k, C starts at position k + 1 (C may be just x)
+                k = np.arange(j, n - 1)
+                deltas = (costs[x, rotated_tour[j]]
+                          + costs[rotated_tour[k], rotated_tour[0]]
+                          + costs[rotated_tour[j - 1], rotated_tour[k + 1]]
+                          - costs[x, rotated_tour[0]]
+                          - costs[rotated_tour[j - 1], rotated_tour[j]]
+                          - costs[rotated_tour[k], rotated_tour[k + 1]])
+
+                best = deltas.argmin()
+                if deltas[best] < best_delta:
+                    best_delta = deltas[best]
+                    best_move = (j, k[best])
+
+            if best_move is not None:
+                j, k = best_move
+                tour = np.concatenate((rotated_tour[j:k + 1], rotated_tour[:j],
+                                       rotated_tour[k + 1:]))
+                improved = True
+
+    return tour
+
+
+def swap(costs, tour, candidates):
+    """
+    Swap local search: exchanges the positions of two vertices of the tour, until
+    no improving move exists
+
+    A vertex x is only swapped with the candidate successors of its predecessor
+    (see get_candidate_lists)
+    """
+    n = len(tour)
+    if n < 4:
+        return tour
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n):
+            positions = np.empty(n, dtype=np.int64)
+            positions[tour] = np.arange(n)
+
+            x = tour[i]
+            x_prev, x_next = tour[i - 1], tour[(i + 1) % n]
+
+            y = candidates[x_prev]
+            y = y[(y >= 0) & (y != x)]
+            if y.size == 0:
+                continue
+
+            y_positions = positions[y]
+            y_prev, y_next = tour[y_positions - 1], tour[(y_positions + 1) % n]
+
+            # x_prev, x, x_next ... y_prev, y, y_next becomes
+            # x_prev, y, x_next ... y_prev, x, y_next
+            deltas = (costs[x_prev, y] + costs[y, x_next]
+                      + costs[y_prev, x] + costs[x, y_next]
+                      - costs[x_prev, x] - costs[x, x_next]
+                      - costs[y_prev, y] - costs[y, y_next])
+
+            # if y directly follows x, x_prev, x, y, y_next becomes
+            # x_prev, y, x, y_next
+            adjacent = y == x_next
+            if adjacent.any():
+                y_next = y_next[adjacent]
+                deltas[adjacent] = (
+                    costs[x_prev, x_next] + costs[x_next, x] + costs[x, y_next]
+                    - costs[x_prev, x] - costs[x, x_next] - costs[x_next, y_next])
+
+            best = deltas.argmin()
+            if deltas[best] < 0:
+                tour = tour.copy()
+                tour[i], tour[y_positions[best]] = y[best], x
+                improved = True
+
+    return tour
+
+
+def local_search(costs, tour, candidates):
+    # improves a tour with the Or-opt, segment insertion and swap neighbourhoods,
+    # until the tour is a local optimum for all of them
+    cost = tour_cost(costs, tour)
+    while True:
+        for neighbourhood in (or_opt, segment_insertion, swap):
+            tour = neighbourhood(costs, tour, candidates)
+
+        new_cost = tour_cost(costs, tour)
+        if new_cost >= cost:
+            return tour
+        cost = new_cost
+
+
+def double_bridge(costs, tour, rng, max_attempts=100):
+    """
+    Double bridge perturbation: the tour A, B, C, D (cut at three random positions)
+    becomes A, C, B, D. The move doesn't reverse any segment, so it suits the
+    asymmetric costs. Returns the perturbed tour, or the tour itself if no
+    perturbation using only feasible edges was found in max_attempts attempts
+    """
+    n = len(tour)
+    if n < 8:
+        return tour
+
+    for _ in range(max_attempts):
+        a, b, c = np.sort(rng.choice(np.arange(1, n), size=3, replace=False))
+        perturbed_tour = np.concatenate((tour[:a], tour[b:c], tour[a:b], tour[c:]))
+        if np.isfinite(tour_cost(costs, perturbed_tour)):
+            return perturbed_tour
+
+    return tour
+
+
+def initial_tour_heuristic(costs, candidates=None):
+    """
+    Heuristic for an initial solution (upper bound) of a CGLSP instance: constructs
+    a tour by insertion from every feasible start cycle (see construct_tour), and
+    improves the best one by local search (see local_search)
+
+    Returns the cost of the tour and the tour as a list of (job, next job) edges,
+    or (np.inf, []) if no tour could be found
+    """
+    tour = construct_tour(costs)
+
+    if tour is None:
+        return np.inf, []
+
+    if candidates is None:
+        candidates = get_candidate_lists(costs)
+
+    tour = local_search(costs, tour, candidates)
+
+    return int(tour_cost(costs, tour)), tour_to_solution(tour)
+
+
+def subtour_patching_heuristic(costs, subtours, candidates=None):
+    """
+    Upper bound heuristic for a subproblem whose MAP solution consists of subtours:
+    patches the subtours into a single tour (see patch_subtours), which is improved
+    by Or-opt local search (see or_opt) if candidate lists are given
+
+    Returns the cost of the tour and the tour as a list of (job, next job) edges,
+    or (np.inf, []) if no tour could be found
+    """
+    tour = patch_subtours(costs, subtours)
+
+    if tour is None:
+        return np.inf, []
+
+    if candidates is not None:
+        tour = or_opt(costs, tour, candidates)
+
+    return int(tour_cost(costs, tour)), tour_to_solution(tour)
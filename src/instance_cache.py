@@ -0,0 +1,99 @@
+"""
+Cache of the parsed problem instances, in a compact binary form
+
+Parsing an instance file (text for the CGLSP instances, TSPLIB for the ATSP
+instances) is done once per distinct file content: the parsed cost matrix is stored
+in the cache directory as a .npy file of the costs of the edges, as int32 (or int64
+if a cost doesn't fit in int32), with the forbidden edges marked by their sentinel
+cost, keyed by a hash of the instance file's content and the kind of instance. A
+changed instance file has a new key, so its cache entry is rebuilt transparently.
+
+The cost matrix of an instance is the cache file memory-mapped read-only, without
+any decoding, so the solver processes reading the same instance (e.g. in a batch,
+a benchmark or a parallel search) share one physical copy of it in the page cache.
+Only the solver's working matrices that are modified (the reduced instance of the
+preprocessing, the root cost matrix of a search) are private int64 copies.
+
+The cache directory is given by the CGLSP_CACHE_DIRECTORY environment variable, by
+default ~/.cache/CGLSP/instances. If the cache can't be written, the instances are
+just parsed on every load.
+"""
+from pathlib import Path
+import hashlib
+import numpy as np
+import os
+import tempfile
+
+
+# version of the cache file format, part of the cache keys so that the entries of
+# another format are never read
+CACHE_VERSION = 2
+
+CACHE_DIRECTORY_VARIABLE = "CGLSP_CACHE_DIRECTORY"
+DEFAULT_CACHE_DIRECTORY = Path.home() / ".cache" / "CGLSP" / "instances"
+
+
+def get_cached_cost_matrix(instance_file_path, instance_kind, parse_instance,
+                           cache_directory=None):
+    # the cost matrix of an instance file, as the read-only memory-mapped cache
+    # file, which is first parsed with parse_instance(instance_file_path) and
+    # added to the cache if it isn't cached yet
+    if cache_directory is None:
+        cache_directory = get_cache_directory()
+
+    key = get_cache_key(instance_file_path, instance_kind)
+    costs_path = Path(cache_directory) / f"{key}.costs.npy"
+
+    if not costs_path.exists():
+        cost_matrix = parse_instance(instance_file_path)
+
+        try:
+            write_cache_entry(cost_matrix, costs_path)
+        except OSError:
+            # e.g. a read only file system, the instance is parsed again next time
+            return cost_matrix
+
+    return np.load(costs_path, mmap_mode="r")
+
+
+def write_cache_entry(cost_matrix, costs_path):
+    # encodes the cost matrix into the compact form and writes its cache file
+    costs = cost_matrix
+    if (costs.min(initial=0) >= np.iinfo(np.int32).min
+            and costs.max(initial=0) <= np.iinfo(np.int32).max):
+        costs = costs.astype(np.int32)
+
+    costs_path.parent.mkdir(parents=True, exist_ok=True)
+    write_array_atomically(costs_path, costs)
+
+
+def write_array_atomically(path, array):
+    # writes the array to a temporary file which then replaces the cache file, so
+    # processes building the same cache entry at the same time, or reading it
+    # while it's written, never see a partially written file
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=path.parent,
+                                                       suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as temporary_file:
+            np.save(temporary_file, array)
+        os.replace(temporary_path, path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def get_cache_key(instance_file_path, instance_kind):
+    # hash of the instance file's content, the kind of instance (which parser
+    # reads it) and the cache format version
+    content_hash = hashlib.sha256()
+    content_hash.update(f"{instance_kind}:{CACHE_VERSION}:".encode())
+    with open(instance_file_path, "rb") as instance_file:
+        for block in iter(lambda: instance_file.read(1 << 20), b""):
+            content_hash.update(block)
+
+    return content_hash.hexdigest()
+
+
+def get_cache_directory():
+    return Path(os.environ.get(CACHE_DIRECTORY_VARIABLE, DEFAULT_CACHE_DIRECTORY))
@@ -1,5 +1,6 @@
 import numpy as np
 import math
+from src.instance_parser import NA
 
 
 def get_random_CGLSP_instances(num_jobs, cost_lower_bound=1, cost_upper_bound=100, forbidden_job_pairs=True):
@@ -14,7 +15,7 @@ def get_random_CGLSP_instances(num_jobs, cost_lower_bound=1, cost_upper_bound=10
 
     for instance_size in instance_sizes:
 
-        cost_matrix_augmented = np.zeros((instance_size + 1, instance_size + 1), dtype=int)
+        cost_matrix_augmented = np.zeros((instance_size + 1, instance_size + 1), dtype=np.int64)
 
         cost_matrix = np.random.randint(cost_lower_bound, cost_upper_bound + 1, size=(instance_size, instance_size))
 
@@ -40,14 +41,11 @@ def get_random_CGLSP_instances(num_jobs, cost_lower_bound=1, cost_upper_bound=10
             row_indices = [edge[0] for edge in edges_to_delete]
             col_indices = [edge[1] for edge in edges_to_delete]
 
-            cost_matrix[row_indices, col_indices] = -1
+            cost_matrix[row_indices, col_indices] = NA
 
         cost_matrix_augmented[1:, 1:,] = cost_matrix
 
-        np.fill_diagonal(cost_matrix_augmented, -1)
-
-        cost_matrix_augmented = cost_matrix_augmented.astype(object)
-        cost_matrix_augmented[cost_matrix_augmented == -1] = "NA"
+        np.fill_diagonal(cost_matrix_augmented, NA)
 
         cost_matrices_augmented.append(cost_matrix_augmented)
 
@@ -1,7 +1,24 @@
+from src.instance_cache import get_cached_cost_matrix
 import numpy as np
+from pathlib import Path
+from scipy import sparse
 
+# cost of an edge that can't be selected, i.e. a pair of coils that can't be
+# sequenced consecutively (as per the CGLSP problem instance files)
+NA = -1
 
-def get_CGLSP_instance_cost_matrix(instance_file_path):
+
+def get_CGLSP_instance_cost_matrix(instance_file_path, use_cache=True):
+    # get the cost matrix of a CGLSP instance, from the parsed instance cache (see
+    # instance_cache.py) unless use_cache is False
+    if use_cache:
+        return get_cached_cost_matrix(instance_file_path, "CGLSP",
+                                      parse_CGLSP_instance)
+
+    return parse_CGLSP_instance(instance_file_path)
+
+
+def parse_CGLSP_instance(instance_file_path):
     # get raw cost matrix from problem instance text file
     cost_matrix_raw = np.loadtxt(
         instance_file_path, dtype=int, delimiter=";")
@@ -12,16 +29,77 @@ def get_CGLSP_instance_cost_matrix(instance_file_path):
     # number of jobs = n
     n = cost_matrix_raw.shape[0]
 
-    cost_matrix_augmented = np.zeros((n + 1, n + 1), dtype=int)
-    cost_matrix_augmented[0, 0] = -1
+    cost_matrix_augmented = np.zeros((n + 1, n + 1), dtype=np.int64)
+    cost_matrix_augmented[0, 0] = NA
 
     # insert cost matrix for real jobs into augmented cost matrix with dummy job
+    # (forbidden edges are already marked with a cost of -1, i.e. NA, in the
+    # problem instance files)
     cost_matrix_augmented[1:, 1:] = cost_matrix_raw
 
-    # replace -1 in cost_matrix with "NA" as per Google_OR_TOOLS AP solver
-    # specification
+    return cost_matrix_augmented
 
-    cost_matrix_augmented = cost_matrix_augmented.astype(object)
-    cost_matrix_augmented[cost_matrix_augmented == -1] = "NA"
 
-    return cost_matrix_augmented
+def get_TSPLIB_instance_cost_matrix(instance_file_path, use_cache=True):
+    # get the cost matrix of a TSPLIB ATSP instance, from the parsed instance cache
+    # (see instance_cache.py) unless use_cache is False
+    if use_cache:
+        return get_cached_cost_matrix(instance_file_path, "TSPLIB",
+                                      parse_TSPLIB_instance)
+
+    return parse_TSPLIB_instance(instance_file_path)
+
+
+def parse_TSPLIB_instance(instance_file_path):
+    # parse a TSPLIB ATSP instance with an explicit full matrix of edge weights
+    # (tsplib95 is only needed for TSPLIB instances)
+    import tsplib95
+
+    problem = tsplib95.load(instance_file_path)
+
+    # the rows of the matrix are wrapped over several lines in the instance files,
+    # so the edge weights are flattened and reshaped into the full matrix
+    n = problem.dimension
+    cost_matrix = np.array(
+        [weight for line in problem.edge_weights for weight in line],
+        dtype=np.int64).reshape(n, n)
+
+    # TSPLIB marks forbidden edges (the diagonal) with a cost of 9999
+    cost_matrix[cost_matrix == 9999] = NA
+
+    return cost_matrix
+
+
+def get_instance_cost_matrix(instance_file_path, use_cache=True):
+    # get the cost matrix of a CGLSP instance (.txt) or a TSPLIB ATSP instance
+    # (.atsp), along with the problem type of the instance
+    if Path(instance_file_path).suffix == ".atsp":
+        return (get_TSPLIB_instance_cost_matrix(instance_file_path, use_cache),
+                "TSPLIB")
+
+    return (get_CGLSP_instance_cost_matrix(instance_file_path, use_cache),
+            "CGLSP")
+
+
+def get_feasible_edges_CSR(cost_matrix):
+    """
+    Convert a cost matrix into a compressed sparse row (CSR) matrix of its feasible
+    (non NA) edges, i.e. an adjacency list of the coils each coil can be directly
+    followed by, along with the costs of those edges.
+
+    The real CGLSP instances are dominated by forbidden edges, so the CSR matrix is
+    much smaller than the dense cost matrix and solvers working on it scale with the
+    number of feasible edges instead of n^2. Edges with a cost of 0 are stored as
+    explicit zeros, so every feasible edge is in the sparse representation.
+    """
+
+    n = cost_matrix.shape[0]
+
+    # np.nonzero returns the edges in row major order, i.e. sorted by row and then
+    # column, as required by the CSR format
+    tails, heads = np.nonzero(cost_matrix != NA)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=n), out=indptr[1:])
+
+    return sparse.csr_matrix(
+        (cost_matrix[tails, heads], heads, indptr), shape=(n, n))
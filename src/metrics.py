@@ -0,0 +1,164 @@
+"""
+Instrumentation of the branch and bound search
+
+Solver_Metrics collects the time spent in each phase of the search (PHASES) and the
+number of times each phase ran, and the trajectory of the best cost (upper bound)
+and of the global lower bound over time. The metrics are reported as events, which
+are passed to a user supplied callback and/or written as JSON lines to a trace
+file:
+
+- "root": the root node was processed (or the search resumed from a checkpoint),
+  and the search is about to branch; not sent if the root node solves the problem
+- "incumbent": a better solution was found
+- "progress": sent every update_frequency branchings
+- "end": the search is over
+
+Each event is a dict with the event type, the time since the start of the solve,
+the best cost and lower bound, the solve statistics of the tree and the phase
+timers. The phase timers nest, e.g. the queue operations of the subtour patching,
+and a phase's time is exclusive: the enclosing phase is paused while a nested phase
+runs, so the phase times add up to at most the time of the solve. When the metrics
+are disabled, the phase timers are a shared no-op context manager, so the
+instrumentation costs next to nothing.
+"""
+import contextlib
+import json
+import time
+
+
+# the timed phases of the search
+PHASES = (
+    "root_node",
+    "subtour_extraction",
+    "subtour_patching",
+    "branching",
+    "subproblem_matrix_construction",
+    "cost_reduction_bound",
+    "MAP_solve",
+    "queue_operations",
+    "arc_elimination",
+    "additive_bounding",
+)
+
+# the solve statistics of the tree included in each event
+EVENT_STATISTICS = (
+    "explored_subproblems",
+    "optimal_subproblem_solutions_found",
+    "heuristic_upper_bound_updates",
+    "pruned_subproblems",
+    "branched_subproblems",
+)
+
+NO_OP_TIMER = contextlib.nullcontext()
+
+
+class Solver_Metrics:
+    def __init__(self, callback=None, trace_path=None, enabled=None,
+                 clock=time.perf_counter):
+        # the metrics are enabled if there is a callback or a trace file to report
+        # them to, unless enabled is given
+        self.callback = callback
+        self.trace_path = trace_path
+        if enabled is None:
+            enabled = callback is not None or trace_path is not None
+        self.enabled = enabled
+
+        self.phase_times = dict.fromkeys(PHASES, 0.0)
+        self.phase_calls = dict.fromkeys(PHASES, 0)
+        # the innermost running phase timer, paused while a nested one runs
+        self.active_timer = None
+        # the (time, best cost, lower bound) points of the bound trajectory
+        self.trajectory = []
+
+        # the clock of the phase timers and events, in seconds
+        self.clock = clock
+        self.start_time = clock()
+        self.trace_file = None
+        if self.enabled and trace_path is not None:
+            self.trace_file = open(trace_path, "w")
+
+    def timer(self, phase):
+        # context manager adding the time spent in its block to the phase's timer
+        if not self.enabled:
+            return NO_OP_TIMER
+
+        return Phase_Timer(self, phase)
+
+    def record_event(self, event, tree):
+        # reports an event with the current state of the search of tree
+        if not self.enabled:
+            return
+
+        elapsed_time = self.clock() - self.start_time
+        best_cost = to_json_number(tree.best_cost)
+        lower_bound = to_json_number(tree.get_lower_bound())
+        self.trajectory.append((elapsed_time, best_cost, lower_bound))
+
+        event_record = {
+            "event": event,
+            "time": elapsed_time,
+            "best_cost": best_cost,
+            "lower_bound": lower_bound,
+            "unpruned_subproblems": tree.unpruned_nodes.qsize(),
+        }
+        for statistic in EVENT_STATISTICS:
+            event_record[statistic] = getattr(tree, statistic)
+        event_record["phase_times"] = dict(self.phase_times)
+        event_record["phase_calls"] = dict(self.phase_calls)
+
+        if self.trace_file is not None:
+            self.trace_file.write(json.dumps(event_record) + "\n")
+
+        if self.callback is not None:
+            self.callback(event_record)
+
+    def print_phase_times(self):
+        if not self.enabled:
+            return
+
+        print("Time spent in each phase of the search (s): ")
+        for phase in PHASES:
+            print(f"  {phase}: ", format(self.phase_times[phase], '.6f'),
+                  f"({self.phase_calls[phase]} calls)")
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+
+class Phase_Timer:
+    __slots__ = ("metrics", "phase", "start_time", "enclosing_timer")
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start_time = self.metrics.clock()
+
+        # the enclosing phase is paused: its time so far is added to its timer
+        self.enclosing_timer = self.metrics.active_timer
+        if self.enclosing_timer is not None:
+            self.metrics.phase_times[self.enclosing_timer.phase] += \
+                self.start_time - self.enclosing_timer.start_time
+        self.metrics.active_timer = self
+
+    def __exit__(self, *exception_info):
+        end_time = self.metrics.clock()
+        self.metrics.phase_times[self.phase] += end_time - self.start_time
+        self.metrics.phase_calls[self.phase] += 1
+
+        # the enclosing phase is resumed
+        if self.enclosing_timer is not None:
+            self.enclosing_timer.start_time = end_time
+        self.metrics.active_timer = self.enclosing_timer
+
+
+def to_json_number(value):
+    # utility function
+    # JSON has no infinity, infinite bounds are reported as None (null)
+    if value == float("inf"):
+        return None
+
+    return int(value) if float(value).is_integer() else float(value)
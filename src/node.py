@@ -1,9 +1,34 @@
-from src.MAP_solver import google_or_AP_solver
+from src.MAP_solver import jv_AP_solver, jv_AP_batch_solver, get_dual_potentials
+from src.instance_parser import NA
+from src.additive_bounds import get_additive_lower_bound
+from src.heuristics import get_heuristic_costs, initial_tour_heuristic
+from scipy import sparse
 import numpy as np
-import time
+
+
+# dtype of the edges stored on the Nodes, as (tail, head) pairs of vertex indices
+EDGE_DTYPE = np.int16
 
 
 class Node:
+    # Nodes are stored compactly, as the branch and bound tree can hold millions of
+    # unexplored Nodes. Each Node only stores the edges it fixes in addition to its
+    # parent's fixed edges (and a pointer to its parent), and its subproblem cost
+    # matrix is only materialized when the subproblem's MAP is solved
+    __slots__ = (
+        "cost_matrix",
+        "instance_size",
+        "parent",
+        "new_included_edges",
+        "new_excluded_edges",
+        "lower_bound",
+        "MAP_solver",
+        "MAP_successors",
+        "MAP_min_cost",
+        "MAP_solve_status",
+        "MAP_solver_state",
+    )
+
     def __init__(
         self,
         cost_matrix,
@@ -11,27 +36,66 @@ class Node:
         included_edges,
         excluded_edges,
         lower_bound,
+        parent=None,
+        MAP_solver=jv_AP_solver,
     ):
+        # included_edges and excluded_edges are the edges this subproblem fixes in
+        # addition to the edges fixed by its parent subproblem
         self.cost_matrix = cost_matrix
         self.instance_size = instance_size
-        self.included_edges = included_edges
-        self.excluded_edges = excluded_edges
-        self.subproblem_cost_matrix = self.create_subproblem_cost_matrix(
-            cost_matrix, included_edges, excluded_edges
-        )
+        self.parent = parent
+        self.new_included_edges = np.array(
+            included_edges, dtype=EDGE_DTYPE).reshape(-1, 2)
+        self.new_excluded_edges = np.array(
+            excluded_edges, dtype=EDGE_DTYPE).reshape(-1, 2)
         self.lower_bound = lower_bound
-        # store creation time of Node - it will be used to break ties on Node
-        # with same priority in the BnB unpruned_nodes queue
-        self.creation_time = time.time()
-
-    # define custom comparison for Nodes based on creation time
-    def __lt__(self, other):
-        # Compare based on creation time (timestamp)
-        return self.creation_time < other.creation_time
+        # the assignment problem solver used to solve the MAP relaxation
+        self.MAP_solver = MAP_solver
+
+        # the MAP solution is stored as the successor of each vertex, i.e. the
+        # assigned column of each row
+        self.MAP_successors = None
+        self.MAP_min_cost = None
+        self.MAP_solve_status = None
+        self.MAP_solver_state = None
+
+    @property
+    def included_edges(self):
+        # all the edges included in this subproblem, i.e. the edges included by this
+        # node and all its ancestors
+        return self.collect_edges("new_included_edges")
+
+    @property
+    def excluded_edges(self):
+        # all the edges excluded in this subproblem, i.e. the edges excluded by this
+        # node and all its ancestors
+        return self.collect_edges("new_excluded_edges")
+
+    def collect_edges(self, edges_attribute):
+        # utility function
+        # walks up the tree from this node to the root collecting the edges stored
+        # in edges_attribute of each node, as a list of (tail, head) tuples
+
+        edges = []
+        node = self
+        while node is not None:
+            edges.extend(map(tuple, getattr(node, edges_attribute).tolist()))
+            node = node.parent
+
+        return edges
+
+    @property
+    def subproblem_cost_matrix(self):
+        # the subproblem cost matrix is materialized from the root cost matrix
+        # each time it is needed, instead of being stored on the node
+        return self.create_subproblem_cost_matrix(
+            self.cost_matrix, self.included_edges, self.excluded_edges
+        )
 
-    def __eq__(self, other):
-        # Compare based on creation time (timestamp)
-        return self.creation_time == other.creation_time
+    @property
+    def MAP_solution(self):
+        # the MAP solution as a list of (job, next job) edges
+        return list(enumerate(self.MAP_successors.tolist()))
 
     def create_subproblem_cost_matrix(
         self, cost_matrix, included_edges, excluded_edges
@@ -45,15 +109,35 @@ class Node:
         selected in the MAP solution for the subproblem, hence achieveing the 
         objective of having only the included edges selected
 
-        All excluded edges simply have their edge cost set to "NA" so that they
+        All excluded edges simply have their edge cost set to NA (-1) so that they
         won't be selected
+
+        If the cost matrix is a sparse (CSR) matrix of the feasible edges, the
+        subproblem cost matrix is also sparse, see
+        create_sparse_subproblem_cost_matrix
         """
+        if sparse.issparse(cost_matrix):
+            return self.create_sparse_subproblem_cost_matrix(
+                cost_matrix, included_edges, excluded_edges)
+
         subproblem_cost_matrix = cost_matrix.copy()
 
+        self.apply_edge_restrictions(
+            subproblem_cost_matrix, included_edges, excluded_edges)
+
+        return subproblem_cost_matrix
+
+    def apply_edge_restrictions(
+        self, subproblem_cost_matrix, included_edges, excluded_edges
+    ):
+        # fixes the included and excluded edges in a (dense) subproblem cost matrix,
+        # in place. Also used to fix just the edges a child subproblem adds to its
+        # parent's subproblem cost matrix
+
         if included_edges:
 
             # for each already included edge (i,j) that is fixed for this subproblem
-            # the subproblem cost matrix assigns "NA"
+            # the subproblem cost matrix assigns NA
             # to to all edges (i,k) k!=j
 
             # get included edge row and col indices in lists for indexing purposes
@@ -63,19 +147,19 @@ class Node:
             ) = self.get_edge_indices(included_edges)
 
             # for each col that an included edge is in, set all values in that
-            # col to "NA", including included edge
+            # col to NA, including included edge
             # we will restore the included edges to their original cost
-            col_mask = np.zeros(cost_matrix.shape[0], dtype=bool)
+            included_edges_costs = subproblem_cost_matrix[
+                included_edges_row_indices, included_edges_col_indices]
+            col_mask = np.zeros(subproblem_cost_matrix.shape[0], dtype=bool)
             col_mask[included_edges_col_indices] = True
-            subproblem_cost_matrix[:, col_mask] = "NA"
+            subproblem_cost_matrix[:, col_mask] = NA
 
             # restore actual cost for included edges
-            included_edges_costs = cost_matrix[included_edges_row_indices,
-                                               included_edges_col_indices]
             subproblem_cost_matrix[included_edges_row_indices,
                                    included_edges_col_indices] = included_edges_costs
 
-        # set the sub_problem_cost_matrix entries for excluded edges to "NA" as
+        # set the sub_problem_cost_matrix entries for excluded edges to NA as
         # they can't be selected for this subproblem
         if excluded_edges:
             (
@@ -85,23 +169,107 @@ class Node:
 
             subproblem_cost_matrix[
                 excluded_edges_row_indices, excluded_edges_col_indices
-            ] = "NA"
+            ] = NA
 
-        return subproblem_cost_matrix
+        return
+
+    def create_sparse_subproblem_cost_matrix(
+        self, cost_matrix, included_edges, excluded_edges
+    ):
+        """
+        Sparse version of create_subproblem_cost_matrix, for a cost matrix in CSR
+        form containing only the feasible edges (see get_feasible_edges_CSR)
+
+        Instead of setting the costs of edges that can't be selected to NA, those
+        edges are dropped from the sparse matrix, i.e. the excluded edges and the
+        edges sharing a column with an included edge (other than the included edge).
+        This takes O(number of feasible edges) time and never densifies the matrix.
+        """
+        n = cost_matrix.shape[0]
+        indptr, heads = cost_matrix.indptr, cost_matrix.indices
+        tails = np.repeat(np.arange(n), np.diff(indptr))
+
+        # identify each edge (i,j) by the key i*n + j
+        edge_keys = tails * n + heads
+        keep_edges = np.ones(heads.size, dtype=bool)
+
+        if included_edges:
+            (
+                included_edges_row_indices,
+                included_edges_col_indices
+            ) = self.get_edge_indices(included_edges)
+            included_edge_keys = (np.array(included_edges_row_indices) * n
+                                  + np.array(included_edges_col_indices))
+
+            keep_edges &= (~np.isin(heads, included_edges_col_indices)
+                           | np.isin(edge_keys, included_edge_keys))
+
+        if excluded_edges:
+            (
+                excluded_edges_row_indices,
+                excluded_edges_col_indices,
+            ) = self.get_edge_indices(excluded_edges)
+            excluded_edge_keys = (np.array(excluded_edges_row_indices) * n
+                                  + np.array(excluded_edges_col_indices))
 
-    def solve_MAP(self):
+            keep_edges &= ~np.isin(edge_keys, excluded_edge_keys)
+
+        subproblem_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails[keep_edges], minlength=n),
+                  out=subproblem_indptr[1:])
+
+        return sparse.csr_matrix(
+            (cost_matrix.data[keep_edges], heads[keep_edges], subproblem_indptr),
+            shape=(n, n))
+
+    def solve_MAP(self, subproblem_cost_matrix=None):
         # Solve the Modified Assignment Problem for this subproblem
 
-        # Use Google OR-Tools AP Solver to find MAP relaxation solution
+        # Use the selected AP Solver to find MAP relaxation solution
         # for this subproblem
-        # The optimal edges determined by the solver will only include
-        # those not already fixed in this subproblem
+        # subproblem_cost_matrix can be passed if it has already been materialized
+        # (e.g. together with its siblings' matrices, see create_sibling_cost_matrices)
+        # If the parent's MAP solver state is available (only the jv solver returns
+        # one), the solver only repairs the rows of the parent's assignment that are
+        # no longer feasible in this subproblem, instead of solving the MAP from
+        # scratch
+        MAP_warm_start = None
+        if self.parent is not None:
+            MAP_warm_start = self.parent.MAP_solver_state
+
+        if subproblem_cost_matrix is None:
+            subproblem_cost_matrix = self.subproblem_cost_matrix
+
+        MAP_result = self.MAP_solver(subproblem_cost_matrix, MAP_warm_start)
+
+        self.update_MAP_solution(MAP_result)
+
+        return
+
+    def update_MAP_solution(self, MAP_result):
+        # store the result of solving the Modified Assignment Problem for this
+        # subproblem, whether solved individually or in a batch with its siblings,
+        # and update the subproblem's lower bound
+
         (
-            self.MAP_solution,
+            MAP_solution,
             self.MAP_min_cost,
             MAP_partial_assignment_costs,
             self.MAP_solve_status,
-        ) = google_or_AP_solver(self.subproblem_cost_matrix)
+            MAP_solver_state,
+        ) = MAP_result
+
+        # store the solution and solver state compactly as small integer arrays
+        if MAP_solution:
+            self.MAP_successors = np.empty(len(MAP_solution), dtype=EDGE_DTYPE)
+            jobs, next_jobs = zip(*MAP_solution)
+            self.MAP_successors[list(jobs)] = next_jobs
+
+        if MAP_solver_state is not None:
+            u, v, col4row = MAP_solver_state
+            self.MAP_solver_state = (
+                compact_potentials(u), compact_potentials(v),
+                col4row.astype(EDGE_DTYPE))
 
         # if the solution status is infeasible, then subproblem doesn't have an
         # MAP feasible solution, so we can prune this node from the branch and bound
@@ -116,7 +284,7 @@ class Node:
         elif self.MAP_solve_status == "POSSIBLE_OVERFLOW":
             return
 
-        # otherwise the Google AP solver found the optimal solution to the MAP
+        # otherwise the AP solver found the optimal solution to the MAP
         # for this subproblem
 
         # if the optimal cost for the MAP for this subproblem which is a
@@ -137,9 +305,7 @@ class Node:
         # MAP solution is feasible for CGLSP if it the edges form one tour, i.e. a
         # hamiltonian circuit has been found otherwise MAP contains subtours
 
-        edge_dict = {}
-        for first_job, second_job in self.MAP_solution:
-            edge_dict[first_job] = second_job
+        edge_dict = self.MAP_successors
 
         # starting at job 0, follow the edges through the graph until you have visited
         # enough jobs to complete a hamiltonian circuit, if no nodes are visited twice
@@ -148,7 +314,7 @@ class Node:
 
         cur_job = 0
         path_length = 0
-        tour_length = len(self.MAP_solution)  # 5
+        tour_length = len(self.MAP_successors)  # 5
         visited_jobs = set()
         while path_length < tour_length:
             next_job = edge_dict[cur_job]
@@ -162,38 +328,166 @@ class Node:
 
         return True
 
-    def get_cost_reduction_lower_bound(self):
+    def discard_MAP_solution(self):
+        # once a subproblem has been branched, its MAP solution and solver state are
+        # no longer needed (its children have been created and solved), so they are
+        # released to keep the nodes kept alive as parents small
+        self.MAP_successors = None
+        self.MAP_solver_state = None
+
+    def get_cost_reduction_lower_bound(self, subproblem_cost_matrix=None):
         # First LB procedure for subproblem using cost matrix reduction
         # if the lower bound obtained using cost matrix reduction
         # is higher than the lower bound inherited from the node's parent
         # then we update the lower bound for this subproblem
 
-        # PLACEHOLDER
-        cost_reduction_LB = -1
+        # The reduction starts from the parent's reduced matrix, i.e. the parent's
+        # MAP dual potentials, which remain feasible for this subproblem as it only
+        # forbids more edges than its parent. Only the rows and columns whose
+        # minimum reduced cost edge was forbidden by this subproblem's new edges
+        # contribute more than the parent's MAP cost to the bound
+        # subproblem_cost_matrix can be passed if it has already been materialized
+        if subproblem_cost_matrix is None:
+            subproblem_cost_matrix = self.subproblem_cost_matrix
 
-        if cost_reduction_LB > self.lower_bound:
-            self.lower_bound = cost_reduction_LB
+        row_potentials, col_potentials = self.get_parent_potentials()
+
+        if sparse.issparse(subproblem_cost_matrix):
+            cost_reduction_LB = sparse_cost_reduction_lower_bound(
+                subproblem_cost_matrix, row_potentials, col_potentials)
+        else:
+            cost_reduction_LB = cost_reduction_lower_bound(
+                subproblem_cost_matrix, row_potentials, col_potentials)
+
+        self.update_lower_bound(cost_reduction_LB)
+
+        return
+
+    def get_parent_potentials(self):
+        # the parent's MAP dual potentials (u, v) as floats, the starting point of
+        # this subproblem's cost reduction. If they are not available (the root node,
+        # or an MAP solver without a solver state) the reduction starts from the
+        # unreduced cost matrix, i.e. zero potentials
+        if self.parent is None or self.parent.MAP_solver_state is None:
+            zero_potentials = np.zeros(self.instance_size)
+            return zero_potentials, zero_potentials
+
+        u, v, _ = self.parent.MAP_solver_state
+        return u.astype(float), v.astype(float)
+
+    def get_exclusion_penalties(self, edges, subproblem_cost_matrix=None):
+        # for each edge (i,j) of this subproblem's MAP solution, the increase of the
+        # MAP lower bound caused by excluding it, as bounded by this subproblem's
+        # reduced costs: row i has to be assigned to another column, and column j to
+        # another row, by two different edges, so the bound increases by at least
+        # the sum of the two smallest alternative reduced costs (inf if row i or
+        # column j has no alternative)
+        # Without a solver state (MAP solvers other than jv) the reduced costs are
+        # the costs, so the penalty is the regret of the edge instead
+        # subproblem_cost_matrix can be passed if it has already been materialized
+        if subproblem_cost_matrix is None:
+            subproblem_cost_matrix = self.subproblem_cost_matrix
+        cost_matrix = get_dense_cost_matrix(subproblem_cost_matrix)
+
+        if self.MAP_solver_state is None:
+            u = v = np.zeros(self.instance_size)
+        else:
+            u, v, _ = self.MAP_solver_state
+            u, v = u.astype(float), v.astype(float)
+
+        reduced_costs = np.where(cost_matrix != NA,
+                                 cost_matrix - u[:, np.newaxis] - v[np.newaxis, :],
+                                 np.inf)
+
+        edge_indices = np.arange(len(edges))
+        tails, heads = self.get_edge_indices(edges)
+        edge_reduced_costs = reduced_costs[tails, heads]
+
+        row_alternatives = reduced_costs[tails]
+        row_alternatives[edge_indices, heads] = np.inf
+        column_alternatives = reduced_costs[:, heads].T
+        column_alternatives[edge_indices, tails] = np.inf
+
+        penalties = (row_alternatives.min(axis=1) + column_alternatives.min(axis=1)
+                     - edge_reduced_costs)
+
+        # an edge eliminated since the MAP was solved (see BnB_Tree.eliminate_arcs)
+        # can't be in any solution of the subproblem, it's given an infinite penalty
+        # so it's excluded first, and the siblings including it are infeasible
+        penalties[~np.isfinite(edge_reduced_costs)] = np.inf
+
+        return penalties
+
+    def get_additive_lower_bound(self, procedures, subproblem_cost_matrix=None):
+        # strengthens this subproblem's MAP lower bound by additive bounding, i.e.
+        # by chaining the bounding procedures on the reduced costs of its MAP (see
+        # additive_bounds.py)
+        # The dual potentials of the MAP are those of its solver state, only the jv
+        # solver returns one, otherwise the MAP is solved again by the jv solver
+        # subproblem_cost_matrix can be passed if it has already been materialized
+        if subproblem_cost_matrix is None:
+            subproblem_cost_matrix = self.subproblem_cost_matrix
+        cost_matrix = get_dense_cost_matrix(subproblem_cost_matrix)
+
+        if self.MAP_solver_state is None:
+            dual_potentials = get_dual_potentials(cost_matrix)
+            if dual_potentials is None:
+                return
+            u, v = dual_potentials
+        else:
+            u, v, _ = self.MAP_solver_state
+            u, v = u.astype(float), v.astype(float)
+
+        additive_bound = get_additive_lower_bound(cost_matrix, u, v, procedures)
+        if additive_bound is None:
+            return
+
+        additive_LB, _ = additive_bound
+        self.update_lower_bound(additive_LB)
 
         return
 
+    def update_lower_bound(self, cost_reduction_LB):
+        # a subproblem with a row or column without any feasible edge has an
+        # infinite lower bound, i.e. it has no feasible solutions
+        # the costs are integers, so a finite bound is stored as an integer
+        if np.isfinite(cost_reduction_LB):
+            cost_reduction_LB = int(cost_reduction_LB)
+
+        if cost_reduction_LB > self.lower_bound:
+            self.lower_bound = cost_reduction_LB
+
     def get_feasible_sol(self):
 
         # heuristic solve to generate feasible sol to subproblem
         # used to generate initial solution for root problem
+        # a tour is constructed by insertion, most constrained job first, from
+        # every feasible start cycle through the dummy job, and the best one is
+        # improved by local search, using only the edges feasible for this
+        # subproblem (see initial_tour_heuristic)
 
-        # PLACEHOLDER heuristic solution using the fact that the sequence of jobs
-        # [0,1,...instance_size-1] is a feasible solution of the CGSLP instances
-        n = self.instance_size
-        solution = [(i, (i+1) % n) for i in range(n)]
-        row_indices, col_indices = self.get_edge_indices(solution)
-        cost = self.cost_matrix[row_indices, col_indices].sum()
-
-        # PLACEHOLDER NO FEASIBLE SOLUTIONS
-        # solution = []
-        # cost = -1
+        # if no feasible solution was found, the cost is infinite and the solution
+        # is empty
+        costs = get_heuristic_costs(self.subproblem_cost_matrix)
+        cost, solution = initial_tour_heuristic(costs)
 
         return cost, solution
 
+    def get_compact_subproblem(self):
+        # the subproblem as a tuple of small arrays and scalars, without the pointer
+        # to its parent, i.e. with all its fixed edges. Used to send (solved but not
+        # yet branched) subproblems to other processes, which recreate them with
+        # create_node_from_compact_subproblem
+        return (
+            np.array(self.included_edges, dtype=EDGE_DTYPE).reshape(-1, 2),
+            np.array(self.excluded_edges, dtype=EDGE_DTYPE).reshape(-1, 2),
+            self.lower_bound,
+            self.MAP_successors,
+            self.MAP_min_cost,
+            self.MAP_solve_status,
+            self.MAP_solver_state,
+        )
+
     def get_edge_indices(self, edge_list):
         # utility function
         # converts list of edges into edge row and col indices suitable for indexing a
@@ -207,3 +501,190 @@ class Node:
             edges_col_indices = [edge[1] for edge in edge_list]
 
         return edges_row_indices, edges_col_indices
+
+
+def get_dense_cost_matrix(cost_matrix):
+    # utility function
+    # the cost matrix itself if it's dense, or the dense version of a sparse (CSR)
+    # cost matrix of the feasible edges, with the missing edges set to NA
+    if not sparse.issparse(cost_matrix):
+        return cost_matrix
+
+    n = cost_matrix.shape[0]
+    dense_cost_matrix = np.full((n, n), NA, dtype=np.int64)
+    tails = np.repeat(np.arange(n), np.diff(cost_matrix.indptr))
+    dense_cost_matrix[tails, cost_matrix.indices] = cost_matrix.data
+
+    return dense_cost_matrix
+
+
+def create_node_from_compact_subproblem(
+    compact_subproblem, cost_matrix, instance_size, MAP_solver=jv_AP_solver
+):
+    # recreates a Node from a subproblem in compact form (see
+    # Node.get_compact_subproblem), as a Node without a parent fixing all the edges
+    # of the subproblem
+    (
+        included_edges,
+        excluded_edges,
+        lower_bound,
+        MAP_successors,
+        MAP_min_cost,
+        MAP_solve_status,
+        MAP_solver_state,
+    ) = compact_subproblem
+
+    node = Node(
+        cost_matrix,
+        instance_size=instance_size,
+        included_edges=included_edges,
+        excluded_edges=excluded_edges,
+        lower_bound=lower_bound,
+        MAP_solver=MAP_solver,
+    )
+    node.MAP_successors = MAP_successors
+    node.MAP_min_cost = MAP_min_cost
+    node.MAP_solve_status = MAP_solve_status
+    node.MAP_solver_state = MAP_solver_state
+
+    return node
+
+
+def compact_potentials(potentials):
+    # utility function
+    # the dual potentials found by the AP solvers are integers (the costs are
+    # integers), so they can be stored in the smallest integer dtype that holds them
+    max_abs_potential = int(np.abs(potentials).max())
+    return potentials.astype(np.min_scalar_type(-max_abs_potential - 1))
+
+
+def cost_reduction_lower_bound(cost_matrices, row_potentials, col_potentials):
+    """
+    Row and column reduction lower bound of a cost matrix, or of a (k, n, n) stack
+    of cost matrices (one bound per matrix), starting from the given dual potentials
+
+    The potentials must be feasible duals of the matrices, i.e. the reduced costs
+    c_ij - u_i - v_j of all the feasible (not NA) edges must be non-negative, as is
+    the case for a parent's MAP potentials and the cost matrices of its children.
+    The reduced matrix is then reduced by its row minimums and afterwards by its
+    column minimums, and the lower bound is the sum of the potentials and all the
+    reductions. A matrix with a row or column without any feasible edge has an
+    infinite lower bound.
+    """
+    feasible_edges = cost_matrices != NA
+    reduced_costs = np.where(
+        feasible_edges,
+        cost_matrices - row_potentials[:, None] - col_potentials[None, :],
+        np.inf)
+
+    row_reductions = reduced_costs.min(axis=-1)
+    # rows without feasible edges already make the bound infinite, don't reduce
+    # them to avoid inf - inf
+    reduced_costs -= np.where(np.isinf(row_reductions), 0, row_reductions)[..., None]
+    col_reductions = reduced_costs.min(axis=-2)
+
+    return (row_potentials.sum() + col_potentials.sum()
+            + row_reductions.sum(axis=-1) + col_reductions.sum(axis=-1))
+
+
+def sparse_cost_reduction_lower_bound(cost_matrix, row_potentials, col_potentials):
+    # sparse version of cost_reduction_lower_bound, for a subproblem cost matrix in
+    # CSR form containing only the feasible edges
+    n = cost_matrix.shape[0]
+    indptr, heads = cost_matrix.indptr, cost_matrix.indices
+    row_lengths = np.diff(indptr)
+
+    if np.any(row_lengths == 0) or np.unique(heads).size < n:
+        return np.inf
+
+    tails = np.repeat(np.arange(n), row_lengths)
+    reduced_costs = (cost_matrix.data - row_potentials[tails]
+                     - col_potentials[heads])
+
+    row_reductions = np.minimum.reduceat(reduced_costs, indptr[:-1])
+    reduced_costs -= row_reductions[tails]
+    col_reductions = np.full(n, np.inf)
+    np.minimum.at(col_reductions, heads, reduced_costs)
+
+    return (row_potentials.sum() + col_potentials.sum()
+            + row_reductions.sum() + col_reductions.sum())
+
+
+def create_sibling_cost_matrices(nodes, parent_cost_matrix=None):
+    """
+    Materialize the subproblem cost matrices of sibling subproblems, i.e. the
+    children of the same parent subproblem, as one (k, n, n) cost tensor.
+
+    The parent's subproblem cost matrix is materialized once (unless it's passed as
+    parent_cost_matrix) and copied into the tensor, in which each sibling only fixes
+    the edges it adds to its parent.
+    Returns None if there are no siblings or the cost matrices are sparse, in which
+    case each subproblem cost matrix is materialized on its own when needed.
+    """
+
+    if not nodes or sparse.issparse(nodes[0].cost_matrix):
+        return None
+
+    if parent_cost_matrix is None:
+        parent_cost_matrix = nodes[0].parent.subproblem_cost_matrix
+    cost_matrices = np.empty((len(nodes),) + parent_cost_matrix.shape,
+                             dtype=parent_cost_matrix.dtype)
+    cost_matrices[:] = parent_cost_matrix
+    for node, cost_matrix in zip(nodes, cost_matrices):
+        node.apply_edge_restrictions(
+            cost_matrix,
+            node.new_included_edges.tolist(),
+            node.new_excluded_edges.tolist(),
+        )
+
+    return cost_matrices
+
+
+def get_cost_reduction_lower_bound_batch(nodes, cost_matrices=None):
+    # cost reduction lower bounds of sibling subproblems, computed for all the
+    # siblings at once on their stacked cost matrices (see
+    # create_sibling_cost_matrices) starting from their parent's potentials
+    if cost_matrices is None:
+        for node in nodes:
+            node.get_cost_reduction_lower_bound()
+        return
+
+    row_potentials, col_potentials = nodes[0].get_parent_potentials()
+    cost_reduction_LBs = cost_reduction_lower_bound(
+        cost_matrices, row_potentials, col_potentials)
+
+    for node, cost_reduction_LB in zip(nodes, cost_reduction_LBs):
+        node.update_lower_bound(cost_reduction_LB)
+
+
+def solve_MAP_batch(nodes, cost_matrices=None):
+    """
+    Solve the Modified Assignment Problems of sibling subproblems, i.e. the children
+    of the same parent subproblem, in a single batched call.
+
+    The siblings are all warm started from their parent's MAP solver state, and
+    their cost matrices are stacked into one (k, n, n) cost tensor (see
+    create_sibling_cost_matrices, the tensor can be passed if it was already
+    materialized), so the solver setup and Python overhead are paid once per
+    branching instead of once per child. Batching requires the jv solver (the only
+    solver that can be warm started), otherwise the siblings' MAPs are solved one
+    at a time.
+    """
+
+    if not nodes:
+        return
+
+    parent = nodes[0].parent
+    if (nodes[0].MAP_solver is not jv_AP_solver or parent is None
+            or parent.MAP_solver_state is None or len(nodes) == 1):
+        for b, node in enumerate(nodes):
+            node.solve_MAP(None if cost_matrices is None else cost_matrices[b])
+        return
+
+    if cost_matrices is None:
+        cost_matrices = create_sibling_cost_matrices(nodes)
+
+    MAP_results = jv_AP_batch_solver(cost_matrices, parent.MAP_solver_state)
+
+    for node, MAP_result in zip(nodes, MAP_results):
+        node.update_MAP_solution(MAP_result)
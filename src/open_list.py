@@ -0,0 +1,273 @@
+"""
+Open list of the branch and bound: the unpruned subproblems waiting to be branched,
+popped in order of their priority (lower bound), ties broken in the order they were
+added
+
+The open list keeps its subproblems in memory in buckets by priority. Pruning
+against a new best cost drops whole buckets, and the subproblems are never compared
+to each other. If the number of subproblems in memory is bounded
+(max_nodes_in_memory), then whenever it grows past the bound, the worst (cold) half
+of the subproblems is spilled to disk:
+
+- the cold subproblems are written, in non decreasing order of priority and in
+  compact form (their fixed edges, lower bound and MAP solution, see
+  Node.get_compact_subproblem), to a new sorted run file
+- the priorities of the run are saved alongside it, and memory-mapped, so that the
+  run can be pruned against a new best cost by binary search without reading it
+- the runs are merged back into memory lazily, as the buckets drain: a subproblem is
+  read back once its priority is better than the best priority in memory
+- the files of a run are only opened while it is read or pruned, so the number of
+  open files doesn't grow with the number of runs
+"""
+import collections
+import heapq
+import numpy as np
+import os
+import pickle
+import shutil
+import tempfile
+
+
+class Open_List:
+    def __init__(self, restore_node, max_nodes_in_memory=None,
+                 spill_directory=None):
+        if max_nodes_in_memory is not None and max_nodes_in_memory < 1:
+            raise ValueError("The maximum number of subproblems in memory must be "
+                             f"at least 1, not {max_nodes_in_memory}")
+
+        # restore_node recreates a Node from a subproblem in compact form
+        self.restore_node = restore_node
+        # the maximum number of subproblems kept in memory, None for no bound
+        self.max_nodes_in_memory = max_nodes_in_memory
+        # the directory in which the directory of the run files is created (the
+        # default temporary directory if None)
+        self.spill_directory = spill_directory
+        self.run_directory = None
+
+        # the subproblems in memory are kept in buckets by priority (the costs,
+        # and so the lower bounds, are integers), each a queue of the subproblems
+        # in the order they were added, and the priorities of the buckets are kept
+        # in a heap. A priority stays in the heap after its bucket is emptied or
+        # pruned, and is skipped when it reaches the top of the heap
+        self.buckets = {}
+        self.priorities = []
+        self.nodes_in_memory = 0
+
+        # heap of the runs, as (next priority, run number, run) tuples
+        self.runs = []
+        self.spilled_nodes = 0
+        self.num_runs = 0
+
+    def put(self, item):
+        priority, node = item
+
+        bucket = self.buckets.get(priority)
+        if bucket is None:
+            bucket = self.buckets[priority] = collections.deque()
+            heapq.heappush(self.priorities, priority)
+        bucket.append(node)
+        self.nodes_in_memory += 1
+
+        if (self.max_nodes_in_memory is not None
+                and self.nodes_in_memory > self.max_nodes_in_memory):
+            self.spill()
+
+    def get(self):
+        # pops the (priority, node) tuple of the subproblem with the best priority,
+        # ties broken in the order the subproblems were added, reading subproblems
+        # back from the runs if their priority is better than the best priority in
+        # memory
+        while self.runs and self.runs[0][0] < self.best_priority():
+            _, run_number, run = heapq.heappop(self.runs)
+
+            priority, compact_subproblem = run.read()
+            self.put((priority, self.restore_node(compact_subproblem)))
+
+            self.push_run(run_number, run)
+
+        priority = self.best_priority()
+        bucket = self.buckets[priority]
+        node = bucket.popleft()
+        self.nodes_in_memory -= 1
+        if not bucket:
+            del self.buckets[priority]
+
+        return priority, node
+
+    def best_priority(self):
+        # the best priority of the subproblems in memory (inf if there are none),
+        # discarding the priorities of the emptied buckets on the way
+        while self.priorities and self.priorities[0] not in self.buckets:
+            heapq.heappop(self.priorities)
+
+        return self.priorities[0] if self.priorities else np.inf
+
+    def min_priority(self):
+        # the best priority of all the subproblems, in memory and on disk (inf if
+        # there are none)
+        if self.runs:
+            return min(self.best_priority(), self.runs[0][0])
+
+        return self.best_priority()
+
+    def empty(self):
+        return self.nodes_in_memory == 0 and not self.runs
+
+    def qsize(self):
+        return self.nodes_in_memory + sum(run.remaining() for _, _, run in self.runs)
+
+    def compact_subproblems(self):
+        # generator of the (priority, compact subproblem) tuples of all the
+        # subproblems, in memory and on disk, e.g. to checkpoint the search
+        for priority, bucket in self.buckets.items():
+            for node in bucket:
+                yield priority, node.get_compact_subproblem()
+
+        for _, _, run in self.runs:
+            yield from run.compact_subproblems()
+
+    def prune(self, best_cost):
+        # removes all subproblems whose priority (lower bound) is no better than
+        # best_cost, and returns the number of removed subproblems
+
+        # whole buckets are dropped, their priorities are discarded lazily by
+        # best_priority
+        num_pruned = 0
+        for priority in [priority for priority in self.buckets
+                         if priority >= best_cost]:
+            num_pruned += len(self.buckets.pop(priority))
+        self.nodes_in_memory -= num_pruned
+
+        # the runs are sorted, so they are cut at the first subproblem which can be
+        # pruned, and the pruned subproblems are never read
+        runs = self.runs
+        self.runs = []
+        for _, run_number, run in runs:
+            num_pruned += run.truncate(best_cost)
+            self.push_run(run_number, run)
+
+        return num_pruned
+
+    def spill(self):
+        # writes the worst half of the subproblems in memory to a new sorted run:
+        # the subproblems of the worst buckets, and the last added subproblems of
+        # the best of the spilled buckets if it is only partially spilled
+        num_spilled_nodes = self.nodes_in_memory - self.max_nodes_in_memory // 2
+
+        cold_items = []
+        for priority in sorted(self.buckets, reverse=True):
+            bucket = self.buckets[priority]
+            num_bucket_nodes = min(len(bucket), num_spilled_nodes - len(cold_items))
+
+            cold_items.extend((priority, bucket.pop())
+                              for _ in range(num_bucket_nodes))
+            if not bucket:
+                del self.buckets[priority]
+
+            if len(cold_items) == num_spilled_nodes:
+                break
+
+        # the spilled subproblems in non decreasing order of priority, and ties in
+        # the order they were added
+        cold_items.reverse()
+        self.nodes_in_memory -= len(cold_items)
+
+        if self.run_directory is None:
+            self.run_directory = tempfile.mkdtemp(prefix="CGLSP_open_list_",
+                                                  dir=self.spill_directory)
+
+        run_path = os.path.join(self.run_directory, f"run_{self.num_runs}")
+        self.push_run(self.num_runs, Spilled_Run(run_path, cold_items))
+        self.num_runs += 1
+        self.spilled_nodes += len(cold_items)
+
+    def push_run(self, run_number, run):
+        # adds a run to the heap of runs, or deletes it if all its subproblems have
+        # been read or pruned
+        if run.remaining() > 0:
+            heapq.heappush(self.runs, (run.next_priority(), run_number, run))
+        else:
+            run.close()
+
+    def close(self):
+        # deletes the run files
+        for _, _, run in self.runs:
+            run.close()
+        self.runs = []
+
+        if self.run_directory is not None:
+            shutil.rmtree(self.run_directory, ignore_errors=True)
+            self.run_directory = None
+
+
+class Spilled_Run:
+    # a sorted run of subproblems spilled to disk: the subproblems in compact form
+    # are stored in the records file, and their priorities in a .npy file,
+    # memory-mapped when the run is pruned
+
+    def __init__(self, path, items):
+        self.records_path = path + ".pkl"
+        self.priorities_path = path + ".npy"
+
+        # the offsets of the records in the records file
+        offsets = []
+        with open(self.records_path, "wb") as records_file:
+            for _, node in items:
+                offsets.append(records_file.tell())
+                pickle.dump(node.get_compact_subproblem(), records_file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        self.offsets = np.array(offsets, dtype=np.int64)
+
+        np.save(self.priorities_path,
+                np.array([priority for priority, _ in items], dtype=np.int64))
+        # the offset of the priorities in the .npy file, after its header
+        self.priorities_offset = self.load_priorities().offset
+
+        # the index of the next subproblem to read, and the index after the last
+        # unpruned subproblem of the run
+        self.position = 0
+        self.end = len(items)
+
+    def remaining(self):
+        return self.end - self.position
+
+    def next_priority(self):
+        return int(np.fromfile(self.priorities_path, dtype=np.int64, count=1,
+                               offset=self.priorities_offset
+                               + self.position * np.dtype(np.int64).itemsize)[0])
+
+    def read(self):
+        priority = self.next_priority()
+        with open(self.records_path, "rb") as records_file:
+            records_file.seek(int(self.offsets[self.position]))
+            compact_subproblem = pickle.load(records_file)
+        self.position += 1
+        return priority, compact_subproblem
+
+    def load_priorities(self):
+        # the priorities of the run, memory-mapped read-only
+        return np.load(self.priorities_path, mmap_mode="r")
+
+    def compact_subproblems(self):
+        # generator of the (priority, compact subproblem) tuples of the subproblems
+        # not yet read or pruned, read without moving the position of the run
+        priorities = self.load_priorities()
+        with open(self.records_path, "rb") as records_file:
+            records_file.seek(int(self.offsets[self.position]))
+            for position in range(self.position, self.end):
+                yield (int(priorities[position]),
+                       pickle.load(records_file))
+
+    def truncate(self, best_cost):
+        # cuts the run at its first subproblem whose priority is no better than
+        # best_cost, and returns the number of subproblems cut
+        end = max(self.position, min(
+            self.end, int(np.searchsorted(self.load_priorities(), best_cost,
+                                          side="left"))))
+        num_cut = self.end - end
+        self.end = end
+        return num_cut
+
+    def close(self):
+        os.remove(self.records_path)
+        os.remove(self.priorities_path)
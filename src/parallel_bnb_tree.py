@@ -0,0 +1,427 @@
+"""
+Parallel (multi-process) branch and bound
+
+The search is started by the main process, which explores the root node and then
+branches the most promising subproblems until there are enough unpruned subproblems
+to keep all the worker processes busy. The unpruned subproblems are then shared
+out between the workers, each of which runs its own best first search (a
+Worker_BnB_Tree) on its share of the subproblems.
+
+- The root cost matrix is placed once in shared memory, and the workers' trees use
+  it directly, without copying it.
+- The best cost (and tour) found by any worker is broadcast through shared memory,
+  and every worker prunes its subproblems against this global best cost.
+- Work stealing: a worker that runs out of subproblems registers a steal request.
+  Busy workers answer the requests by sending some of their best unpruned
+  subproblems (in compact form, see Node.get_compact_subproblem) to the shared work
+  queue.
+- The search is over when all the workers are idle and no subproblems are being
+  sent between them.
+"""
+from src.bnb_tree import (BnB_Tree, SOLVE_STATUS_OPTIMAL,
+                          SOLVE_STATUS_EPSILON_OPTIMAL,
+                          BRANCHING_RULE_CARPANETO_TOTH, get_epsilon_lower_bound,
+                          get_optimality_gap)
+from src.additive_bounds import DEFAULT_ADDITIVE_BOUNDS
+from src.heuristics import solution_to_tour, tour_to_solution
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+import queue
+import traceback
+
+
+# the number of unpruned subproblems per worker the main process creates before
+# starting the workers
+INITIAL_SUBPROBLEMS_PER_WORKER = 4
+
+# the maximum number of subproblems sent to answer a single steal request
+MAX_STOLEN_SUBPROBLEMS = 32
+
+# the solve statistics of the parallel search, summed over the main tree and the
+# workers' trees
+PARALLEL_STATISTICS = (
+    "explored_subproblems",
+    "optimal_subproblem_solutions_found",
+    "heuristic_upper_bound_updates",
+    "pruned_subproblems",
+    "branched_subproblems",
+)
+
+
+class Parallel_BnB_Tree:
+    def __init__(self, root_cost_matrix, instance_size, update_frequency,
+                 num_workers, MAP_solver="jv", subtour_patching=True,
+                 patching_local_search=False, ACO_time_limit=0,
+                 max_nodes_in_memory=None, spill_directory=None, epsilon=0,
+                 arc_elimination=True,
+                 branching_rule=BRANCHING_RULE_CARPANETO_TOTH,
+                 additive_bounds=DEFAULT_ADDITIVE_BOUNDS):
+        self.root_cost_matrix = root_cost_matrix
+        self.instance_size = instance_size
+        self.update_frequency = update_frequency
+        self.num_workers = num_workers
+
+        # the options of the workers' branch and bound trees
+        self.tree_options = {
+            "MAP_solver": MAP_solver,
+            "subtour_patching": subtour_patching,
+            "patching_local_search": patching_local_search,
+            "max_nodes_in_memory": max_nodes_in_memory,
+            "spill_directory": spill_directory,
+            "epsilon": epsilon,
+            "arc_elimination": arc_elimination,
+            "branching_rule": branching_rule,
+            "additive_bounds": additive_bounds,
+        }
+
+        # the tree of the main process, which explores the root node and creates
+        # the initial subproblems of the workers
+        self.main_tree = BnB_Tree(root_cost_matrix, instance_size, update_frequency,
+                                  ACO_time_limit=ACO_time_limit, **self.tree_options)
+
+        self.best_cost = np.inf
+        self.best_solution = []
+        self.explored_subproblems = 0
+        self.optimal_subproblem_solutions_found = 0
+        self.heuristic_upper_bound_updates = 0
+        self.pruned_subproblems = 0
+        self.branched_subproblems = 0
+        self.solve_status = None
+        self.lower_bound = 0
+        self.optimality_gap = np.inf
+
+    def solve(self):
+
+        # Process the root node, which may already solve the CGLSP
+        if self.main_tree.process_root_node():
+            self.add_statistics(vars(self.main_tree))
+            return self.finish_solve(self.main_tree.get_final_solution())
+
+        # branch the most promising subproblems until there are enough unpruned
+        # subproblems for all the workers
+        main_tree = self.main_tree
+        while (0 < main_tree.unpruned_nodes.qsize()
+               < INITIAL_SUBPROBLEMS_PER_WORKER * self.num_workers):
+            cur_node = main_tree.unpruned_nodes.get()[1]
+            main_tree.branched_subproblems += 1
+            main_tree.explore_node(cur_node)
+
+        if main_tree.unpruned_nodes.empty():
+            self.add_statistics(vars(main_tree))
+            return self.finish_solve(main_tree.get_final_solution())
+
+        # share out the unpruned subproblems between the workers, in order of their
+        # lower bounds so that each worker gets some of the most promising ones
+        initial_subproblems = []
+        while not main_tree.unpruned_nodes.empty():
+            node = main_tree.unpruned_nodes.get()[1]
+            initial_subproblems.append(node.get_compact_subproblem())
+        main_tree.unpruned_nodes.close()
+
+        # the workers share the root cost matrix without the arcs eliminated by the
+        # main tree, and eliminate more arcs from it as better solutions are found,
+        # using the dual potentials of the root MAP
+        shared_cost_matrix = create_shared_cost_matrix(main_tree.root_cost_matrix)
+        try:
+            search_state = Shared_Search_State(self.num_workers, self.instance_size)
+            search_state.publish_best_solution(main_tree.best_cost,
+                                               main_tree.best_solution)
+
+            for worker_id in range(self.num_workers):
+                search_state.send_subproblems(
+                    initial_subproblems[worker_id::self.num_workers])
+
+            worker_statistics = self.run_workers(
+                shared_cost_matrix, search_state,
+                dict(self.tree_options,
+                     root_dual_potentials=main_tree.root_dual_potentials))
+
+        finally:
+            shared_cost_matrix.close()
+            shared_cost_matrix.unlink()
+
+        for statistics in [vars(main_tree)] + worker_statistics:
+            self.add_statistics(statistics)
+
+        # Output fianl solution statistics once the optimal solution has been found
+        dashed_line = "-" * 80
+        print(dashed_line)
+        print(f"Solution statistics at end of solve with {self.num_workers} workers: \n")
+        print("Explored subproblems: ",
+              self.explored_subproblems)
+        print("Upper bound updates: ",
+              self.optimal_subproblem_solutions_found)
+        print("Upper bound updates by subtour patching: ",
+              self.heuristic_upper_bound_updates)
+        print("Pruned subproblems: ",
+              self.pruned_subproblems)
+        print("Branched supbroblems: ",
+              self.branched_subproblems)
+
+        return self.finish_solve(search_state.get_best_solution())
+
+    def run_workers(self, shared_cost_matrix, search_state, worker_tree_options):
+        # starts the worker processes and waits for them to finish the search,
+        # returns the statistics of the workers' trees
+        statistics_queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=parallel_bnb_worker,
+                args=(worker_id, shared_cost_matrix.name,
+                      self.main_tree.root_cost_matrix.shape,
+                      self.main_tree.root_cost_matrix.dtype,
+                      self.instance_size, self.update_frequency, worker_tree_options,
+                      search_state, statistics_queue),
+            )
+            for worker_id in range(self.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        worker_statistics = []
+        try:
+            while len(worker_statistics) < self.num_workers:
+                try:
+                    statistics = statistics_queue.get(timeout=1)
+                except queue.Empty:
+                    if any(worker.exitcode not in (None, 0) for worker in workers):
+                        raise ParallelSearchException(
+                            "A branch and bound worker process died")
+                    continue
+
+                if "error" in statistics:
+                    raise ParallelSearchException(
+                        "A branch and bound worker process failed with: \n"
+                        + statistics["error"])
+
+                worker_statistics.append(statistics)
+
+        finally:
+            for worker in workers:
+                if worker.is_alive() and len(worker_statistics) < self.num_workers:
+                    worker.terminate()
+                worker.join()
+
+        return worker_statistics
+
+    def add_statistics(self, statistics):
+        # adds the solve statistics of a tree (a dict of PARALLEL_STATISTICS) to
+        # those of the parallel search
+        for statistic in PARALLEL_STATISTICS:
+            setattr(self, statistic, getattr(self, statistic) + statistics[statistic])
+
+    def finish_solve(self, final_solution):
+        # the parallel search always runs to completion
+        self.best_cost, self.best_solution = final_solution
+        epsilon = self.tree_options["epsilon"]
+        if epsilon == 0:
+            self.solve_status = SOLVE_STATUS_OPTIMAL
+        else:
+            self.solve_status = SOLVE_STATUS_EPSILON_OPTIMAL
+        self.lower_bound = get_epsilon_lower_bound(self.best_cost, epsilon)
+        self.optimality_gap = get_optimality_gap(self.best_cost, self.lower_bound)
+        return self.best_cost, self.best_solution
+
+
+class Shared_Search_State:
+    # the state of the parallel search shared between the worker processes, i.e. the
+    # best solution found, the work queue through which subproblems are sent between
+    # the workers, and the counters used for work stealing and termination
+
+    def __init__(self, num_workers, instance_size):
+        self.num_workers = num_workers
+        self.lock = multiprocessing.Lock()
+
+        # the best cost found by any worker, and its tour (as the sequence of the
+        # jobs visited, starting from job 0)
+        self.best_cost = multiprocessing.Value("d", np.inf, lock=False)
+        self.best_tour = multiprocessing.Array("q", instance_size, lock=False)
+
+        # each item of the work queue is a list of subproblems in compact form
+        self.work_queue = multiprocessing.Queue()
+        self.idle_workers = multiprocessing.Value("q", 0, lock=False)
+        self.steal_requests = multiprocessing.Value("q", 0, lock=False)
+        self.subproblems_in_transit = multiprocessing.Value("q", 0, lock=False)
+
+    def publish_best_solution(self, cost, solution):
+        # broadcast a solution to all the workers, if it is better than the best
+        # solution found so far by any worker
+        if not solution:
+            return
+
+        with self.lock:
+            if cost < self.best_cost.value:
+                self.best_cost.value = cost
+                self.best_tour[:] = solution_to_tour(solution).tolist()
+
+    def get_best_solution(self):
+        with self.lock:
+            if self.best_cost.value == np.inf:
+                return np.inf, []
+
+            return (int(self.best_cost.value),
+                    tour_to_solution(np.array(self.best_tour[:])))
+
+    def send_subproblems(self, compact_subproblems):
+        # used by the main process to send the initial subproblems to the workers,
+        # and by the workers to answer steal requests
+        with self.lock:
+            self.subproblems_in_transit.value += 1
+        self.work_queue.put(compact_subproblems)
+
+    def has_unanswered_steal_requests(self):
+        return self.steal_requests.value > self.subproblems_in_transit.value
+
+    def wait_for_subproblems(self):
+        """
+        Called by a worker that has run out of subproblems: registers a steal request
+        and waits for subproblems to be sent to the work queue
+
+        Returns None when the search is over, i.e. when all the workers are idle and
+        no subproblems are being sent between them, as then no worker can create new
+        subproblems
+        """
+        with self.lock:
+            self.idle_workers.value += 1
+            self.steal_requests.value += 1
+
+        while True:
+            try:
+                compact_subproblems = self.work_queue.get(timeout=0.01)
+            except queue.Empty:
+                with self.lock:
+                    if (self.idle_workers.value == self.num_workers
+                            and self.subproblems_in_transit.value == 0):
+                        return None
+                continue
+
+            with self.lock:
+                self.idle_workers.value -= 1
+                self.steal_requests.value -= 1
+                self.subproblems_in_transit.value -= 1
+
+            return compact_subproblems
+
+
+class Worker_BnB_Tree(BnB_Tree):
+    # the branch and bound tree of a worker process, which prunes its subproblems
+    # against the best cost found by all the workers
+
+    def __init__(self, root_cost_matrix, instance_size, update_frequency,
+                 search_state, **tree_options):
+        super().__init__(root_cost_matrix, instance_size, update_frequency,
+                         **tree_options)
+        self.search_state = search_state
+
+    def get_search_cost_matrix(self, root_cost_matrix):
+        # the workers eliminate arcs from the cost matrix they share, so it isn't
+        # copied
+        return root_cost_matrix
+
+    def update_best_solution(self, cost, solution):
+        # broadcast the new best solution to the other workers
+        self.search_state.publish_best_solution(cost, solution)
+        super().update_best_solution(cost, solution)
+
+    def sync_best_cost(self):
+        # prune against a better solution found by another worker
+        # (the worker doesn't need the solution itself, it is kept by the shared
+        # search state)
+        shared_best_cost = self.search_state.best_cost.value
+        if shared_best_cost < self.best_cost:
+            self.best_cost = shared_best_cost
+            self.prune_queue()
+
+    def share_subproblems(self):
+        # answer a steal request of an idle worker by sending it (up to
+        # MAX_STOLEN_SUBPROBLEMS of) every other one of this worker's best unpruned
+        # subproblems, so both workers keep exploring promising subproblems
+        if not self.search_state.has_unanswered_steal_requests():
+            return
+
+        num_stolen_subproblems = min(self.unpruned_nodes.qsize() // 2,
+                                     MAX_STOLEN_SUBPROBLEMS)
+        if num_stolen_subproblems == 0:
+            return
+
+        stolen_subproblems = []
+        for i in range(2 * num_stolen_subproblems):
+            node_priority, node = self.unpruned_nodes.get()
+            if i % 2 == 0:
+                stolen_subproblems.append(node.get_compact_subproblem())
+            else:
+                self.unpruned_nodes.put((node_priority, node))
+
+        self.search_state.send_subproblems(stolen_subproblems)
+
+    def add_compact_subproblems(self, compact_subproblems):
+        for compact_subproblem in compact_subproblems:
+            node = self.restore_node(compact_subproblem)
+            self.unpruned_nodes.put((node.lower_bound, node))
+
+
+def parallel_bnb_worker(worker_id, shared_cost_matrix_name, shape, dtype,
+                        instance_size, update_frequency, tree_options, search_state,
+                        statistics_queue):
+    # the main function of a worker process: runs a best first search over the
+    # subproblems it gets from the work queue, until the parallel search is over,
+    # and then reports its statistics
+    try:
+        shared_cost_matrix = shared_memory.SharedMemory(name=shared_cost_matrix_name)
+        root_cost_matrix = np.ndarray(shape, dtype=dtype,
+                                      buffer=shared_cost_matrix.buf)
+
+        tree = Worker_BnB_Tree(root_cost_matrix, instance_size, update_frequency,
+                               search_state, **tree_options)
+
+        while True:
+            if tree.unpruned_nodes.empty():
+                compact_subproblems = search_state.wait_for_subproblems()
+                if compact_subproblems is None:
+                    break
+
+                tree.add_compact_subproblems(compact_subproblems)
+
+            tree.sync_best_cost()
+            if tree.unpruned_nodes.empty():
+                continue
+
+            cur_node = tree.unpruned_nodes.get()[1]
+            tree.branched_subproblems += 1
+
+            # only the first worker outputs its progress, to keep the console
+            # readable
+            if worker_id == 0 and tree.branched_subproblems % update_frequency == 0:
+                tree.print_progress()
+
+            tree.explore_node(cur_node)
+
+            tree.share_subproblems()
+
+        tree.unpruned_nodes.close()
+
+        statistics = {statistic: getattr(tree, statistic)
+                      for statistic in PARALLEL_STATISTICS}
+
+    except Exception:
+        statistics = {"error": traceback.format_exc()}
+
+    # the shared memory is unmapped when the worker process exits, and released by
+    # the main process
+    statistics_queue.put(statistics)
+
+
+def create_shared_cost_matrix(cost_matrix):
+    # copies a cost matrix into a new block of shared memory, which the workers can
+    # access without copying it
+    shared_cost_matrix = shared_memory.SharedMemory(create=True,
+                                                    size=cost_matrix.nbytes)
+    np.ndarray(cost_matrix.shape, dtype=cost_matrix.dtype,
+               buffer=shared_cost_matrix.buf)[:] = cost_matrix
+    return shared_cost_matrix
+
+
+# custom exception class in case a worker process of the parallel search fails
+class ParallelSearchException(Exception):
+    pass
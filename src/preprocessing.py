@@ -0,0 +1,220 @@
+"""
+Preprocessing of the cost matrix of an instance before the branch and bound
+
+Two reductions are applied to the cost matrix, each of which keeps at least one
+optimal solution of the instance:
+
+- forced arc contraction: a job with exactly one feasible successor (or
+  predecessor) is always followed (or preceded) by it, so the two jobs are
+  contracted into a single job of the reduced instance, which enters the chain of
+  jobs like its first job and leaves it like its last job. The cost of the forced
+  arc is a fixed cost added to the cost of every solution of the reduced instance.
+  The contraction is repeated until no job has a single feasible successor or
+  predecessor.
+- symmetry breaking of identical jobs: two jobs are identical if swapping them in
+  any tour gives a tour of the same cost, i.e. their rows and columns of the cost
+  matrix are equal, apart from the edges between them, whose costs are equal in
+  both directions (e.g. coils of the same width, thickness and steel grade). The
+  jobs of a group of identical jobs can be visited in any order, so there is an
+  optimal tour visiting them in order of their indices (after the dummy job 0).
+  Such a tour uses no edge between the jobs of the group other than the edges from
+  each job to the next job of the group, so the other edges are forbidden (NA). The
+  subtrees of the branch and bound which only differ by the order of identical
+  jobs are never explored, and the MAP relaxations can't use the (typically zero
+  cost) 2-cycles between identical jobs.
+
+Identical jobs aren't contracted into a single job, as the cost matrices don't
+satisfy the triangle inequality, so there may be no optimal tour visiting them
+consecutively.
+
+The solutions of the reduced instance are expanded back into solutions of the
+original instance by Instance_Reduction.expand_solution.
+"""
+from src.instance_parser import NA
+import numpy as np
+
+
+# the contraction of forced arcs stops once the reduced instance has this many jobs
+MIN_REDUCED_INSTANCE_SIZE = 3
+
+
+class Instance_Reduction:
+    def __init__(self, cost_matrix, contract_forced_arcs=True,
+                 break_symmetries=True):
+        self.original_size = cost_matrix.shape[0]
+
+        # the cost matrix of the reduced instance (an int64 copy, the given cost
+        # matrix may be a read-only memory-mapped instance, see instance_cache.py),
+        # and for each job of the reduced instance, the chain of jobs of the
+        # original instance it stands for
+        self.cost_matrix = np.array(cost_matrix, dtype=np.int64)
+        self.chains = [[job] for job in range(self.original_size)]
+        # the cost of the contracted (forced) arcs, part of the cost of every
+        # solution
+        self.fixed_cost = 0
+
+        self.num_contracted_arcs = 0
+        self.num_identical_job_groups = 0
+        self.num_identical_jobs = 0
+        self.num_forbidden_edges = 0
+
+        if contract_forced_arcs:
+            self.contract_forced_arcs()
+
+        if break_symmetries:
+            self.break_identical_job_symmetries()
+
+            # forbidding edges can leave jobs with a single feasible successor or
+            # predecessor
+            if contract_forced_arcs:
+                self.contract_forced_arcs()
+
+    def contract_forced_arcs(self):
+        while self.cost_matrix.shape[0] > MIN_REDUCED_INSTANCE_SIZE:
+            forced_arc = self.find_forced_arc()
+            if forced_arc is None:
+                return
+
+            self.contract_arc(*forced_arc)
+
+    def find_forced_arc(self):
+        # the first arc which is the only feasible arc out of its tail or into its
+        # head, None if there is none (or if a job has no feasible successor or
+        # predecessor, i.e. the instance is infeasible, which is left to the branch
+        # and bound to prove)
+        feasible_edges = self.cost_matrix != NA
+        np.fill_diagonal(feasible_edges, False)
+
+        out_degrees = feasible_edges.sum(axis=1)
+        in_degrees = feasible_edges.sum(axis=0)
+        if (out_degrees == 0).any() or (in_degrees == 0).any():
+            return None
+
+        tails = np.flatnonzero(out_degrees == 1)
+        if tails.size:
+            tail = int(tails[0])
+            return tail, int(np.flatnonzero(feasible_edges[tail])[0])
+
+        heads = np.flatnonzero(in_degrees == 1)
+        if heads.size:
+            head = int(heads[0])
+            return int(np.flatnonzero(feasible_edges[:, head])[0]), head
+
+        return None
+
+    def contract_arc(self, tail, head):
+        # contracts the arc from tail to head into a single job, which takes the
+        # place of the one of them with the smaller index (so the job standing for
+        # the dummy job 0 stays job 0), entered like tail and left like head
+        self.fixed_cost += int(self.cost_matrix[tail, head])
+        self.num_contracted_arcs += 1
+
+        kept, removed = min(tail, head), max(tail, head)
+
+        cost_matrix = self.cost_matrix
+        contracted_row = cost_matrix[head].copy()
+        contracted_column = cost_matrix[:, tail].copy()
+        cost_matrix[kept] = contracted_row
+        cost_matrix[:, kept] = contracted_column
+        # the arc from head back to tail is a loop of the contracted job
+        cost_matrix[kept, kept] = NA
+
+        self.cost_matrix = np.ascontiguousarray(np.delete(
+            np.delete(cost_matrix, removed, axis=0), removed, axis=1))
+
+        self.chains[kept] = self.chains[tail] + self.chains[head]
+        del self.chains[removed]
+
+    def break_identical_job_symmetries(self):
+        # forbids the edges between identical jobs which aren't from a job to the
+        # next job of its group
+        for group in self.find_identical_job_groups():
+            self.num_identical_job_groups += 1
+            self.num_identical_jobs += len(group)
+
+            for position, job in enumerate(group):
+                for other_position, other_job in enumerate(group):
+                    if (other_position != position + 1 and other_job != job
+                            and self.cost_matrix[job, other_job] != NA):
+                        self.cost_matrix[job, other_job] = NA
+                        self.num_forbidden_edges += 1
+
+    def find_identical_job_groups(self):
+        # the groups (of at least 2 jobs) of identical jobs, each in order of the
+        # job indices. Job 0 is the job the order of the jobs of a group is
+        # relative to, so it's never in a group
+        cost_matrix = self.cost_matrix
+        n = cost_matrix.shape[0]
+
+        group_of_job = {}
+        groups = []
+        for job in range(1, n):
+            if job in group_of_job:
+                continue
+
+            group = [job]
+            group_of_job[job] = group
+            groups.append(group)
+
+            # the candidates have the same row and column as job, apart from the
+            # entries of the edges between them and the diagonal entries
+            row_differences = cost_matrix != cost_matrix[job]
+            column_differences = cost_matrix.T != cost_matrix[:, job]
+            for other_job in range(job + 1, n):
+                if other_job in group_of_job:
+                    continue
+
+                if (cost_matrix[job, other_job] == cost_matrix[other_job, job]
+                        and are_equal_except(row_differences[other_job], job,
+                                             other_job)
+                        and are_equal_except(column_differences[other_job], job,
+                                             other_job)):
+                    group.append(other_job)
+                    group_of_job[other_job] = group
+
+        return [group for group in groups if len(group) > 1]
+
+    def expand_solution(self, solution):
+        # the solution of the original instance, as a list of (job, next job) edges
+        # starting from the dummy job 0, of a solution of the reduced instance
+        if not solution:
+            return solution
+
+        successors = dict(solution)
+        reduced_tour = [0]
+        while len(reduced_tour) < len(solution):
+            reduced_tour.append(successors[reduced_tour[-1]])
+
+        tour = [job for reduced_job in reduced_tour
+                for job in self.chains[reduced_job]]
+        # the job standing for the dummy job 0 starts with it, unless it was
+        # contracted after another job
+        start = tour.index(0)
+        tour = tour[start:] + tour[:start]
+
+        return list(zip(tour, tour[1:] + tour[:1]))
+
+    def expand_cost(self, cost):
+        # the cost of the solutions of the original instance (or a bound on it), of
+        # a cost of the reduced instance
+        return cost + self.fixed_cost
+
+    def print_summary(self):
+        print("Preprocessing: ", self.original_size, "jobs reduced to",
+              self.cost_matrix.shape[0], "jobs")
+        print("Contracted forced arcs: ", self.num_contracted_arcs,
+              "(fixed cost", self.fixed_cost, ")")
+        print("Groups of identical jobs: ", self.num_identical_job_groups,
+              f"({self.num_identical_jobs} jobs, {self.num_forbidden_edges} "
+              "forbidden edges)")
+
+
+def are_equal_except(differences, job, other_job):
+    # utility function
+    # whether a row (or column) of differences has no differences, apart from the
+    # entries of job and other_job
+    num_differences = np.count_nonzero(differences)
+    if num_differences > 2:
+        return False
+
+    return num_differences == (int(differences[job]) + int(differences[other_job]))
@@ -0,0 +1,54 @@
+import time
+from pathlib import Path
+
+from src.bnb_tree import BnB_Tree
+from src.instance_parser import get_CGLSP_instance_cost_matrix
+from src.metrics import Solver_Metrics
+
+CGL_17_PATH = (Path(__file__).resolve().parent.parent
+               / "problem_instances/CGLSP_instances/data/cgl_17.txt")
+
+
+class Manual_Clock:
+    # a clock which only moves when advanced
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+    def advance(self, seconds):
+        self.time += seconds
+
+
+def test_nested_phase_time_is_exclusive():
+    clock = Manual_Clock()
+    metrics = Solver_Metrics(enabled=True, clock=clock)
+
+    with metrics.timer("subtour_patching"):
+        clock.advance(2)
+        with metrics.timer("queue_operations"):
+            clock.advance(5)
+            with metrics.timer("arc_elimination"):
+                clock.advance(3)
+        clock.advance(1)
+
+    assert metrics.phase_times["subtour_patching"] == 3
+    assert metrics.phase_times["queue_operations"] == 5
+    assert metrics.phase_times["arc_elimination"] == 3
+    assert sum(metrics.phase_times.values()) == clock.time
+    assert metrics.phase_calls["queue_operations"] == 1
+    assert metrics.active_timer is None
+
+
+def test_phase_times_sum_to_at_most_the_solve_time():
+    cost_matrix = get_CGLSP_instance_cost_matrix(CGL_17_PATH)
+    bnb_tree = BnB_Tree(cost_matrix, cost_matrix.shape[0], 1000,
+                        collect_metrics=True)
+
+    start_time = time.perf_counter()
+    bnb_tree.solve()
+    elapsed_time = time.perf_counter() - start_time
+
+    assert bnb_tree.best_cost == 4422
+    assert sum(bnb_tree.metrics.phase_times.values()) <= elapsed_time
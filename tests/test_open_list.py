@@ -0,0 +1,36 @@
+import os
+
+from src.open_list import Open_List
+
+
+class Compact_Node:
+    # a stand-in for a Node, which is its own compact form
+    def __init__(self, label):
+        self.label = label
+
+    def get_compact_subproblem(self):
+        return self.label
+
+
+def count_open_files():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_spilled_runs_keep_no_files_open(tmp_path):
+    open_list = Open_List(Compact_Node, max_nodes_in_memory=2,
+                          spill_directory=tmp_path)
+    num_open_files = count_open_files()
+
+    for label in range(200):
+        open_list.put((label % 50, Compact_Node(label)))
+    assert open_list.num_runs > 50
+    assert count_open_files() == num_open_files
+
+    priorities = []
+    while not open_list.empty():
+        priority, _ = open_list.get()
+        priorities.append(priority)
+    open_list.close()
+
+    assert priorities == sorted(label % 50 for label in range(200))
+    assert count_open_files() == num_open_files
@@ -0,0 +1,18 @@
+from pathlib import Path
+
+from src.CGLSP import CGLSP
+
+CGL_17_PATH = (Path(__file__).resolve().parent.parent
+               / "problem_instances/CGLSP_instances/data/cgl_17.txt")
+
+
+def test_parallel_solve_reports_the_main_tree_statistics():
+    # cgl_17 is solved by the main tree while it creates the workers' initial
+    # subproblems, so all the statistics are the main tree's
+    CGLSP_instance = CGLSP(CGL_17_PATH, "CGLSP", 500, num_workers=3,
+                           log_results=False)
+    min_cost, _, _ = CGLSP_instance.solve()
+
+    assert min_cost == 4422
+    assert CGLSP_instance.bnb_tree.explored_subproblems > 0
+    assert CGLSP_instance.get_result()["# Explored Subproblems"] > 0